@@ -0,0 +1,139 @@
+"""Collision-free 64-bit activation ID generation."""
+
+import logging
+import os
+import threading
+import time
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Layout (63 bits, always positive so it fits the protocol's Ulong):
+#   41 bits milliseconds since EPOCH_MS | 10 bits node | 12 bits sequence
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class ActivationIdGenerator:
+    """Thread-safe, monotonic generator of time/node/sequence IDs.
+
+    Each process holds its node for its lifetime through an OS lock on
+    ``<state_file>.<node>.lock``: a configured ``node_id`` that another
+    process already holds is an error, and without one the first free node
+    is claimed. The lock goes away with the process, so a crashed worker's
+    node can be taken over on the next start.
+
+    Restart safety comes from a per-node high-water mark persisted to
+    ``<state_file>.<node>``: the generator reserves ``lease_ms`` of future
+    timestamps at a time and never issues an ID below the mark left by a
+    previous run on that node, so a restart (or the clock stepping
+    backwards) cannot reuse an ID. The file is only written once per lease,
+    not once per ID.
+    """
+
+    def __init__(self, node_id: Optional[int] = None,
+                 state_file: str = 'activation_ids.state', lease_ms: int = 10000):
+        self.state_file = state_file
+        self.lease_ms = lease_ms
+        if node_id is None:
+            self.node_id, self._node_lock = self._claim_free_node()
+        else:
+            if not 0 <= int(node_id) <= MAX_NODE_ID:
+                raise ValueError(f"node_id must be between 0 and {MAX_NODE_ID}: {node_id}")
+            self.node_id = int(node_id)
+            self._node_lock = self._try_lock_node(self.node_id)
+            if self._node_lock is None:
+                raise ValueError(f"Activation ID node {self.node_id} is in use by another process")
+        self.mark_file = f"{state_file}.{self.node_id}"
+        self._lock = threading.Lock()
+        self._sequence = 0
+        # The shared file is the mark of versions that kept a single one
+        self._last_ms = max(self._read_mark(self.mark_file), self._read_mark(state_file))
+        self._reserved_until = self._last_ms
+
+    def next_id(self) -> int:
+        """Return the next activation ID.
+
+        Raises OSError if a new high-water mark is due and cannot be saved;
+        no ID beyond the last saved mark is issued until a save succeeds.
+        """
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock went backwards: keep counting
+                # and borrow the next millisecond when the sequence wraps.
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    self._last_ms += 1
+
+            if self._last_ms >= self._reserved_until:
+                self._reserve(self._last_ms + self.lease_ms)
+
+            return (((self._last_ms - EPOCH_MS) << (NODE_BITS + SEQUENCE_BITS))
+                    | (self.node_id << SEQUENCE_BITS)
+                    | self._sequence)
+
+    def _try_lock_node(self, node_id: int) -> Optional[IO]:
+        """Lock file held for as long as this process owns ``node_id``; None if taken."""
+        f = open(f"{self.state_file}.{node_id}.lock", 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def _claim_free_node(self):
+        """Claim the lowest node no other live process holds."""
+        for node_id in range(MAX_NODE_ID + 1):
+            lock = self._try_lock_node(node_id)
+            if lock is not None:
+                return node_id, lock
+        raise RuntimeError(f"All {MAX_NODE_ID + 1} activation ID nodes are in use")
+
+    @staticmethod
+    def _read_mark(path: str) -> int:
+        """A high-water mark left by a previous run (0 if there is none)."""
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    return int(f.read().strip() or 0)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading activation ID state: {e}")
+        return 0
+
+    def _reserve(self, until_ms: int) -> None:
+        """Persist a new high-water mark before issuing IDs below it."""
+        tmp_file = f"{self.mark_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                f.write(str(until_ms))
+                f.flush()
+                os.fsync(f.fileno())  # On disk before the rename makes it the mark
+            os.replace(tmp_file, self.mark_file)
+        except OSError as e:
+            logger.error(f"Error saving activation ID state: {e}")
+            raise
+        self._reserved_until = until_ms
+
+    def close(self) -> None:
+        """Give up the node (another process may claim it)."""
+        if self._node_lock is not None:
+            self._node_lock.close()
+            self._node_lock = None
@@ -0,0 +1,224 @@
+"""Write-ahead journal of in-flight activations.
+
+Every state change of a live activation is appended as one JSON line. The
+request thread puts the entry on a queue and a writer thread writes
+whatever has accumulated, then flushes and fsyncs once per batch (group
+commit). Callers ``wait`` for the batch holding their entry before they
+answer the hub, so a sale the hub was told about is on disk; concurrent
+requests share one fsync. The wait is bounded by ``commit_timeout``: if
+the disk stalls longer than that the request goes ahead and a warning is
+logged. On restart ``recover`` replays the journal and returns the
+activations that were still open, plus the recently closed ones so a
+repeated FINISH_ACTIVATION is still answered with SUCCESS.
+
+Entries::
+
+    {"op": "open", "activation": {...}}        activation reserved
+    {"op": "update", "id": ..., "fields": {...}}
+    {"op": "close", "id": ..., "status": ...}  reached a terminal state
+    {"op": "close", "id": ..., "status": ..., "activation": {...}}
+                                               closed activation kept by a checkpoint
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OPEN = 'open'
+UPDATE = 'update'
+CLOSE = 'close'
+
+_STOP = object()
+
+
+class _Checkpoint:
+    """Writer-thread instruction: replace the journal with these activations."""
+
+    def __init__(self, activations: List[Dict], closed: List[Dict]):
+        self.activations = activations
+        self.closed = closed
+
+
+class ActivationJournal:
+    """Append-only activation journal with group commit."""
+
+    def __init__(self, path: str = 'activation_journal.log', fsync: bool = True,
+                 batch_size: int = 512, checkpoint_every: int = 10000, commit_timeout: float = 5.0):
+        self.path = path
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every  # entries written before a checkpoint is due
+        self.commit_timeout = commit_timeout  # longest a caller waits for its batch
+        self.entries = 0  # entries written since the last checkpoint
+        self.commits = 0  # fsync'd batches
+        self._entries_lock = threading.Lock()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._queued = 0  # Items put on the queue
+        self._done = 0  # Items the writer has committed (queue order)
+        self._progress = threading.Condition()
+        self._file = None
+        self._writer: Optional[threading.Thread] = None
+
+    def recover(self) -> Tuple[List[Dict], List[Dict]]:
+        """Replay the journal.
+
+        Returns (activations open when it was last written, closed
+        activations oldest first).
+        """
+        live: Dict[int, Dict] = {}
+        closed: 'OrderedDict[int, Dict]' = OrderedDict()
+        if not os.path.exists(self.path):
+            return [], []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be torn by a crash mid-write
+                    logger.warning(f"Skipping unreadable journal line {number}")
+                    continue
+                op = entry.get('op')
+                if op == OPEN:
+                    activation = entry['activation']
+                    live[activation['activation_id']] = activation
+                elif op == UPDATE and entry.get('id') in live:
+                    live[entry['id']].update(entry.get('fields') or {})
+                elif op == CLOSE:
+                    activation = live.pop(entry.get('id'), None) or entry.get('activation')
+                    if activation is not None:
+                        activation['status'] = entry.get('status', activation.get('status'))
+                        closed.pop(entry.get('id'), None)
+                        closed[entry.get('id')] = activation
+        return list(live.values()), list(closed.values())
+
+    def start(self) -> None:
+        """Open the journal for appending and start the writer thread."""
+        if self._writer is not None:
+            return
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._writer = threading.Thread(target=self._write_loop, name='activation-journal', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _put(self, item) -> int:
+        """Queue ``item``; returns the ticket to ``wait`` on."""
+        with self._progress:
+            self._queue.put(item)
+            self._queued += 1
+            return self._queued
+
+    def opened(self, activation: Dict) -> int:
+        return self._put({'op': OPEN, 'activation': dict(activation)})  # Copy: the writer serialises it later
+
+    def updated(self, activation_id: int, **fields) -> int:
+        return self._put({'op': UPDATE, 'id': activation_id, 'fields': fields})
+
+    def closed(self, activation_id: int, status: str) -> int:
+        return self._put({'op': CLOSE, 'id': activation_id, 'status': status})
+
+    def wait(self, ticket: int) -> bool:
+        """Block until the entry behind ``ticket`` is committed; False on timeout."""
+        with self._progress:
+            if self._writer is None:
+                return False  # Not started yet: nothing is being written
+            if self._progress.wait_for(lambda: self._done >= ticket or not self._writer.is_alive(),
+                                       self.commit_timeout) and self._done >= ticket:
+                return True
+        logger.warning(f"Activation journal entry not committed within {self.commit_timeout}s")
+        return False
+
+    def checkpoint(self, activations: Iterable[Dict], closed: Iterable[Dict] = ()) -> None:
+        """Rewrite the journal as these open activations and these closed ones.
+
+        The caller must hold the lock that orders its journal calls, so no
+        change made after the snapshot can be queued ahead of it.
+        """
+        self._put(_Checkpoint([dict(activation) for activation in activations],
+                              [dict(activation) for activation in closed]))
+        with self._entries_lock:
+            self.entries = 0
+
+    @property
+    def checkpoint_due(self) -> bool:
+        return self.entries >= self.checkpoint_every
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            lines = []
+            for item in batch:
+                if item is _STOP:
+                    self._commit(lines)
+                    self._file.close()
+                    self._advance(len(batch))
+                    return
+                if isinstance(item, _Checkpoint):
+                    self._commit(lines)
+                    lines = []
+                    self._rewrite(item.activations, item.closed)
+                    continue
+                lines.append(json.dumps(item, separators=(',', ':'), default=str))
+            self._commit(lines)
+            self._advance(len(batch))
+
+    def _advance(self, count: int) -> None:
+        """Release callers waiting on the batch just committed."""
+        with self._progress:
+            self._done += count
+            self._progress.notify_all()
+
+    def _commit(self, lines: List[str]) -> None:
+        """Write one batch and make it durable with a single fsync."""
+        if not lines:
+            return
+        try:
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            with self._entries_lock:
+                self.entries += len(lines)
+            self.commits += 1
+        except OSError as e:
+            logger.error(f"Error writing activation journal: {e}")
+
+    def _rewrite(self, activations: List[Dict], closed: List[Dict]) -> None:
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for activation in closed:
+                    f.write(json.dumps({'op': CLOSE, 'id': activation['activation_id'],
+                                        'status': activation['status'], 'activation': activation},
+                                       separators=(',', ':'), default=str) + '\n')
+                for activation in activations:
+                    f.write(json.dumps({'op': OPEN, 'activation': activation},
+                                       separators=(',', ':'), default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error checkpointing activation journal: {e}")
+        finally:
+            if self._file.closed:
+                self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Commit queued entries and stop the writer thread."""
+        if self._writer is None or not self._writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
@@ -0,0 +1,119 @@
+"""Activation state machine and lease expiry timer."""
+
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Activation states
+RESERVED = 'reserved'
+SMS_RECEIVED = 'sms_received'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+REFUNDED = 'refunded'
+EXPIRED = 'expired'
+
+LIVE_STATES = (RESERVED, SMS_RECEIVED)
+TERMINAL_STATES = (FINISHED, CANCELLED, REFUNDED, EXPIRED)
+
+# FINISH_ACTIVATION status (protocol appendix 4) -> terminal state
+FINISH_STATUS_STATES = {
+    1: FINISHED,   # Do not provide this number for the service again
+    3: FINISHED,   # Successfully sold
+    4: CANCELLED,  # Cancelled, number may be offered again
+    5: REFUNDED,   # Refunded to the user
+}
+
+# Transitions allowed out of each state. The hub owns the activation, so a
+# late FINISH_ACTIVATION may still close an activation we already expired.
+TRANSITIONS = {
+    RESERVED: (SMS_RECEIVED, FINISHED, CANCELLED, REFUNDED, EXPIRED),
+    SMS_RECEIVED: (FINISHED, CANCELLED, REFUNDED, EXPIRED),
+    EXPIRED: (FINISHED, CANCELLED, REFUNDED),
+    FINISHED: (REFUNDED,),
+    CANCELLED: (),
+    REFUNDED: (),
+}
+
+
+def can_transition(current: str, new: str) -> bool:
+    """Check whether an activation may move from ``current`` to ``new``."""
+    return new in TRANSITIONS.get(current, ())
+
+
+class LeaseTimer:
+    """Min-heap of lease deadlines served by one background thread.
+
+    Cancelling is O(1): the deadline is dropped from an index and the stale
+    heap entry is skipped when it surfaces. Keys are activation ids here,
+    but any hashable, mutually comparable key works.
+    """
+
+    def __init__(self, on_expire: Callable[[Hashable], None], name: str = 'lease-timer'):
+        self.on_expire = on_expire
+        self.name = name
+        self._heap: List[Tuple[float, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = {}
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the expiry thread."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the expiry thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    def schedule(self, activation_id: Hashable, deadline: float) -> None:
+        """Arm (or re-arm) the lease for an activation at ``deadline`` (epoch seconds)."""
+        with self._cond:
+            self._deadlines[activation_id] = deadline
+            heapq.heappush(self._heap, (deadline, activation_id))
+            if self._heap[0][1] == activation_id:
+                self._cond.notify()
+
+    def cancel(self, activation_id: Hashable) -> None:
+        """Disarm the lease for an activation."""
+        with self._cond:
+            self._deadlines.pop(activation_id, None)
+
+    def pending(self) -> int:
+        """Number of armed leases."""
+        return len(self._deadlines)
+
+    def _run(self):
+        while True:
+            expired = []
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, activation_id = heapq.heappop(self._heap)
+                    if self._deadlines.get(activation_id) == deadline:
+                        del self._deadlines[activation_id]
+                        expired.append(activation_id)
+                if not expired:
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._cond.wait(timeout)
+                    continue
+
+            for activation_id in expired:
+                try:
+                    self.on_expire(activation_id)
+                except Exception as e:
+                    logger.error(f"Error expiring {activation_id} ({self.name}): {e}")
@@ -5,8 +5,6 @@ import os
 from datetime import datetime
 from typing import Dict, Any, List
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ActivationLogger:
@@ -1,141 +1,214 @@
 import logging
 import json
 import os
+import queue
+import random
+import threading
+import time
+import atexit
 from datetime import datetime
-from typing import Dict, Any, Optional
+from itertools import count
+from typing import Dict, Any, Optional, List
 from flask import Request, Response
 
+logger = logging.getLogger(__name__)
+
+_UNSET = object()  # Sentinel: body not supplied by the caller
+
+
 class APILogger:
-    def __init__(self, log_dir: str = 'logs/api'):
+    """Non-blocking API request/response logger.
+
+    The request thread only builds a small record and puts it on a bounded
+    queue; a writer thread serialises records as compact JSON lines and
+    writes them in batches. If the queue is full (e.g. the disk stalls)
+    records are dropped and counted instead of slowing down the request.
+    """
+
+    def __init__(self, log_dir: str = 'logs/api', sample_rates: Optional[Dict[str, float]] = None,
+                 queue_size: int = 10000, batch_size: int = 256, flush_interval: float = 0.5):
         self.log_dir = log_dir
-        
+        self.sample_rates = sample_rates or {}  # action -> fraction of requests to log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+
         # Ensure log directory exists
         os.makedirs(log_dir, exist_ok=True)
-        
-        # Set up logging
-        self.logger = logging.getLogger(__name__)
-        
-        # Create a new log file for each day
+
         self.current_date = datetime.now().strftime('%Y-%m-%d')
-        self.log_file = os.path.join(log_dir, f'api_requests_{self.current_date}.log')
-        
-        # Set up file handler
-        file_handler = logging.FileHandler(self.log_file)
-        file_handler.setFormatter(
-            logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        )
-        self.logger.addHandler(file_handler)
-        self.logger.setLevel(logging.INFO)
-
-    def _rotate_log_file_if_needed(self):
-        """Check and rotate log file if date has changed."""
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        if current_date != self.current_date:
-            self.current_date = current_date
-            self.log_file = os.path.join(self.log_dir, f'api_requests_{self.current_date}.log')
-            
-            # Update file handler
-            for handler in self.logger.handlers[:]:
-                if isinstance(handler, logging.FileHandler):
-                    self.logger.removeHandler(handler)
-            
-            new_handler = logging.FileHandler(self.log_file)
-            new_handler.setFormatter(
-                logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            )
-            self.logger.addHandler(new_handler)
+        self.log_file = self._log_file_for(self.current_date)
+
+        self._ids = count(1)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='api-log-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _log_file_for(self, date: str) -> str:
+        return os.path.join(self.log_dir, f'api_requests_{date}.jsonl')
 
     def _sanitize_headers(self, headers: Dict) -> Dict:
         """Remove sensitive information from headers."""
         sanitized = dict(headers)
         sensitive_keys = ['authorization', 'cookie', 'api-key']
-        
-        for key in sensitive_keys:
-            if key.lower() in sanitized:
-                sanitized[key.lower()] = '[REDACTED]'
-        
+
+        for key in list(sanitized):
+            if key.lower() in sensitive_keys:
+                sanitized[key] = '[REDACTED]'
+
         return sanitized
 
-    def log_request(self, request: Request, include_headers: bool = True) -> Dict[str, Any]:
-        """Log incoming API request details."""
-        self._rotate_log_file_if_needed()
-        
+    def _sampled_out(self, action: Optional[str]) -> bool:
+        rate = self.sample_rates.get(action)
+        return rate is not None and random.random() >= rate
+
+    def _enqueue(self, record: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def log_request(self, request: Request, include_headers: bool = True, body: Any = _UNSET) -> Dict[str, Any]:
+        """Queue a record of an incoming API request.
+
+        Pass ``body`` when the caller has already decoded the request so it
+        is not parsed again. Returns the record; pass it to log_response so
+        the response is linked to the request by id. Records skipped by
+        sampling carry ``logged: False``.
+        """
         try:
-            # Extract request data
             request_data = {
-                'timestamp': datetime.now().isoformat(),
+                'type': 'request',
+                'id': next(self._ids),
+                'timestamp': time.time(),
                 'method': request.method,
                 'url': request.url,
                 'remote_addr': request.remote_addr,
                 'path': request.path,
             }
-            
-            if include_headers:
-                request_data['headers'] = self._sanitize_headers(dict(request.headers))
-            
+
             # Try to get JSON body if present
             try:
-                if request.is_json:
-                    request_data['body'] = request.get_json()
+                if body is not _UNSET:
+                    if body is not None:
+                        request_data['body'] = body
+                    elif request.data:
+                        request_data['body'] = request.get_data(as_text=True)
+                elif request.is_json:
+                    request_data['body'] = request.get_json(silent=True)
                 elif request.form:
                     request_data['body'] = dict(request.form)
                 elif request.data:
                     request_data['body'] = request.data.decode('utf-8')
             except Exception as e:
                 request_data['body'] = f'[Error parsing body: {str(e)}]'
-            
-            # Log the request
-            self.logger.info(f"Incoming Request: {json.dumps(request_data, indent=2)}")
+
+            body = request_data.get('body')
+            action = body.get('action') if isinstance(body, dict) else None
+            if self._sampled_out(action):
+                return {'id': request_data['id'], 'logged': False}
+
+            if include_headers:
+                request_data['headers'] = self._sanitize_headers(request.headers)
+
+            self._enqueue(request_data)
             return request_data
-            
+
         except Exception as e:
-            self.logger.error(f"Error logging request: {str(e)}")
+            logger.error(f"Error logging request: {str(e)}")
             return {'error': str(e)}
 
-    def log_response(self, response: Response, request_data: Optional[Dict] = None) -> None:
-        """Log API response details."""
-        self._rotate_log_file_if_needed()
-        
+    def log_response(self, response: Response, request_data: Optional[Dict] = None, body: Any = None) -> None:
+        """Queue a record of an API response, linked to its request by id.
+
+        Pass ``body`` (the object the response was encoded from) to avoid
+        decoding the response again.
+        """
+        if request_data and request_data.get('logged') is False:
+            return
+
         try:
-            # Extract response data
             response_data = {
-                'timestamp': datetime.now().isoformat(),
+                'type': 'response',
+                'id': request_data.get('id') if request_data else None,
+                'timestamp': time.time(),
                 'status_code': response.status_code,
-                'headers': self._sanitize_headers(dict(response.headers)),
             }
-            
+
             # Try to get response body
             try:
-                if response.is_json:
+                if body is not None:
+                    response_data['body'] = body
+                elif response.is_json:
                     response_data['body'] = response.get_json()
                 else:
                     response_data['body'] = response.get_data(as_text=True)
             except Exception as e:
                 response_data['body'] = f'[Error parsing body: {str(e)}]'
-            
-            # Include original request data if available
-            if request_data:
-                response_data['request'] = request_data
-            
-            # Log the response
-            self.logger.info(f"API Response: {json.dumps(response_data, indent=2)}")
-            
+
+            self._enqueue(response_data)
+
         except Exception as e:
-            self.logger.error(f"Error logging response: {str(e)}")
+            logger.error(f"Error logging response: {str(e)}")
+
+    def _write_loop(self):
+        """Drain the queue in batches and append compact JSON lines."""
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Write one batch, switching files when the date changes."""
+        lines_by_file: Dict[str, List[str]] = {}
+        for record in batch:
+            date = datetime.fromtimestamp(record['timestamp']).strftime('%Y-%m-%d')
+            if date != self.current_date:
+                self.current_date = date
+                self.log_file = self._log_file_for(date)
+            try:
+                line = json.dumps(record, separators=(',', ':'), default=str)
+            except Exception as e:
+                line = json.dumps({'type': record.get('type'), 'id': record.get('id'),
+                                   'error': f'[Unserializable record: {e}]'})
+            lines_by_file.setdefault(self.log_file, []).append(line)
+
+        for path, lines in lines_by_file.items():
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write('\n'.join(lines) + '\n')
+                self.written += len(lines)
+            except OSError as e:
+                logger.error(f"Error writing API log {path}: {e}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush queued records and stop the writer thread."""
+        self._stop.set()
+        if self._writer.is_alive():
+            self._writer.join(timeout)
 
     def get_logs(self, date: Optional[str] = None) -> list:
         """Retrieve logs for a specific date or current date."""
         if date is None:
             date = self.current_date
-            
-        log_file = os.path.join(self.log_dir, f'api_requests_{date}.log')
-        
+
+        log_file = self._log_file_for(date)
+
         if not os.path.exists(log_file):
             return []
-            
+
         try:
-            with open(log_file, 'r') as f:
+            with open(log_file, 'r', encoding='utf-8') as f:
                 return [line.strip() for line in f if line.strip()]
         except Exception as e:
-            self.logger.error(f"Error reading logs: {str(e)}")
-            return [] 
\ No newline at end of file
+            logger.error(f"Error reading logs: {str(e)}")
+            return []
@@ -0,0 +1,733 @@
+"""Load and stress benchmarks for the SMS Hub agent.
+
+Every benchmark runs in a throwaway working directory so config, history
+and log files from the real installation are never touched.
+
+Usage:
+    python benchmark.py reservation [--modems 200] [--threads 32] [--rounds 5]
+    python benchmark.py serve [--mode both] [--clients 16] [--duration 10]
+    python benchmark.py codec [--iterations 20000]
+    python benchmark.py history [--rows 1000000] [--phones 5000] [--services 200]
+    python benchmark.py state [--backend both] [--processes 4] [--threads 8] [--modems 2000]
+    python benchmark.py push [--messages 500] [--senders 4] [--handshake-ms 30] [--stall-fraction 0.02] [--hedge 0.95]
+    python benchmark.py pipeline [--rate 1000] [--duration 60] [--modems 50] [--serial-ms 100]
+    python benchmark.py hub [--modems 200] [--rate 100] [--duration 30] [--push-reject-rate 0.05]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def isolated_workdir() -> str:
+    """Switch to a fresh temporary directory before the app modules load config."""
+    workdir = tempfile.mkdtemp(prefix='smshub_bench_')
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return workdir
+
+
+def fake_phone(index: int) -> str:
+    """Deterministic 11-digit phone number for fake modem ``index``."""
+    return str(12020000000 + index)
+
+
+def make_server(modems: int):
+    """Build a SmsHubServer with ``modems`` fake active modems and no serial scanning."""
+    from smshub_server import SmsHubServer
+
+    server = SmsHubServer(scan_modems=False)
+    for i in range(modems):
+        server.register_modem(fake_phone(i), {
+            'port': f'COM{i}',
+            'iccid': f'8901{i:015d}',
+            'phone': fake_phone(i),
+            'status': 'active',
+            'last_seen': time.time(),
+        })
+    return server
+
+
+def get_number_request(service: str = 'wa', exception_phones: List[str] = None) -> Dict:
+    """A valid GET_NUMBER body."""
+    from config import config
+
+    return {
+        'action': 'GET_NUMBER',
+        'key': config.get('smshub_api_key'),
+        'country': 'usaphysical',
+        'operator': 'physic',
+        'service': service,
+        'sum': 10.0,
+        'currency': 643,
+        'exceptionPhoneSet': exception_phones or [],
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of ``values`` (q in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def print_latency_table(title: str, latencies: Dict[str, List[float]], elapsed: float) -> None:
+    """Print req/s, p50 and p99 (milliseconds) per action."""
+    print(title)
+    print(f"  {'action':<18} {'count':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for action, values in latencies.items():
+        print(f"  {action:<18} {len(values):>8} {len(values) / elapsed:>9.0f} "
+              f"{percentile(values, 50) * 1000:>8.2f} {percentile(values, 99) * 1000:>8.2f}")
+
+
+def start_http_server(server, mode: str) -> Tuple[int, callable]:
+    """Serve ``server.app`` on an ephemeral port; returns (port, stop)."""
+    if mode == 'production':
+        from wsgi_server import ProductionServer
+
+        http = ProductionServer(server.app, '127.0.0.1', 0)
+        thread = threading.Thread(target=http.run, daemon=True)
+        thread.start()
+        return http.port, http.drain
+
+    # Same server app.run(threaded=True) builds
+    from werkzeug.serving import make_server
+
+    http = make_server('127.0.0.1', 0, server.app, threaded=True)
+    thread = threading.Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+    return http.server_port, http.shutdown
+
+
+def bench_reservation(args) -> int:
+    """Hammer GET_NUMBER from many threads and verify no SIM is sold twice."""
+    server = make_server(args.modems)
+    body = get_number_request()
+    failures = 0
+
+    for round_no in range(1, args.rounds + 1):
+        sold: List[int] = []
+        sold_lock = threading.Lock()
+        barrier = threading.Barrier(args.threads)
+        requests_made = [0]
+
+        def worker():
+            client = server.app.test_client()
+            mine = []
+            calls = 0
+            barrier.wait()
+            while True:
+                calls += 1
+                result = client.post('/', json=body).get_json()
+                if result.get('status') != 'SUCCESS':
+                    break
+                mine.append(result['number'])
+            with sold_lock:
+                sold.extend(mine)
+                requests_made[0] += calls
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        duplicates = len(sold) - len(set(sold))
+        ok = duplicates == 0 and len(sold) == args.modems
+        failures += 0 if ok else 1
+        print(f"round {round_no}: sold={len(sold)}/{args.modems} duplicates={duplicates} "
+              f"requests={requests_made[0]} rate={requests_made[0] / elapsed:.0f} req/s "
+              f"{'OK' if ok else 'FAIL'}")
+
+        # Hand every SIM back through the normal cancel path for the next round
+        for activation in list(server.active_numbers.values()):
+            server.close_activation(activation, 'cancelled', 4)
+
+    return 1 if failures else 0
+
+
+def bench_serve(args) -> int:
+    """Drive every protocol action over keep-alive HTTP and report req/s and p99."""
+    import requests
+
+    modes = ['development', 'production'] if args.mode == 'both' else [args.mode]
+    server = make_server(args.modems)
+    key = get_number_request()['key']
+    requests_by_action = {
+        'GET_SERVICES': {'action': 'GET_SERVICES', 'key': key},
+        'GET_NUMBER': get_number_request(),
+        'PUSH_SMS': {'action': 'PUSH_SMS', 'key': key, 'smsId': 1, 'phone': int(fake_phone(0)),
+                     'phoneFrom': 'Bench', 'text': 'Your code is 123456'},
+    }
+
+    for mode in modes:
+        port, stop = start_http_server(server, mode)
+        url = f'http://127.0.0.1:{port}/'
+        latencies: Dict[str, List[float]] = {
+            'GET_SERVICES': [], 'GET_NUMBER': [], 'FINISH_ACTIVATION': [], 'PUSH_SMS': []
+        }
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.duration
+
+        def client():
+            session = requests.Session()
+            mine = {action: [] for action in latencies}
+
+            def call(action, body):
+                start = time.perf_counter()
+                result = session.post(url, json=body, timeout=10).json()
+                mine[action].append(time.perf_counter() - start)
+                return result
+
+            while time.perf_counter() < deadline:
+                call('GET_SERVICES', requests_by_action['GET_SERVICES'])
+                result = call('GET_NUMBER', requests_by_action['GET_NUMBER'])
+                if result.get('status') == 'SUCCESS':
+                    # Cancel so the SIM goes straight back to the pool
+                    call('FINISH_ACTIVATION', {'action': 'FINISH_ACTIVATION', 'key': key,
+                                               'activationId': result['activationId'], 'status': 4})
+                call('PUSH_SMS', requests_by_action['PUSH_SMS'])
+            with lock:
+                for action, values in mine.items():
+                    latencies[action].extend(values)
+
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stop()
+        print_latency_table(f"{mode} server ({args.clients} keep-alive clients, {elapsed:.1f}s)",
+                            latencies, elapsed)
+    return 0
+
+
+def bench_codec(args) -> int:
+    """Per-request JSON CPU: old parse/jsonify/re-decode path vs the single-parse codec path."""
+    import timeit
+    from flask import Flask
+    from json_codec import get_codec, orjson
+
+    app = Flask(__name__)
+    services_body = {'action': 'GET_SERVICES', 'key': 'k'}
+    number_body = get_number_request(exception_phones=[str(7900 + i) for i in range(200)])
+    services_response = {'status': 'SUCCESS', 'services': {f's{i}': i for i in range(200)}}
+    number_response = {'status': 'SUCCESS', 'number': 12025550100, 'activationId': 370404476723027968}
+
+    def old_path(request_bytes, response_obj):
+        # request.json (cached for the logger), jsonify, then log_response's get_json()
+        app.json.loads(request_bytes)
+        encoded = app.json.dumps(response_obj).encode('utf-8')
+        app.json.loads(encoded)
+
+    codecs = [get_codec('json')] + ([get_codec('orjson')] if orjson is not None else [])
+    cases = {
+        'GET_SERVICES': (app.json.dumps(services_body).encode(), services_response),
+        'GET_NUMBER(200 prefixes)': (app.json.dumps(number_body).encode(), number_response),
+    }
+    print(f"  {'case':<26} {'path':<14} {'us/request':>11} {'saved':>8}")
+    with app.app_context():
+        for case, (request_bytes, response_obj) in cases.items():
+            baseline = timeit.timeit(lambda: old_path(request_bytes, response_obj),
+                                     number=args.iterations) / args.iterations * 1e6
+            print(f"  {case:<26} {'old':<14} {baseline:>11.2f} {'':>8}")
+            for codec in codecs:
+                def new_path(codec=codec):
+                    codec.loads(request_bytes)
+                    codec.dumps(response_obj)
+                cost = timeit.timeit(new_path, number=args.iterations) / args.iterations * 1e6
+                print(f"  {case:<26} {'new/' + codec.name:<14} {cost:>11.2f} {baseline - cost:>8.2f}")
+    return 0
+
+
+def write_history(rows: int, phones: int, services: int, path: str = 'activation_history.txt') -> None:
+    """Write ``rows`` completed activations over ``phones`` numbers and ``services`` services."""
+    import json
+    import random
+
+    rng = random.Random(1)
+    names = [f's{i}' for i in range(services)]
+    start = time.time() - 86400 * 30
+    with open(path, 'w') as f:
+        for i in range(rows):
+            timestamp = start + i
+            f.write(json.dumps({
+                'phone': fake_phone(rng.randrange(phones)),
+                'service': rng.choice(names),
+                'timestamp': timestamp,
+                'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+            }) + '\n')
+
+
+def bench_history(args) -> int:
+    """Startup load time: legacy line-by-line replay vs snapshot + tail."""
+    import json
+    from history_store import HistoryStore
+
+    write_history(args.rows, args.phones, args.services)
+
+    def legacy_load():
+        completed = {}
+        with open('activation_history.txt', 'r') as f:
+            for line in f:
+                data = json.loads(line.strip())
+                completed.setdefault(data['phone'], {})[data['service']] = data.get('timestamp')
+        return completed
+
+    timings = []
+    started = time.perf_counter()
+    legacy_load()
+    timings.append(('legacy replay', time.perf_counter() - started))
+
+    store = HistoryStore('activation_history.txt')
+    started = time.perf_counter()
+    store.load()
+    timings.append(('first load (tail)', time.perf_counter() - started))
+    started = time.perf_counter()
+    store.compact()
+    timings.append(('compaction', time.perf_counter() - started))
+    started = time.perf_counter()
+    entries = store.load()
+    timings.append(('snapshot load', time.perf_counter() - started))
+
+    size = os.path.getsize(store.snapshot_file)
+    print(f"  {args.rows} rows -> {len(entries)} (phone, service) pairs, snapshot {size / 1e6:.1f} MB")
+    for name, seconds in timings:
+        print(f"  {name:<20} {seconds * 1000:>10.1f} ms")
+    return 0
+
+
+def _state_worker(backend, threads: int, first_id: int, results) -> None:
+    """Claim modems from ``threads`` threads until the inventory is empty."""
+    lock = threading.Lock()
+    claimed: List[str] = []
+    latencies: List[float] = []
+    next_id = [first_id]
+
+    def claim():
+        mine, times = [], []
+        while True:
+            with lock:
+                next_id[0] += 1
+                activation_id = next_id[0]
+            started = time.perf_counter()
+            activation = backend.reserve({'activation_id': activation_id, 'service': 'wa',
+                                          'timestamp': time.time(), 'status': 'reserved'})
+            times.append(time.perf_counter() - started)
+            if activation is None:
+                break
+            mine.append(activation['phone'])
+        with lock:
+            claimed.extend(mine)
+            latencies.extend(times)
+
+    workers = [threading.Thread(target=claim) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    results.put((claimed, latencies))
+
+
+def _sqlite_state_process(path: str, threads: int, first_id: int, results) -> None:
+    """One worker process with its own connection to the shared database."""
+    from state_backend import create_state_backend
+
+    _state_worker(create_state_backend('sqlite', path=path), threads, first_id, results)
+
+
+def bench_state(args) -> int:
+    """Reservation contention per state backend: throughput, latency, double sales."""
+    import multiprocessing
+    from state_backend import create_state_backend
+
+    backends = ['memory', 'sqlite'] if args.backend == 'both' else [args.backend]
+    failures = 0
+    for name in backends:
+        # The memory backend cannot be shared, so it runs all threads in one process
+        processes = 1 if name == 'memory' else args.processes
+        threads = args.threads * (args.processes if name == 'memory' else 1)
+        options = {'path': os.path.abspath('state_bench.db')} if name == 'sqlite' else {}
+        if name == 'sqlite' and os.path.exists(options['path']):
+            os.remove(options['path'])
+        backend = create_state_backend(name, **options)
+        for i in range(args.modems):
+            backend.register_modem(fake_phone(i), {'status': 'active', 'iccid': f'8901{i:015d}'})
+
+        results = multiprocessing.Queue()
+        procs = []
+        started = time.perf_counter()
+        if name == 'memory':
+            _state_worker(backend, threads, 0, results)
+        else:
+            procs = [multiprocessing.Process(target=_sqlite_state_process,
+                                             args=(options['path'], threads, (p + 1) * 10 ** 9, results))
+                     for p in range(processes)]
+            for proc in procs:
+                proc.start()
+        claimed: List[str] = []
+        latencies: List[float] = []
+        for _ in range(processes):
+            phones, times = results.get()
+            claimed.extend(phones)
+            latencies.extend(times)
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - started
+
+        duplicates = len(claimed) - len(set(claimed))
+        ok = duplicates == 0 and len(claimed) == args.modems
+        failures += 0 if ok else 1
+        print(f"  {name:<7} {processes} proc x {threads} threads: claimed={len(claimed)}/{args.modems} "
+              f"duplicates={duplicates} {len(latencies) / elapsed:>8.0f} reserve/s "
+              f"p50={percentile(latencies, 50) * 1000:.2f} ms p99={percentile(latencies, 99) * 1000:.2f} ms "
+              f"{'OK' if ok else 'FAIL'}")
+        backend.close()
+    return 1 if failures else 0
+
+
+def start_stand_in_hub(handshake_ms: float = 0.0, stall_fraction: float = 0.0,
+                       stall_ms: float = 0.0, on_push=None) -> Tuple[str, callable, Dict[str, int]]:
+    """Local stand-in for the SMS Hub API that answers PUSH_SMS with SUCCESS.
+
+    Each new connection is delayed by ``handshake_ms`` to stand in for the
+    TCP + TLS setup a real hub costs; ``stall_fraction`` of the requests are
+    answered only after ``stall_ms``. ``on_push`` is called with each
+    request body. Returns (url, stop, counters).
+    """
+    from fake_hub import PushReceiver
+
+    receiver = PushReceiver(handshake_ms=handshake_ms, stall_fraction=stall_fraction, stall_ms=stall_ms,
+                            on_push=on_push)
+    return receiver.start(), receiver.stop, receiver.counters
+
+
+def bench_push(args) -> int:
+    """PUSH_SMS latency per message: one-off requests.post vs the pooled hub client."""
+    import requests
+
+    from hub_client import HubClient
+    from smshub_api import OK, TIMEOUT, HubResult, SmsHubAPI, SmsHubConfig
+
+    url, stop, counters = start_stand_in_hub(args.handshake_ms, args.stall_fraction, args.stall_ms)
+
+    def hub_config(**options):
+        return SmsHubConfig(api_key='bench', agent_id='bench', server_url='', api_url=url,
+                            pool_size=args.senders, read_timeout=args.read_timeout,
+                            budget=args.budget, **options)
+
+    class UnpooledAPI(SmsHubAPI):
+        """The previous transport: a new connection per request."""
+
+        def _attempt(self, request_data, deadline):
+            try:
+                response = requests.post(self.config.api_url, json=request_data, headers=self.headers,
+                                         timeout=(self.config.connect_timeout, self.config.read_timeout))
+                response.raise_for_status()
+                return HubResult(OK, response.json())
+            except requests.Timeout:
+                return HubResult(TIMEOUT)
+
+    variants = [
+        ('requests.post', UnpooledAPI(hub_config(), client=HubClient(pool_size=1))),
+        ('pooled client', SmsHubAPI(hub_config(), client=HubClient(pool_size=args.senders))),
+    ]
+    if args.hedge:
+        variants.append((f'pooled + hedge p{args.hedge * 100:g}',
+                         SmsHubAPI(hub_config(hedge_quantile=args.hedge, hedge_min_samples=20),
+                                   client=HubClient(pool_size=args.senders * 2))))
+    failures = 0
+    for name, api in variants:
+        for key in counters:
+            counters[key] = 0
+        latencies: List[float] = []
+        outcomes: Dict[str, int] = {}
+        lock = threading.Lock()
+        per_sender = args.messages // args.senders
+
+        def sender(first_id):
+            mine = []
+            for sms_id in range(first_id, first_id + per_sender):
+                result = api.push_sms_result(sms_id, fake_phone(sms_id), 'Bench', 'Your code is 123456')
+                mine.append((result.elapsed, result.outcome + (' (hedged)' if result.hedged else '')))
+            with lock:
+                for elapsed, outcome in mine:
+                    latencies.append(elapsed)
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        threads = [threading.Thread(target=sender, args=(i * per_sender + 1,)) for i in range(args.senders)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        print_latency_table(f"{name}: {counters['connections']} connections, "
+                            f"{counters['gzip']}/{counters['requests']} gzip bodies, "
+                            f"{counters['stalled']} stalled",
+                            {'PUSH_SMS': latencies}, elapsed)
+        print('  outcomes: ' + ', '.join(f'{outcome}={count}' for outcome, count in sorted(outcomes.items())))
+        if len(latencies) != per_sender * args.senders or max(latencies) > args.budget + 0.5:
+            failures += 1  # A push outlived its budget
+    stop()
+    return 1 if failures else 0
+
+class FakeModemBank:
+    """Stands in for ModemManager: modems COM0.. whose SIM storage fills as SMS arrive.
+
+    Reads answer with a text-mode AT+CMGL listing after ``serial_ms``, the
+    time a real serial round trip takes.
+    """
+
+    def __init__(self, modems: int, serial_ms: float = 100.0):
+        from modem_manager import ModemManager
+
+        self.modems = {f'COM{i}': {'port': f'COM{i}', 'phone': fake_phone(i)} for i in range(modems)}
+        self.parse_sms_list = ModemManager.parse_sms_list
+        self.serial_ms = serial_ms
+        self.stored: Dict[str, Dict[int, Tuple[str, str, str]]] = {port: {} for port in self.modems}
+        self.next_index = {port: 1 for port in self.modems}
+        self.deleted = 0
+        self.lock = threading.Lock()
+
+    def receive(self, port: str, sender: str, text: str) -> None:
+        with self.lock:
+            index = self.next_index[port]
+            self.next_index[port] += 1
+            self.stored[port][index] = (sender, time.strftime('%y/%m/%d,%H:%M:%S+00', time.gmtime()), text)
+
+    def read_sms(self, port: str) -> str:
+        time.sleep(self.serial_ms / 1000.0)
+        with self.lock:
+            lines = []
+            for index, (sender, timestamp, text) in sorted(self.stored[port].items()):
+                lines.append(f'+CMGL: {index},"REC UNREAD","{sender}",,"{timestamp}"')
+                lines.append(text)
+        return '\r\n'.join(lines + ['', 'OK'])
+
+    def delete_sms(self, port: str, index: str) -> bool:
+        with self.lock:
+            found = self.stored[port].pop(int(index), None) is not None
+            self.deleted += found
+            return found
+
+
+def bench_pipeline(args) -> int:
+    """Fake modems -> SMS pipeline -> local stand-in hub at a fixed SMS rate."""
+    from sms_pipeline import STAGES, SmsPipeline
+    from smshub_integration import SmsHubIntegration
+
+    total = int(args.rate * args.duration / 60.0)
+    arrived: Dict[str, float] = {}  # text -> arrival time on the modem
+    hub_latencies: List[float] = []
+    pushed: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def on_push(request):
+        with lock:
+            pushed[request['smsId']] = pushed.get(request['smsId'], 0) + 1
+            if pushed[request['smsId']] == 1 and request['text'] in arrived:
+                hub_latencies.append(time.monotonic() - arrived[request['text']])
+
+    url, stop_hub, counters = start_stand_in_hub(on_push=on_push)
+    server = make_server(args.modems)
+    client = server.app.test_client()
+    for _ in range(args.modems):  # Sell every number so its SMS are pushed
+        client.post('/', json=get_number_request())
+    smshub = SmsHubIntegration()
+    smshub.api.config.api_url = url
+    smshub.attach_server(server)
+
+    bank = FakeModemBank(args.modems, args.serial_ms)
+    pipeline = SmsPipeline(bank, smshub, poll_interval=args.poll_interval, queue_size=args.queue_size,
+                           receive_threads=args.receive_threads, delete_delivered=True)
+    pipeline.start()
+    print(f"{total} SMS at {args.rate:g}/min over {args.modems} modems "
+          f"(poll every {args.poll_interval:g}s, {args.serial_ms:g} ms per serial read)")
+    started = time.monotonic()
+    for n in range(total):
+        delay = started + n * 60.0 / args.rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        text = f'Your code is {n:06d}'
+        with lock:
+            arrived[text] = time.monotonic()
+        bank.receive(f'COM{n % args.modems}', 'Bench', text)
+    deadline = time.monotonic() + args.poll_interval * 2 + 30
+    while len(pushed) < total and time.monotonic() < deadline:
+        time.sleep(0.1)
+    time.sleep(0.5)  # Let the last acknowledgements through
+    elapsed = time.monotonic() - started
+    stats = pipeline.stats()
+    pipeline.stop()
+    smshub.delivery.stop()
+    stop_hub()
+
+    print(f"  {'stage':<12} {'in':>8} {'out':>8} {'per s':>8} {'queued':>7} {'errors':>7}")
+    for stage in STAGES:
+        row = stats[stage]
+        print(f"  {stage:<12} {row['in']:>8} {row['out']:>8} {row['per_second']:>8.1f} "
+              f"{row['queue']:>7} {row['errors']:>7}")
+    end_to_end = stats['end_to_end']
+    print(f"  modem read -> hub SUCCESS: p50={end_to_end.get('p50', 0) * 1000:.1f} ms "
+          f"p99={end_to_end.get('p99', 0) * 1000:.1f} ms")
+    print(f"  SMS arrival -> hub:        p50={percentile(hub_latencies, 50) * 1000:.1f} ms "
+          f"p99={percentile(hub_latencies, 99) * 1000:.1f} ms")
+    duplicates = sum(count - 1 for count in pushed.values())
+    ok = len(pushed) == total and duplicates == 0 and bank.deleted == total
+    print(f"  delivered={len(pushed)}/{total} duplicate pushes={duplicates} deleted from SIM={bank.deleted} "
+          f"throughput={len(pushed) / elapsed * 60:.0f} SMS/min {'OK' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+
+def bench_hub(args) -> int:
+    """Both protocol sides against the local fake hub: drive the agent over HTTP, receive its SMS."""
+    from config import config
+    from fake_hub import HubDriver, PushReceiver, Violations, print_report
+    from smshub_integration import SmsHubIntegration
+
+    violations = Violations()
+    receiver = PushReceiver(latency_ms=args.push_latency_ms, error_rate=args.push_error_rate,
+                            reject_rate=args.push_reject_rate, violations=violations)
+    server = make_server(args.modems)
+    smshub = SmsHubIntegration()
+    smshub.api.config.api_url = receiver.start()
+    smshub.delivery.retry_interval = args.retry_interval
+    smshub.attach_server(server)
+    port, stop_http = start_http_server(server, args.mode)
+    driver = HubDriver(f'http://127.0.0.1:{port}/', config.get('smshub_api_key'), rate=args.rate,
+                       workers=args.workers, violations=violations)
+
+    stop_sms = threading.Event()
+    sent = [0]
+
+    def sms_source():
+        """SMS for random live activations, as the modems would receive them."""
+        while not stop_sms.wait(1.0 / args.sms_rate):
+            live = list(driver.live.values())
+            if not live:
+                continue
+            number = driver._rng.choice(live)['number']
+            smshub.process_message(f'COM{number - int(fake_phone(0))}',
+                                   {'sender': 'Bench', 'text': f'Your code is {sent[0]:06d}'})
+            sent[0] += 1
+
+    print(f"{args.modems} modems, {args.rate:g} agent req/s for {args.duration:g}s, "
+          f"{args.sms_rate:g} SMS/s, pushes: {args.push_error_rate:g} HTTP 500, "
+          f"{args.push_reject_rate:g} rejected")
+    source = threading.Thread(target=sms_source, daemon=True)
+    source.start()
+    started = time.monotonic()
+    driver.run(args.duration, drain=False)
+    stop_sms.set()
+    source.join()
+    elapsed = time.monotonic() - started
+    deadline = time.monotonic() + args.retry_interval * 3 + 10
+    while receiver.counters['delivered'] < sent[0] and time.monotonic() < deadline:
+        time.sleep(0.1)
+    for activation_id in list(driver.live):
+        driver.call({'action': 'FINISH_ACTIVATION', 'key': driver.key, 'activationId': activation_id, 'status': 4})
+    smshub.delivery.stop()
+    stop_http()
+    receiver.stop()
+
+    print_report(driver, receiver, violations, elapsed)
+    ok = violations.total() == 0 and receiver.counters['delivered'] == sent[0]
+    print(f"  SMS delivered {receiver.counters['delivered']}/{sent[0]} {'OK' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--log', action='store_true', help='keep application logging enabled')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('reservation', help='concurrent GET_NUMBER stress test')
+    p.add_argument('--modems', type=int, default=200)
+    p.add_argument('--threads', type=int, default=32)
+    p.add_argument('--rounds', type=int, default=5)
+    p.set_defaults(func=bench_reservation)
+
+    p = sub.add_parser('serve', help='per-action req/s and p99 over HTTP')
+    p.add_argument('--mode', choices=['development', 'production', 'both'], default='both')
+    p.add_argument('--modems', type=int, default=200)
+    p.add_argument('--clients', type=int, default=16)
+    p.add_argument('--duration', type=float, default=10)
+    p.set_defaults(func=bench_serve)
+
+    p = sub.add_parser('codec', help='JSON decode/encode CPU per request')
+    p.add_argument('--iterations', type=int, default=20000)
+    p.set_defaults(func=bench_codec)
+
+    p = sub.add_parser('history', help='activation history load time at startup')
+    p.add_argument('--rows', type=int, default=1000000)
+    p.add_argument('--phones', type=int, default=5000)
+    p.add_argument('--services', type=int, default=200)
+    p.set_defaults(func=bench_history)
+
+    p = sub.add_parser('state', help='reservation contention per state backend')
+    p.add_argument('--backend', choices=['memory', 'sqlite', 'both'], default='both')
+    p.add_argument('--processes', type=int, default=4, help='worker processes (sqlite)')
+    p.add_argument('--threads', type=int, default=8, help='threads per process')
+    p.add_argument('--modems', type=int, default=2000)
+    p.set_defaults(func=bench_state)
+
+    p = sub.add_parser('push', help='PUSH_SMS latency against a local stand-in hub')
+    p.add_argument('--messages', type=int, default=500)
+    p.add_argument('--senders', type=int, default=4, help='concurrent sending threads')
+    p.add_argument('--handshake-ms', type=float, default=30,
+                   help='delay per new connection, standing in for TCP + TLS setup')
+    p.add_argument('--stall-fraction', type=float, default=0.0, help='fraction of requests the hub stalls')
+    p.add_argument('--stall-ms', type=float, default=3000)
+    p.add_argument('--read-timeout', type=float, default=10.0)
+    p.add_argument('--budget', type=float, default=15.0, help='overall seconds per push')
+    p.add_argument('--hedge', type=float, default=None, help='also run with hedging at this quantile, e.g. 0.95')
+    p.set_defaults(func=bench_push)
+
+    p = sub.add_parser('pipeline', help='modem-to-hub SMS pipeline with fake modems and a stand-in hub')
+    p.add_argument('--rate', type=float, default=1000, help='SMS per minute')
+    p.add_argument('--duration', type=float, default=60, help='seconds of arrivals')
+    p.add_argument('--modems', type=int, default=50)
+    p.add_argument('--serial-ms', type=float, default=100, help='duration of one AT+CMGL read')
+    p.add_argument('--poll-interval', type=float, default=2.0)
+    p.add_argument('--receive-threads', type=int, default=4)
+    p.add_argument('--queue-size', type=int, default=1000)
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser('hub', help='both protocol sides against the local fake hub, with invariant checks')
+    p.add_argument('--mode', choices=['development', 'production'], default='production')
+    p.add_argument('--modems', type=int, default=200)
+    p.add_argument('--rate', type=float, default=100, help='agent requests per second')
+    p.add_argument('--workers', type=int, default=8)
+    p.add_argument('--duration', type=float, default=30)
+    p.add_argument('--sms-rate', type=float, default=5, help='inbound SMS per second for live numbers')
+    p.add_argument('--push-latency-ms', type=float, default=20)
+    p.add_argument('--push-error-rate', type=float, default=0.02, help='pushes answered with HTTP 500')
+    p.add_argument('--push-reject-rate', type=float, default=0.05, help='pushes answered with status ERROR')
+    p.add_argument('--retry-interval', type=float, default=2.0,
+                   help='seconds between pushes of an SMS (the protocol says 10)')
+    p.set_defaults(func=bench_hub)
+
+    args = parser.parse_args()
+    isolated_workdir()
+    if not args.log:
+        logging.disable(logging.CRITICAL)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
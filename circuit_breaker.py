@@ -0,0 +1,129 @@
+"""Circuit breaker and push pacing for the SMS Hub API endpoint.
+
+closed     requests flow, paced by a token bucket; consecutive transport
+           failures are counted
+open       the endpoint is considered down: nothing is sent until
+           ``probe_interval`` has passed
+half_open  exactly one request (the probe) is let through; its result
+           closes the circuit or opens it for another interval
+
+While the circuit is open, queued messages do not retry on their own
+schedules: they wait for the circuit, and the single probe every
+``probe_interval`` seconds stands in for all of them. After a recovery
+the allowed rate ramps up over ``ramp_seconds`` so a large backlog drains
+without a request storm.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Closed/open/half-open gate with a token-bucket pacer."""
+
+    def __init__(self, failure_threshold: int = 5, probe_interval: float = 10.0,
+                 max_rate: float = 50.0, ramp_seconds: float = 30.0, name: str = 'smshub'):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.max_rate = max_rate  # Requests per second while closed; 0 = unlimited
+        self.ramp_seconds = ramp_seconds
+        self.state = CLOSED
+        self.failures = 0  # Consecutive transport failures
+        self.opened_at: Optional[float] = None  # Wall clock, for the dashboard
+        self.outages = 0
+        self._open_until = 0.0
+        self._probe_out = False
+        self._closed_at = time.monotonic() - ramp_seconds  # Start at full rate
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take permission for one request: 0 if granted, else seconds to wait before asking again."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self._open_until:
+                    return self._open_until - now
+                self.state = HALF_OPEN
+                self._probe_out = False
+                logger.info(f"Circuit {self.name} half-open; sending a probe")
+            if self.state == HALF_OPEN:
+                if self._probe_out:
+                    return self.probe_interval  # The probe's result wakes waiters sooner
+                self._probe_out = True
+                return 0.0
+            return self._take_token(now)
+
+    def _take_token(self, now: float) -> float:
+        """Token bucket (lock held); the rate ramps up after a recovery."""
+        if not self.max_rate:
+            return 0.0
+        rate = self.max_rate
+        if self.ramp_seconds:
+            rate *= min(1.0, max(0.05, (now - self._closed_at) / self.ramp_seconds))
+        burst = max(1.0, rate)
+        self._tokens = min(burst, self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / rate
+
+    def record_success(self) -> None:
+        """The endpoint answered (whatever the protocol status)."""
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                outage = time.time() - (self.opened_at or time.time())
+                logger.info(f"Circuit {self.name} closed after {outage:.0f}s outage")
+                self.state = CLOSED
+                self.opened_at = None
+                self._probe_out = False
+                self._closed_at = time.monotonic()
+                self._tokens = 1.0
+
+    def record_failure(self) -> None:
+        """The endpoint could not be reached or did not answer in time."""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._open("probe failed")
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self.outages += 1
+                self.opened_at = time.time()
+                self._open(f"{self.failures} consecutive failures")
+
+    def release(self) -> None:
+        """A granted request was not sent after all; lets another probe through."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_out = False
+
+    def _open(self, reason: str) -> None:
+        self.state = OPEN
+        self._probe_out = False
+        self._open_until = time.monotonic() + self.probe_interval
+        logger.warning(f"Circuit {self.name} open ({reason}); next probe in {self.probe_interval:g}s")
+
+    def snapshot(self) -> Dict:
+        """State for the dashboard."""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'outages': self.outages,
+                'open_since': self.opened_at,
+                'next_probe_in': max(0.0, self._open_until - time.monotonic()) if self.state == OPEN else 0.0,
+            }
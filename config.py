@@ -4,6 +4,7 @@ import json
 import os
 import logging
 from typing import Dict, Any, Optional
+from logging_setup import setup_logging
 
 logger = logging.getLogger(__name__)
 
@@ -23,13 +24,9 @@ class Config:
         SMSHUB_AGENT_ID = self.config.get('smshub_agent_id', SMSHUB_AGENT_ID)
         SMSHUB_SERVER_URL = self.config.get('smshub_server_url', SMSHUB_SERVER_URL)
 
-        # Set logging level based on debug mode
-        log_level = logging.DEBUG if self.config.get('debug_mode', False) else logging.INFO
-        logging.basicConfig(
-            level=log_level,
-            format='%(levelname)s: %(message)s'
-        )
-        logger.info(f"Logging level set to: {'DEBUG' if log_level == logging.DEBUG else 'INFO'}")
+        # Application-wide logging (queue + background listener), levels from config
+        setup_logging(self.config)
+        logger.info("Logging level set to: %s", logging.getLevelName(logging.getLogger().level))
 
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from file."""
@@ -243,7 +240,64 @@ class Config:
             "smshub_server_url": SMSHUB_SERVER_URL,  # Add this
             "auto_start_server": True,
             "debug_mode": False,  # Default to INFO level logging
+            "logging": {
+                "level": "INFO",
+                "file": "activation_log.txt",  # Rotated and gzip-compressed
+                "max_bytes": 10485760,
+                "backup_count": 10,
+                "compress": True,
+                "console": True,
+                "levels": {  # Per-module levels
+                    "werkzeug": "WARNING",
+                    "urllib3": "WARNING"
+                }
+            },
             "scan_interval": 10,  # Modem scan interval in seconds
+            "node_id": None,  # Activation ID node (0-1023), unique per process; None claims a free one
+            "activation_lease_seconds": 1800,  # Release a sold number if the hub never finishes it
+            "api_log_sample_rates": {
+                "GET_SERVICES": 0.1  # Fraction of hub polls written to logs/api
+            },
+            "json_codec": "auto",  # "auto" (orjson when installed), "orjson" or "json"
+            "service_index": "auto",  # "auto" (numpy when installed), "numpy" or "bitmap"
+            "service_reuse": {
+                "*": "never"  # Per service: "never", "rotated" (new SIM) or days before reselling
+            },
+            "history_compact_every": 10000,  # Fold activation_history.txt into the snapshot every N sales
+            "state_backend": "memory",  # "memory" (one process) or "sqlite" (shared by worker processes)
+            "state_db": "smshub_state.db",  # SQLite database for the "sqlite" backend
+            "activation_journal": "activation_journal.log",  # Write-ahead log of in-flight activations (memory backend)
+            "journal_fsync": True,  # fsync each group commit
+            "journal_commit_timeout": 5.0,  # Longest a request waits for its journal entry to reach disk
+            "activity_snapshot": "activity_stats.json",  # Per-minute/per-hour activity rings, kept across restarts
+            "activity_save_interval": 60,  # Seconds between activity snapshots
+            "hub_pool_size": 8,  # Keep-alive connections to the SMS Hub API
+            "hub_gzip_requests": True,  # gzip PUSH_SMS request bodies
+            "hub_dns_ttl": 300,  # Seconds to cache the SMS Hub API address
+            "hub_connect_timeout": 3.05,  # Seconds to connect to the SMS Hub API
+            "hub_read_timeout": 10.0,  # Seconds to wait for its response
+            "hub_request_budget": 15.0,  # Overall seconds per request, retries and hedges included
+            "hub_hedge_quantile": None,  # e.g. 0.95: hedge pushes slower than that latency quantile
+            "hub_breaker_failures": 5,  # Consecutive failed requests that mark the hub as down
+            "hub_probe_interval": 10.0,  # Seconds between probes while it is down
+            "hub_max_push_rate": 50.0,  # PUSH_SMS per second (0 = unlimited)
+            "hub_ramp_seconds": 30.0,  # Seconds to ramp back to full rate after an outage
+            "sms_delivery_workers": 4,  # Concurrent PUSH_SMS deliveries
+            "unsold_sms_delay": None,  # Seconds to hold SMS for numbers not sold (None: do not push them)
+            "sms_outbox": "sms_outbox.db",  # SQLite outbox of inbound SMS until the hub acknowledges them
+            "sms_pipeline": True,  # Poll modems for SMS and stream them to the hub
+            "sms_poll_interval": 5.0,  # Seconds between SMS polls of each modem
+            "sms_pipeline_queue_size": 1000,  # Items each pipeline stage may queue before its producer blocks
+            "sms_receive_threads": 4,  # Threads polling modems (each polls its share serially)
+            "delete_delivered_sms": True,  # Delete SMS from the modem once acknowledged by the hub or dropped
+            "server_mode": "production",  # "production" (waitress) or "development" (Werkzeug)
+            "production_server": {
+                "threads": 8,
+                "connection_limit": 100,
+                "channel_timeout": 30,
+                "backlog": 1024,
+                "drain_timeout": 10
+            },
         }
 
         try:
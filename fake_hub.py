@@ -0,0 +1,505 @@
+"""Local stand-in for the SMS Hub side of the agent protocol.
+
+The hub both calls the agent (GET_SERVICES, GET_NUMBER, FINISH_ACTIVATION)
+and receives PUSH_SMS from it. ``HubDriver`` plays the first role at a set
+rate and action mix; ``PushReceiver`` plays the second, with injectable
+latency, HTTP errors and non-SUCCESS statuses. Both check the rules of the
+hub's own protocol tests and count every breach as a violation:
+
+    over_reported      GET_SERVICES reported numbers that GET_NUMBER then
+                       answered with NO_NUMBERS
+    duplicate_number   a number handed out again while its activation is live
+    excluded_prefix    a number starting with a prefix in exceptionPhoneSet
+    slow_number        GET_NUMBER took longer than 3 seconds
+    finish_not_idempotent  a repeated FINISH_ACTIVATION not answered SUCCESS
+    field_type         a numeric protocol field that is not a number
+    redelivered        an SMS pushed again after the hub answered SUCCESS
+
+Usage:
+    python fake_hub.py --agent-url http://127.0.0.1:5000/ --rate 20 --duration 60
+    python fake_hub.py --push-port 8090 --push-latency-ms 200 --push-reject-rate 0.1 --duration 0
+
+Point the agent's SMS Hub API URL at the push receiver
+(``http://127.0.0.1:<push-port>/agent/api/sms``) to test SMS delivery.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from stream_stats import KeyedStreamStats
+
+logger = logging.getLogger(__name__)
+
+GET_SERVICES = 'GET_SERVICES'
+GET_NUMBER = 'GET_NUMBER'
+FINISH_ACTIVATION = 'FINISH_ACTIVATION'
+PUSH_SMS = 'PUSH_SMS'
+
+DEFAULT_MIX = {GET_SERVICES: 5, GET_NUMBER: 3, FINISH_ACTIVATION: 2}
+GET_NUMBER_LIMIT = 3.0  # Seconds; the hub fails slower agents
+PUSH_PATH = '/agent/api/sms'
+
+
+class Violations:
+    """Protocol violations by kind, with the first few examples of each."""
+
+    def __init__(self, examples: int = 5):
+        self.counts: Dict[str, int] = {}
+        self.examples: Dict[str, List[str]] = {}
+        self.max_examples = examples
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, detail: str) -> None:
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            examples = self.examples.setdefault(kind, [])
+            if len(examples) < self.max_examples:
+                examples.append(detail)
+        logger.warning(f"Protocol violation ({kind}): {detail}")
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_services(response: Dict) -> Dict[str, int]:
+    """{service: quantity} from a GET_SERVICES answer (flat ``services`` or ``countryList``)."""
+    if isinstance(response.get('services'), dict):
+        return dict(response['services'])
+    quantities: Dict[str, int] = {}
+    for country in response.get('countryList') or []:
+        for services in (country.get('operatorMap') or {}).values():
+            for service, quantity in services.items():
+                quantities[service] = quantities.get(service, 0) + quantity
+    return quantities
+
+
+class PushReceiver:
+    """The hub's PUSH_SMS endpoint, with injectable latency, errors and statuses.
+
+    ``error_rate`` of the requests get HTTP 500, ``reject_rate`` get a 200
+    with status ERROR (the agent must retry both), ``stall_fraction`` are
+    answered only after ``stall_ms``; every new connection costs
+    ``handshake_ms`` to stand in for TCP + TLS setup.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, reject_rate: float = 0.0,
+                 stall_fraction: float = 0.0, stall_ms: float = 0.0, handshake_ms: float = 0.0,
+                 on_push: Optional[Callable[[Dict], None]] = None, violations: Optional[Violations] = None,
+                 seed: int = 42):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.reject_rate = reject_rate
+        self.stall_fraction = stall_fraction
+        self.stall_ms = stall_ms
+        self.handshake_ms = handshake_ms
+        self.on_push = on_push
+        self.violations = violations or Violations()
+        self.counters = {'connections': 0, 'requests': 0, 'gzip': 0, 'stalled': 0,
+                         'errors': 0, 'rejected': 0, 'delivered': 0}
+        self.acknowledged = set()  # smsIds answered with SUCCESS
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._http: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://localhost:{self.port}{PUSH_PATH}'
+
+    def start(self) -> str:
+        """Serve on a background thread; returns the PUSH_SMS URL."""
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as the real hub offers
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                with receiver._lock:
+                    receiver.counters['connections'] += 1
+                time.sleep(receiver.handshake_ms / 1000.0)
+                super().setup()
+                # Headers and body go out as separate writes; avoid Nagle/delayed-ACK stalls
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status_code, payload = receiver.handle(body, self.headers.get('Content-Encoding') == 'gzip')
+                data = json.dumps(payload).encode()
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._http.daemon_threads = True
+        self._http.handle_error = lambda request, client_address: None  # Clients that gave up on a stall
+        self.port = self._http.server_port
+        threading.Thread(target=self._http.serve_forever, name='fake-hub-push', daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+
+    def handle(self, body: bytes, gzipped: bool = False) -> Tuple[int, Dict]:
+        """(HTTP status, response) for one PUSH_SMS request body."""
+        with self._lock:
+            self.counters['requests'] += 1
+            if gzipped:
+                self.counters['gzip'] += 1
+            roll = self._rng.random()
+            stall = self._rng.random() < self.stall_fraction
+            delay = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            self.counters['stalled'] += stall
+        if stall:
+            delay += self.stall_ms
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        try:
+            request = json.loads(gzip.decompress(body) if gzipped else body)
+        except ValueError:
+            return 400, {'status': 'ERROR', 'error': 'Invalid JSON'}
+        if self.on_push is not None:
+            self.on_push(request)
+        if request.get('action') != PUSH_SMS:
+            return 200, {'status': 'ERROR', 'error': 'Unknown action'}
+        for field in ('smsId', 'phone'):
+            if not _is_number(request.get(field)):
+                self.violations.add('field_type', f"PUSH_SMS {field}={request.get(field)!r}")
+        for field in ('phoneFrom', 'text'):
+            if not isinstance(request.get(field), str):
+                self.violations.add('field_type', f"PUSH_SMS {field}={request.get(field)!r}")
+
+        with self._lock:
+            if roll < self.error_rate:
+                self.counters['errors'] += 1
+                return 500, {'status': 'ERROR', 'error': 'Injected server error'}
+            if roll < self.error_rate + self.reject_rate:
+                self.counters['rejected'] += 1
+                return 200, {'status': 'ERROR', 'error': 'Injected rejection'}
+            sms_id = request.get('smsId')
+            if sms_id in self.acknowledged:
+                redelivered = True
+            else:
+                redelivered = False
+                self.acknowledged.add(sms_id)
+                self.counters['delivered'] += 1
+        if redelivered:
+            self.violations.add('redelivered', f"SMS {sms_id} pushed again after SUCCESS")
+        return 200, {'status': 'SUCCESS'}
+
+
+class HubDriver:
+    """Calls an agent with GET_SERVICES / GET_NUMBER / FINISH_ACTIVATION like the hub does.
+
+    Requests are spread over ``workers`` threads at ``rate`` per second in
+    the proportions of ``mix``. Activations are finished again with
+    probability ``repeat_finish`` to check idempotence, and GET_NUMBER
+    carries an exceptionPhoneSet with probability ``exclusion_rate``.
+    """
+
+    def __init__(self, agent_url: str, key: str, rate: float = 10.0, mix: Optional[Dict[str, float]] = None,
+                 workers: int = 4, services: Optional[List[str]] = None, country: str = 'usaphysical',
+                 operator: str = 'physic', sum_amount: float = 10.0, currency: int = 643,
+                 sold_fraction: float = 0.5, repeat_finish: float = 0.2, exclusion_rate: float = 0.1,
+                 timeout: float = 10.0, violations: Optional[Violations] = None, seed: int = 42):
+        self.agent_url = agent_url
+        self.key = key
+        self.rate = rate
+        self.mix = mix or dict(DEFAULT_MIX)
+        self.workers = workers
+        self.services = services or ['wa']  # Used until GET_SERVICES has reported some
+        self.country = country
+        self.operator = operator
+        self.sum_amount = sum_amount
+        self.currency = currency
+        self.sold_fraction = sold_fraction  # Finish with status 3 (sold), otherwise 4 (cancelled)
+        self.repeat_finish = repeat_finish
+        self.exclusion_rate = exclusion_rate
+        self.timeout = timeout
+        self.violations = violations or Violations()
+        self.latency = KeyedStreamStats()
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+        self.live: Dict[int, Dict] = {}  # activationId -> {'number', 'service'}
+        self.finished: deque = deque(maxlen=1000)  # (activationId, status) for repeated finishes
+        self.sold = 0  # Successful GET_NUMBERs so far
+        self._reported: Dict[str, Tuple[int, int]] = {}  # service -> (quantity, self.sold at report)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._local = threading.local()
+
+    def _session(self):
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def call(self, payload: Dict) -> Tuple[Optional[Dict], float]:
+        """POST one protocol request; (response or None on transport error, seconds)."""
+        action = payload['action']
+        started = time.perf_counter()
+        try:
+            response = self._session().post(self.agent_url, json=payload, timeout=self.timeout)
+            result = response.json()
+        except Exception as e:
+            result = None
+            logger.error(f"{action} failed: {e}")
+        elapsed = time.perf_counter() - started
+        self.latency.add(action, elapsed)
+        outcome = result.get('status', 'UNKNOWN') if isinstance(result, dict) else 'TRANSPORT_ERROR'
+        with self._lock:
+            counts = self.outcomes.setdefault(action, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return result if isinstance(result, dict) else None, elapsed
+
+    def get_services(self) -> None:
+        with self._lock:
+            sold_before = self.sold
+        result, _ = self.call({'action': GET_SERVICES, 'key': self.key})
+        if not result or result.get('status') != 'SUCCESS':
+            return
+        quantities = parse_services(result)
+        with self._lock:
+            for service, quantity in quantities.items():
+                if not _is_number(quantity):
+                    self.violations.add('field_type', f"GET_SERVICES {service}={quantity!r}")
+                    continue
+                # Sales that raced the report are not held against it (see get_number)
+                self._reported[service] = (int(quantity), sold_before)
+
+    def _pick_service(self) -> str:
+        with self._lock:
+            offered = [service for service, (quantity, _) in self._reported.items() if quantity > 0]
+        return self._rng.choice(offered or self.services)
+
+    def get_number(self) -> None:
+        service = self._pick_service()
+        exclusions: List[str] = []
+        with self._lock:
+            if self.live and self._rng.random() < self.exclusion_rate:
+                number = str(self._rng.choice(list(self.live.values()))['number'])
+                exclusions = [number[:-1]]  # The ten numbers sharing all but the last digit
+        result, elapsed = self.call({
+            'action': GET_NUMBER, 'key': self.key, 'country': self.country, 'operator': self.operator,
+            'service': service, 'sum': self.sum_amount, 'currency': self.currency,
+            'exceptionPhoneSet': exclusions,
+        })
+        if elapsed > GET_NUMBER_LIMIT:
+            self.violations.add('slow_number', f"GET_NUMBER took {elapsed:.2f}s")
+        if not result:
+            return
+        if result.get('status') == 'NO_NUMBERS':
+            with self._lock:
+                quantity, sold_at = self._reported.get(service, (0, self.sold))
+                # Up to workers - 1 concurrent sales may not have been counted yet
+                unexplained = quantity - (self.sold - sold_at) - (self.workers - 1)
+            if unexplained > 0 and not exclusions:
+                self.violations.add('over_reported',
+                                    f"{service}: reported {quantity}, NO_NUMBERS after {self.sold - sold_at} sales")
+            return
+        if result.get('status') != 'SUCCESS':
+            return
+        number, activation_id = result.get('number'), result.get('activationId')
+        if not _is_number(number) or not _is_number(activation_id):
+            self.violations.add('field_type', f"GET_NUMBER number={number!r} activationId={activation_id!r}")
+            return
+        if any(str(number).startswith(prefix) for prefix in exclusions):
+            self.violations.add('excluded_prefix', f"{number} matches {exclusions}")
+        with self._lock:
+            self.sold += 1
+            if any(live['number'] == number for live in self.live.values()):
+                duplicate = True
+            else:
+                duplicate = False
+            self.live[activation_id] = {'number': number, 'service': service}
+        if duplicate:
+            self.violations.add('duplicate_number', f"{number} handed out while still live")
+
+    def finish_activation(self) -> None:
+        with self._lock:
+            repeat = bool(self.finished) and self._rng.random() < self.repeat_finish
+            if repeat:
+                activation_id, status = self._rng.choice(list(self.finished))
+            elif self.live:
+                # Forget it before the agent frees the number, so a resale is not a "duplicate"
+                activation_id = self._rng.choice(list(self.live))
+                self.live.pop(activation_id)
+                status = 3 if self._rng.random() < self.sold_fraction else 4
+            else:
+                activation_id = None
+        if activation_id is None:
+            self.get_number()  # Nothing to finish yet
+            return
+        result, _ = self.call({'action': FINISH_ACTIVATION, 'key': self.key,
+                               'activationId': activation_id, 'status': status})
+        if result and result.get('status') == 'SUCCESS':
+            if not repeat:
+                with self._lock:
+                    self.finished.append((activation_id, status))
+        elif repeat:
+            self.violations.add('finish_not_idempotent',
+                                f"repeated FINISH of {activation_id}: {result and result.get('status')}")
+
+    def _wait_for_slot(self) -> None:
+        """Pace all workers together to ``rate`` requests per second."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def run(self, duration: float, drain: bool = True) -> None:
+        """Drive the agent for ``duration`` seconds; finish what is still live when ``drain``."""
+        actions = list(self.mix)
+        weights = [self.mix[action] for action in actions]
+        handlers = {GET_SERVICES: self.get_services, GET_NUMBER: self.get_number,
+                    FINISH_ACTIVATION: self.finish_activation}
+        deadline = time.monotonic() + duration
+
+        def worker(seed):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                self._wait_for_slot()
+                handlers[rng.choices(actions, weights)[0]]()
+
+        self._next_slot = time.monotonic()
+        threads = [threading.Thread(target=worker, args=(i,), name=f'fake-hub-{i}') for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if drain:
+            for activation_id in list(self.live):
+                self.live.pop(activation_id, None)
+                self.call({'action': FINISH_ACTIVATION, 'key': self.key,
+                           'activationId': activation_id, 'status': 4})
+
+    def report(self, elapsed: float) -> Dict[str, Dict]:
+        """Per action: count, rate, p50/p99 seconds and outcome counts."""
+        result = {}
+        for action, stats in sorted(self.latency.snapshot_all().items()):
+            if action == KeyedStreamStats.ALL:
+                continue
+            result[action] = {
+                'count': stats['count'],
+                'per_second': stats['count'] / elapsed if elapsed else 0.0,
+                'p50': stats['p50'],
+                'p99': stats['p99'],
+                'outcomes': dict(self.outcomes.get(action, {})),
+            }
+        return result
+
+
+def print_report(driver: Optional[HubDriver], receiver: Optional[PushReceiver],
+                 violations: Violations, elapsed: float) -> None:
+    if driver is not None:
+        print(f"  {'action':<18} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}  outcomes")
+        for action, row in driver.report(elapsed).items():
+            outcomes = ', '.join(f'{status}={count}' for status, count in sorted(row['outcomes'].items()))
+            print(f"  {action:<18} {row['count']:>7} {row['per_second']:>8.1f} "
+                  f"{row['p50'] * 1000:>8.2f} {row['p99'] * 1000:>8.2f}  {outcomes}")
+    if receiver is not None:
+        print('  PUSH_SMS received: ' + ', '.join(f'{name}={count}' for name, count in receiver.counters.items()))
+    if violations.total():
+        print(f"  {violations.total()} protocol violations:")
+        for kind, count in sorted(violations.counts.items()):
+            print(f"    {kind}: {count}  e.g. {violations.examples[kind][0]}")
+    else:
+        print('  no protocol violations')
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'GET_SERVICES=5,GET_NUMBER=3,FINISH_ACTIVATION=2' -> weights."""
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        action = action.strip().upper()
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {action!r}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--agent-url', help='agent endpoint to drive, e.g. http://127.0.0.1:5000/')
+    parser.add_argument('--key', help='protocol key (default: smshub_api_key from config)')
+    parser.add_argument('--rate', type=float, default=10.0, help='agent requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to drive the agent / serve pushes')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='action weights, e.g. GET_SERVICES=5,GET_NUMBER=3,FINISH_ACTIVATION=2')
+    parser.add_argument('--service', action='append', help='service to request before GET_SERVICES answers')
+    parser.add_argument('--repeat-finish', type=float, default=0.2, help='fraction of finishes sent twice')
+    parser.add_argument('--push-port', type=int, help='serve PUSH_SMS on this port')
+    parser.add_argument('--push-latency-ms', type=float, default=0.0)
+    parser.add_argument('--push-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--push-error-rate', type=float, default=0.0, help='fraction answered with HTTP 500')
+    parser.add_argument('--push-reject-rate', type=float, default=0.0, help='fraction answered with status ERROR')
+    args = parser.parse_args()
+    if not args.agent_url and args.push_port is None:
+        parser.error('give --agent-url, --push-port or both')
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    violations = Violations()
+    receiver = None
+    if args.push_port is not None:
+        receiver = PushReceiver(port=args.push_port, latency_ms=args.push_latency_ms,
+                                jitter_ms=args.push_jitter_ms, error_rate=args.push_error_rate,
+                                reject_rate=args.push_reject_rate, violations=violations)
+        print(f"PUSH_SMS endpoint: {receiver.start()}")
+    driver = None
+    started = time.monotonic()
+    try:
+        if args.agent_url:
+            key = args.key
+            if key is None:
+                from config import config
+
+                key = config.get('smshub_api_key')
+            driver = HubDriver(args.agent_url, key, rate=args.rate, mix=args.mix, workers=args.workers,
+                               services=args.service, repeat_finish=args.repeat_finish, violations=violations)
+            driver.run(args.duration)
+        elif args.duration > 0:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if receiver is not None:
+            receiver.stop()
+    print_report(driver, receiver, violations, time.monotonic() - started)
+    return 1 if violations.total() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,7 +7,6 @@ import logging
 from smshub_integration import SmsHubIntegration
 from config import SMSHUB_API_KEY, config
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ModemGUI(ttk.Frame):
@@ -35,6 +34,7 @@ class ModemGUI(ttk.Frame):
         self.success_rate = None
         self.active_numbers = None
         self.avg_response_time = None
+        self.hub_status = None
         
         # Create notebook for tabs
         self.notebook = ttk.Notebook(self.root)
@@ -168,6 +168,13 @@ class ModemGUI(ttk.Frame):
         self.tunnel_url = ttk.Label(public_frame, text="Waiting for connection...", foreground='red')
         self.tunnel_url.pack(side="left", padx=5)
 
+        # SMS Hub delivery (circuit breaker state)
+        hub_frame = ttk.Frame(conn_frame)
+        hub_frame.pack(fill="x", padx=5)
+        ttk.Label(hub_frame, text="SMS Hub Delivery:").pack(side="left", padx=5)
+        self.hub_status = ttk.Label(hub_frame, text="Unknown")
+        self.hub_status.pack(side="left", padx=5)
+
         # System Configuration Frame
         config_frame = ttk.LabelFrame(self.server_tab, text="System Configuration", padding="5")
         config_frame.pack(fill="x", padx=5, pady=5)
@@ -200,7 +207,7 @@ class ModemGUI(ttk.Frame):
         services_frame.pack(fill="both", expand=True, padx=5, pady=5)  # Changed to fill both and expand
 
         # Create Treeview for services with more rows visible
-        columns = ('service', 'quantity', 'active', 'completed', 'cancelled', 'refunded')
+        columns = ('service', 'quantity', 'active', 'completed', 'cancelled', 'refunded', 'demand', 'peak_demand')
         self.services_tree = ttk.Treeview(services_frame, columns=columns, show='headings', height=20)  # Increased height
         
         # Define column headings and widths
@@ -210,7 +217,9 @@ class ModemGUI(ttk.Frame):
             'active': ('Active Rentals', 100),
             'completed': ('Completed', 100),
             'cancelled': ('Cancelled', 100),
-            'refunded': ('Refunded', 100)
+            'refunded': ('Refunded', 100),
+            'demand': ('Demand This Hour', 110),
+            'peak_demand': ('Peak Demand/h (24h)', 130)
         }
         
         for col, (heading, width) in headings.items():
@@ -350,21 +359,23 @@ class ModemGUI(ttk.Frame):
         """Update the server status information."""
         try:
             # Update service statistics
-            services = self.server.get_service_quantities()
+            services = self.server.get_service_dashboard()
             
             # Clear existing items
             for item in self.services_tree.get_children():
                 self.services_tree.delete(item)
             
             # Update services tree
-            for service_name, stats in services.items():
+            for service_name, stats in sorted(services.items()):
                 self.services_tree.insert('', 'end', values=(
                     service_name,
                     stats.get('quantity', 0),  # Number of active modems
                     stats.get('active', 0),    # Active rentals
                     stats.get('completed', 0),
                     stats.get('cancelled', 0),
-                    stats.get('refunded', 0)
+                    stats.get('refunded', 0),
+                    stats.get('demand_this_hour', 0),
+                    stats.get('peak_hourly_demand', 0)
                 ))
             
             # Update performance metrics
@@ -383,30 +394,24 @@ class ModemGUI(ttk.Frame):
                 self.tunnel_url.config(text=tunnel_url, foreground='green')
             else:
                 self.tunnel_url.config(text="Not connected", foreground='red')
+
+            # Update SMS Hub delivery status
+            hub = self.server.get_hub_status()
+            if hub:
+                if hub['state'] == 'closed':
+                    self.hub_status.config(text=f"Up - {hub['pending']} pending", foreground='green')
+                elif hub['state'] == 'half_open':
+                    self.hub_status.config(text=f"Probing - {hub['pending']} pending", foreground='orange')
+                else:
+                    since = time.strftime('%H:%M:%S', time.localtime(hub['open_since'] or time.time()))
+                    self.hub_status.config(
+                        text=f"DOWN since {since}, next probe in {hub['next_probe_in']:.0f}s - "
+                             f"{hub['pending']} pending",
+                        foreground='red')
                 
         except Exception as e:
             logger.error(f"Error updating server status: {e}")
 
-    def process_new_message(self, modem_id: str, message: dict):
-        """Process a new message and update the display."""
-        # Update local display
-        self.refresh_messages()
-        
-        # Get phone number for the modem
-        phone_number = None
-        for item in self.device_tree.get_children():
-            values = self.device_tree.item(item)['values']
-            if values[1] == modem_id:  # COM port
-                phone_number = values[3]  # Phone number
-                break
-        
-        if phone_number and phone_number != 'Not Available':
-            # Add message to server queue
-            self.server.add_message(phone_number, message)
-        
-        # Update device info to reflect any changes
-        self.update_device_info()
-
     def start_update_thread(self):
         def update_loop():
             while True:
@@ -0,0 +1,192 @@
+"""Activation history: binary snapshot of the latest sale per (phone, service) plus a JSONL tail.
+
+Completions are appended to the tail (the legacy ``activation_history.txt``
+format, so existing files load unchanged). Compaction folds the tail into
+the snapshot, keeping only the newest entry per (phone, service), so the
+work done at startup depends on the number of distinct pairs rather than on
+how many sales were ever made.
+
+Snapshot layout (little-endian)::
+
+    header   MAGIC, version, record count, string-table length
+    strings  UTF-8, newline separated (phones, services, ICCIDs)
+    records  RECORD, one per (phone, service)
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SHHS'
+VERSION = 1
+HEADER = struct.Struct('<4sHII')
+# phone, service, timestamp, finish_status, sum, currency, activation_id, iccid
+RECORD = struct.Struct('<IIdbdHqI')
+NO_STRING = 0xFFFFFFFF
+
+
+class HistoryStore:
+    """Latest completed activation per (phone, service), persisted as snapshot + tail."""
+
+    def __init__(self, tail_file: str = 'activation_history.txt', compact_every: int = 10000):
+        self.tail_file = tail_file
+        self.snapshot_file = os.path.splitext(tail_file)[0] + '.snapshot'
+        self.compact_every = compact_every
+        self.latest: Dict[Tuple[str, str], Dict] = {}
+        self.tail_lines = 0  # lines in the tail since the last compaction
+        self._lock = threading.Lock()
+        self._compacting = False
+
+    @property
+    def _rotated_tail(self) -> str:
+        return self.tail_file + '.compacting'
+
+    def load(self) -> List[Dict]:
+        """Read snapshot and tail; returns the latest entry per (phone, service)."""
+        self.latest = {}
+        self.tail_lines = 0
+        self._load_snapshot()
+        # A tail left behind by an interrupted compaction is older than the live one
+        for path in (self._rotated_tail, self.tail_file):
+            self.tail_lines += self._load_tail(path)
+        return list(self.latest.values())
+
+    def _keep(self, entry: Dict) -> None:
+        key = (entry['phone'], entry['service'])
+        current = self.latest.get(key)
+        if current is None or (entry.get('timestamp') or 0) >= (current.get('timestamp') or 0):
+            self.latest[key] = entry
+
+    def _load_snapshot(self) -> None:
+        if not os.path.exists(self.snapshot_file) or os.path.getsize(self.snapshot_file) < HEADER.size:
+            return
+        try:
+            with open(self.snapshot_file, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, version, count, strings_length = HEADER.unpack_from(data, 0)
+                if magic != MAGIC or version != VERSION:
+                    logger.error(f"Unrecognised history snapshot {self.snapshot_file}; ignoring it")
+                    return
+                start = HEADER.size
+                strings = bytes(data[start:start + strings_length]).decode('utf-8').split('\n')
+                start += strings_length
+                view = memoryview(data)[start:start + count * RECORD.size]
+                try:
+                    for (phone, service, timestamp, finish_status, amount,
+                         currency, activation_id, iccid) in RECORD.iter_unpack(view):
+                        key = (strings[phone], strings[service])
+                        self.latest[key] = {
+                            'phone': key[0],
+                            'service': key[1],
+                            'timestamp': timestamp,
+                            'finish_status': finish_status if finish_status >= 0 else None,
+                            'sum': None if math.isnan(amount) else amount,
+                            'currency': currency or None,
+                            'activation_id': activation_id or None,
+                            'iccid': strings[iccid] if iccid != NO_STRING else None,
+                        }
+                finally:
+                    view.release()
+        except (OSError, ValueError, struct.error, IndexError) as e:
+            logger.error(f"Error reading history snapshot {self.snapshot_file}: {e}")
+
+    def _load_tail(self, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        lines = 0
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    data = json.loads(line.strip())
+                except json.JSONDecodeError:
+                    logger.error(f"Error parsing activation history line: {line}")
+                    continue
+                if data.get('phone') and data.get('service'):
+                    self._keep(data)
+                    lines += 1
+        return lines
+
+    def append(self, entry: Dict) -> None:
+        """Append one completed activation; compacts in the background every ``compact_every`` lines."""
+        with self._lock:
+            with open(self.tail_file, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self._keep(entry)
+            self.tail_lines += 1
+            start = self.compact_every and self.tail_lines >= self.compact_every and not self._compacting
+            if start:
+                self._compacting = True
+        if start:
+            threading.Thread(target=self.compact, name='history-compact', daemon=True).start()
+
+    def compact(self) -> None:
+        """Fold the tail into a new snapshot and start an empty tail."""
+        try:
+            with self._lock:
+                self._compacting = True
+                if os.path.exists(self.tail_file):
+                    if os.path.exists(self._rotated_tail):
+                        # Leftover of an interrupted compaction: keep both until the snapshot is written
+                        with open(self.tail_file, 'rb') as src, open(self._rotated_tail, 'ab') as dst:
+                            shutil.copyfileobj(src, dst)
+                        os.remove(self.tail_file)
+                    else:
+                        os.replace(self.tail_file, self._rotated_tail)
+                entries = list(self.latest.values())
+                self.tail_lines = 0
+
+            self._write_snapshot(entries)
+            if os.path.exists(self._rotated_tail):
+                os.remove(self._rotated_tail)
+            logger.info(f"Compacted activation history to {len(entries)} entries")
+        except Exception as e:
+            logger.error(f"Error compacting activation history: {e}")
+        finally:
+            self._compacting = False
+
+    def _write_snapshot(self, entries: List[Dict]) -> None:
+        string_ids: Dict[str, int] = {}
+
+        def string_id(value: Optional[str]) -> int:
+            if value is None:
+                return NO_STRING
+            value = str(value).replace('\n', ' ')
+            if value not in string_ids:
+                string_ids[value] = len(string_ids)
+            return string_ids[value]
+
+        records = bytearray()
+        for entry in entries:
+            finish_status = entry.get('finish_status')
+            amount = entry.get('sum')
+            records += RECORD.pack(
+                string_id(entry['phone']),
+                string_id(entry['service']),
+                float(entry.get('timestamp') or 0),
+                finish_status if isinstance(finish_status, int) and 0 <= finish_status < 128 else -1,
+                float(amount) if isinstance(amount, (int, float)) else math.nan,
+                entry.get('currency') if isinstance(entry.get('currency'), int) and 0 < entry['currency'] < 65536 else 0,
+                entry.get('activation_id') or 0,
+                string_id(entry.get('iccid')),
+            )
+        strings = '\n'.join(string_ids).encode('utf-8')
+
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(entries), len(strings)))
+            f.write(strings)
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    def __len__(self) -> int:
+        return len(self.latest)
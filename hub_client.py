@@ -0,0 +1,147 @@
+"""Pooled HTTP client for requests to the SMS Hub server.
+
+All senders share one ``requests.Session``: connections are kept alive in a
+bounded pool, so a PUSH_SMS normally reuses an open TCP/TLS connection
+instead of handshaking again. Request bodies are gzip-compressed as the
+protocol asks, and hub hostnames are resolved through a small TTL cache
+when a new connection has to be opened.
+"""
+
+import gzip
+import logging
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import allowed_gai_family
+
+from json_codec import get_codec
+
+logger = logging.getLogger(__name__)
+
+
+class DnsCache:
+    """Caches the first resolved address of each (host, port) for ``ttl`` seconds."""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> str:
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        address = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._entries[key] = (address, now + self.ttl)
+        return address
+
+    def forget(self, host: str, port: int) -> None:
+        """Drop a cached address (e.g. connecting to it failed)."""
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+# Shared by every HubClient in the process
+DNS_CACHE = DnsCache()
+
+
+class _CachedDnsConnection:
+    """Connects to the cached address; TLS still verifies against the hostname."""
+
+    def _new_conn(self):
+        hostname = self._dns_host
+        if not DNS_CACHE.ttl:
+            return super()._new_conn()
+        try:
+            self._dns_host = DNS_CACHE.resolve(hostname, self.port)
+        except OSError:
+            return super()._new_conn()  # Let urllib3 report the resolution error
+        try:
+            return super()._new_conn()
+        except Exception:
+            DNS_CACHE.forget(hostname, self.port)
+            raise
+        finally:
+            self._dns_host = hostname
+
+
+class _HTTPConnection(_CachedDnsConnection, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CachedDnsConnection, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _HubAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools open connections through the DNS cache."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _HTTPConnectionPool,
+            'https': _HTTPSConnectionPool,
+        }
+
+
+class HubClient:
+    """Keep-alive session with a bounded connection pool and gzip request bodies."""
+
+    def __init__(self, pool_size: int = 8, gzip_requests: bool = True, gzip_level: int = 6,
+                 headers: Optional[Dict[str, str]] = None, codec: Optional[str] = 'auto'):
+        self.gzip_requests = gzip_requests
+        self.gzip_level = gzip_level
+        self.codec = get_codec(codec)
+        self.session = requests.Session()
+        # pool_block: with every connection busy, wait for one instead of
+        # opening extra connections that are closed again after one request
+        adapter = _HubAdapter(pool_connections=4, pool_maxsize=pool_size,
+                              pool_block=True, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(headers or {})
+
+    def post_json(self, url: str, payload: Any, timeout=None) -> requests.Response:
+        """POST ``payload`` as (gzip-compressed) JSON."""
+        body = self.codec.dumps(payload)
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip_requests:
+            body = gzip.compress(body, compresslevel=self.gzip_level)
+            headers['Content-Encoding'] = 'gzip'
+        return self.session.post(url, data=body, headers=headers, timeout=timeout)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_shared_client: Optional[HubClient] = None
+_shared_lock = threading.Lock()
+
+
+def shared_client(dns_ttl: Optional[float] = None, **options) -> HubClient:
+    """The process-wide HubClient; options apply when it is first created."""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            if dns_ttl is not None:
+                DNS_CACHE.ttl = dns_ttl
+            _shared_client = HubClient(**options)
+        return _shared_client
@@ -0,0 +1,52 @@
+"""Pluggable JSON codec for the request/response hot path."""
+
+import json
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library
+    orjson = None
+
+
+class StdlibCodec:
+    """Compact JSON through the standard library."""
+    name = 'json'
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class OrjsonCodec:
+    """orjson: parses and serialises straight from/to bytes."""
+    name = 'orjson'
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+
+CODECS = {
+    'json': StdlibCodec,
+    'orjson': OrjsonCodec,
+}
+
+
+def get_codec(name: Optional[str] = 'auto'):
+    """Return a codec by name; 'auto' picks the fastest one installed."""
+    if name in (None, 'auto'):
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson' and orjson is None:
+        logger.warning("orjson is not installed; using the standard json codec")
+        name = 'json'
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec: {name}")
+    return CODECS[name]()
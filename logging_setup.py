@@ -0,0 +1,109 @@
+"""Application-wide logging: queue handler, background listener, rotating gzip files."""
+
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from typing import Any, Dict, Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+DEFAULT_LOGGING = {
+    'level': 'INFO',
+    'file': 'activation_log.txt',
+    'max_bytes': 10 * 1024 * 1024,
+    'backup_count': 10,
+    'compress': True,
+    'console': True,
+    'levels': {  # Per-module overrides
+        'werkzeug': 'WARNING',
+        'urllib3': 'WARNING',
+    },
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _gzip_namer(name: str) -> str:
+    return name + '.gz'
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """Compress the rotated file instead of keeping it as plain text."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _build_handlers(settings: Dict[str, Any]):
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+
+    if settings.get('file'):
+        directory = os.path.dirname(settings['file'])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            settings['file'],
+            maxBytes=settings['max_bytes'],
+            backupCount=settings['backup_count'],
+            encoding='utf-8',
+        )
+        if settings.get('compress'):
+            file_handler.namer = _gzip_namer
+            file_handler.rotator = _gzip_rotator
+        handlers.append(file_handler)
+
+    if settings.get('console'):
+        handlers.append(logging.StreamHandler())
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def setup_logging(app_config: Optional[Dict[str, Any]] = None) -> None:
+    """Route all logging through one queue to a background listener thread.
+
+    ``app_config`` is the application config dict; its ``logging`` section
+    overrides DEFAULT_LOGGING and ``debug_mode`` forces the root level to
+    DEBUG. Safe to call more than once: the previous listener is replaced.
+    """
+    global _listener
+    app_config = app_config or {}
+    settings = dict(DEFAULT_LOGGING)
+    settings.update(app_config.get('logging') or {})
+    levels = dict(DEFAULT_LOGGING['levels'])
+    levels.update(settings.get('levels') or {})
+
+    if _listener is not None:
+        _listener.stop()
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel('DEBUG' if app_config.get('debug_mode') else settings['level'])
+
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *_build_handlers(settings), respect_handler_level=True
+    )
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -1,22 +1,14 @@
 import tkinter as tk
-from modem_manager import ModemManager
 from smshub_server import SmsHubServer
 from smshub_integration import SmsHubIntegration
+from sms_pipeline import SmsPipeline
 from gui import ModemGUI
 from config import config
 import logging
 import threading
 import time
 
-# Configure logging to write to a file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("activation_log.txt"),
-        logging.StreamHandler()
-    ]
-)
+# Logging (rotating activation_log.txt + console) is configured by config.py
 logger = logging.getLogger(__name__)  # Add logger definition
 
 def main():
@@ -29,8 +21,8 @@ def main():
         
         # Initialize server with SMS Hub integration
         logger.info("Starting SMS Hub Agent server...")
-        server = SmsHubServer()
-        server.smshub = smshub  # Link SMS Hub to server
+        server = SmsHubServer(scan_modems=False)  # Scanning starts below, once the GUI is ready
+        smshub.attach_server(server)  # Link SMS Hub to server (shares its SMS routing index)
         
         # Start server in a separate thread
         server_thread = threading.Thread(target=server.run, daemon=True)
@@ -40,9 +32,8 @@ def main():
         # Give the server a moment to start
         time.sleep(1)
         
-        # Initialize modem manager with server reference
-        logger.info("Initializing modem manager...")
-        modem_manager = ModemManager(server=server)
+        # The server's modem manager is the only one: scanner, pipeline and GUI share its port locks
+        modem_manager = server.modem_manager
         
         # Create GUI first so it's ready to show updates
         logger.info("Starting GUI...")
@@ -52,8 +43,27 @@ def main():
         logger.info("Starting modem scanning...")
         modem_manager.start()  # This will trigger automatic registration of any found modems
         
-        # Run the GUI main loop
-        app.run()
+        pipeline = None
+        if config.get('sms_pipeline', True):
+            logger.info("Starting SMS pipeline...")
+            pipeline = SmsPipeline(
+                modem_manager, smshub,
+                poll_interval=config.get('sms_poll_interval', 5.0),
+                queue_size=config.get('sms_pipeline_queue_size', 1000),
+                receive_threads=config.get('sms_receive_threads', 4),
+                delete_delivered=config.get('delete_delivered_sms', True)
+            )
+            pipeline.start()
+        
+        # Run the GUI main loop; closing the window (or Ctrl+C) shuts everything down
+        try:
+            app.run()
+        finally:
+            logger.info("Shutting down...")
+            if pipeline is not None:
+                pipeline.stop()  # SMS already stored stay in the outbox
+            modem_manager.stop()
+            server.stop()  # Stops accepting, lets in-flight hub requests finish
         
     except Exception as e:
         logger.error(f"Error in main: {e}")
@@ -0,0 +1,228 @@
+"""In-process metrics registry with Prometheus text exposition.
+
+Updates never take a shared lock: every thread writes to its own shard
+(a plain dict reached through threading.local) and shards are only summed
+when the registry is rendered. A lock is taken once per thread per metric,
+when that thread's shard is created; shards of finished threads are folded
+into a retired total so thread-per-request servers do not grow the list.
+"""
+
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Sharded:
+    """Per-thread storage shared by counters and histograms."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict = {}  # merged values of threads that have exited
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                if len(self._shards) >= 256:
+                    self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def _retire_dead_shards(self) -> None:
+        """Fold shards of finished threads into the retired total (lock held)."""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for key, value in list(shard.items()):
+                    self._fold(self._retired, key, value)
+        self._shards = live
+
+    def _fold(self, target: Dict, key: Tuple, value) -> None:
+        raise NotImplementedError
+
+    def _snapshot(self) -> List[List[Tuple]]:
+        with self._shards_lock:
+            self._retire_dead_shards()
+            snapshot = [list(self._retired.items())]
+            snapshot.extend(list(shard.items()) for _, shard in self._shards)
+        return snapshot
+
+
+class Counter(_Sharded):
+    """Monotonically increasing value per label set."""
+    kind = 'counter'
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def _fold(self, target: Dict, key: Tuple, value) -> None:
+        target[key] = target.get(key, 0) + value
+
+    def values(self) -> Dict[Tuple, float]:
+        """Totals per label set, summed across threads."""
+        totals: Dict[Tuple, float] = {}
+        for items in self._snapshot():
+            for key, value in items:
+                self._fold(totals, key, value)
+        return totals
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in sorted(self.values().items())]
+
+
+class Histogram(_Sharded):
+    """Bucketed distribution (e.g. request latency in seconds) per label set."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values) -> None:
+        shard = self._shard()
+        entry = shard.get(label_values)
+        if entry is None:
+            # [per-bucket counts..., +Inf count, sum]
+            entry = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def _fold(self, target: Dict, key: Tuple, entry) -> None:
+        merged = target.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, value in enumerate(list(entry)):
+            merged[i] += value
+
+    def values(self) -> Dict[Tuple, List[float]]:
+        """Merged [bucket counts..., +Inf count, sum] per label set."""
+        merged: Dict[Tuple, List[float]] = {}
+        for items in self._snapshot():
+            for key, entry in items:
+                self._fold(merged, key, entry)
+        return merged
+
+    def summary(self, *label_values) -> Tuple[int, float]:
+        """(count, sum) for one label set."""
+        entry = self.values().get(label_values)
+        if not entry:
+            return 0, 0.0
+        return int(sum(entry[:-1])), entry[-1]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, entry in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(entry[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """Point-in-time value, either set directly or read from a callback at render time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.callback = callback
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, *label_values) -> None:
+        # A single dict store is atomic; no lock needed
+        self._values[label_values] = value
+
+    def values(self) -> Dict[Tuple, float]:
+        if self.callback is None:
+            return dict(self._values)
+        result = self.callback()
+        if isinstance(result, dict):
+            return {key if isinstance(key, tuple) else (key,): value for key, value in result.items()}
+        return {(): result}
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in sorted(self.values().items())]
+
+
+class MetricsRegistry:
+    """Named collection of metrics; creating an existing name returns it."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], object]] = None) -> Gauge:
+        gauge = self._get_or_create(name, lambda: Gauge(name, help_text, labels, callback))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def render(self) -> str:
+        """Text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry
+registry = MetricsRegistry()
@@ -3,11 +3,35 @@ import time
 import threading
 import serial.tools.list_ports
 import re
+import calendar
 from typing import Dict, Optional, List
 from config import config
 
 logger = logging.getLogger(__name__)
 
+# One lock per serial port, shared by every ModemManager in the process
+_port_locks: Dict[str, threading.Lock] = {}
+_port_locks_lock = threading.Lock()
+
+_SMS_TIMESTAMP = re.compile(r'(\d{2})/(\d{2})/(\d{2}),(\d{2}):(\d{2}):(\d{2})([+-]\d{1,2})?')
+
+
+def parse_sms_timestamp(timestamp: str) -> Optional[float]:
+    """Epoch seconds of a +CMGL service-centre timestamp ("yy/MM/dd,hh:mm:ss+zz").
+
+    ``zz`` is the UTC offset in quarter hours. None if it cannot be parsed.
+    """
+    match = _SMS_TIMESTAMP.match(timestamp or '')
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(part) for part in match.groups()[:6])
+    try:
+        utc = calendar.timegm((2000 + year, month, day, hour, minute, second, 0, 0, 0))
+    except (ValueError, OverflowError):
+        return None
+    return utc - int(match.group(7) or 0) * 900
+
+
 class ModemManager:
     def __init__(self, server=None):
         self.modems: Dict[str, Dict] = {}  # port -> modem_info
@@ -16,6 +40,15 @@ class ModemManager:
         self.server = server  # Add server reference
         self.connected_modems = set()  # Track connected modems
 
+    @staticmethod
+    def _port_lock(port: str) -> threading.Lock:
+        """Lock serializing access to ``port`` (scanner, SMS readers and GUI commands share it)."""
+        with _port_locks_lock:
+            lock = _port_locks.get(port)
+            if lock is None:
+                lock = _port_locks[port] = threading.Lock()
+            return lock
+
     def start(self):
         """Start modem scanning."""
         self.running = True
@@ -145,8 +178,7 @@ class ModemManager:
         """Initialize and add a new modem."""
         try:
             logger.debug(f"Attempting to add modem on port {port.device}")
-            modem = serial.Serial(port.device, baudrate=115200, timeout=1)
-            
+
             # Initialize modem
             commands = [
                 ('AT', 0.1),  # Basic AT command
@@ -160,12 +192,17 @@ class ModemManager:
             ]
             
             responses = {}
-            for cmd, delay in commands:
-                modem.write(f"{cmd}\r\n".encode())
-                time.sleep(delay)
-                response = modem.read_all().decode('utf-8', errors='ignore')
-                responses[cmd] = response
-                logger.debug(f"Command {cmd} response: {response}")
+            with self._port_lock(port.device):
+                modem = serial.Serial(port.device, baudrate=115200, timeout=1)
+                try:
+                    for cmd, delay in commands:
+                        modem.write(f"{cmd}\r\n".encode())
+                        time.sleep(delay)
+                        response = modem.read_all().decode('utf-8', errors='ignore')
+                        responses[cmd] = response
+                        logger.debug(f"Command {cmd} response: {response}")
+                finally:
+                    modem.close()
             
             # Parse responses
             imsi = self._parse_at_response(responses['AT+CIMI'], '+CIMI')
@@ -217,8 +254,6 @@ class ModemManager:
             else:
                 logger.debug(f"Skipping port {port.device}: No valid phone number and not a Franklin T9 modem")
 
-            modem.close()
-            
         except Exception as e:
             logger.error(f"Error adding modem on port {port.device}: {e}")
 
@@ -286,53 +321,83 @@ class ModemManager:
     def check_sms(self, port: str) -> List[Dict]:
         """Check for SMS messages on a specific modem."""
         try:
-            if port not in self.modems:
-                logger.error(f"Port {port} not found in modems")
-                return []
+            response = self.read_sms(port)
+            return self.parse_sms_list(response) if response else []
+        except Exception as e:
+            logger.error(f"Error checking SMS on port {port}: {e}")
+            return []
+
+    def read_sms(self, port: str) -> Optional[str]:
+        """Raw AT+CMGL="ALL" response of a modem (text mode); None if the port is unknown."""
+        if port not in self.modems:
+            logger.error(f"Port {port} not found in modems")
+            return None
 
+        with self._port_lock(port):
             modem = serial.Serial(port, baudrate=115200, timeout=1)
-            messages = []
-
-            # Set text mode
-            modem.write(b'AT+CMGF=1\r\n')
-            time.sleep(0.1)
-            modem.read_all()  # Clear buffer
-
-            # List all messages
-            modem.write(b'AT+CMGL="ALL"\r\n')
-            time.sleep(0.5)
-            response = modem.read_all().decode('utf-8', errors='ignore')
-
-            # Parse messages
-            msg_lines = response.split('\r\n')
-            current_msg = None
-
-            for line in msg_lines:
-                if line.startswith('+CMGL:'):
-                    if current_msg:
-                        messages.append(current_msg)
-                    # Parse message header
-                    parts = line.split(',')
-                    if len(parts) >= 4:
-                        current_msg = {
-                            'index': parts[0].split(':')[1].strip(),
-                            'status': parts[1].strip('"'),
-                            'sender': parts[2].strip('"'),
-                            'timestamp': parts[4].strip('"') if len(parts) > 4 else '',
-                            'text': ''
-                        }
-                elif line.strip() and current_msg:
-                    current_msg['text'] = line.strip()
-
-            if current_msg:
-                messages.append(current_msg)
-
-            modem.close()
-            return messages
+            try:
+                # Set text mode
+                modem.write(b'AT+CMGF=1\r\n')
+                time.sleep(0.1)
+                modem.read_all()  # Clear buffer
+
+                # List all messages
+                modem.write(b'AT+CMGL="ALL"\r\n')
+                time.sleep(0.5)
+                return modem.read_all().decode('utf-8', errors='ignore')
+            finally:
+                modem.close()
+
+    @staticmethod
+    def parse_sms_list(response: str) -> List[Dict]:
+        """Parse a text-mode AT+CMGL response into messages."""
+        messages = []
+        current_msg = None
 
+        lines = response.split('\r\n')
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if lines and (lines[-1].strip() in ('OK', 'ERROR') or lines[-1].startswith('+CMS ERROR')):
+            lines.pop()  # Final result code; a message body may itself read "OK"
+
+        for line in lines:
+            if line.startswith('+CMGL:'):
+                if current_msg:
+                    messages.append(current_msg)
+                # Parse message header
+                parts = line.split(',')
+                if len(parts) >= 4:
+                    current_msg = {
+                        'index': parts[0].split(':')[1].strip(),
+                        'status': parts[1].strip('"'),
+                        'sender': parts[2].strip('"'),
+                        # The timestamp itself contains a comma ("yy/MM/dd,hh:mm:ss+zz")
+                        'timestamp': ','.join(parts[4:]).strip('"') if len(parts) > 4 else '',
+                        'text': ''
+                    }
+            elif line.strip() and current_msg:
+                # Multi-line bodies keep their line breaks
+                text = line.strip()
+                current_msg['text'] = f"{current_msg['text']}\n{text}" if current_msg['text'] else text
+
+        if current_msg:
+            messages.append(current_msg)
+        return messages
+
+    def delete_sms(self, port: str, index: str) -> bool:
+        """Delete message ``index`` from the modem's storage."""
+        try:
+            with self._port_lock(port):
+                modem = serial.Serial(port, baudrate=115200, timeout=1)
+                try:
+                    modem.write(f'AT+CMGD={index}\r\n'.encode())
+                    time.sleep(0.1)
+                    return 'OK' in modem.read_all().decode('utf-8', errors='ignore')
+                finally:
+                    modem.close()
         except Exception as e:
-            logger.error(f"Error checking SMS on port {port}: {e}")
-            return []
+            logger.error(f"Error deleting SMS {index} on port {port}: {e}")
+            return False
 
     def send_at_command(self, port: str, command: str) -> str:
         """Send AT command to modem and return response."""
@@ -340,18 +405,19 @@ class ModemManager:
             if port not in self.modems:
                 return "Error: Port not found"
 
-            modem = serial.Serial(port, baudrate=115200, timeout=1)
-            
             # Add AT prefix if not present
             if not command.upper().startswith('AT'):
                 command = 'AT' + command
 
-            # Send command
-            modem.write(f"{command}\r\n".encode())
-            time.sleep(0.5)
-            response = modem.read_all().decode('utf-8', errors='ignore')
-            
-            modem.close()
+            with self._port_lock(port):
+                modem = serial.Serial(port, baudrate=115200, timeout=1)
+                try:
+                    # Send command
+                    modem.write(f"{command}\r\n".encode())
+                    time.sleep(0.5)
+                    response = modem.read_all().decode('utf-8', errors='ignore')
+                finally:
+                    modem.close()
             return response.strip()
 
         except Exception as e:
@@ -371,8 +437,8 @@ class ModemManager:
         """Connect to all modems."""
         for port in self.modems:
             try:
-                modem = serial.Serial(port, baudrate=115200, timeout=1)
-                modem.close()
+                with self._port_lock(port):
+                    serial.Serial(port, baudrate=115200, timeout=1).close()
                 self.connected_modems.add(port)
                 logger.info(f"Connected to modem on port {port}")
             except Exception as e:
@@ -386,7 +452,7 @@ class ModemManager:
     def _get_imei(self, port) -> str:
         """Get IMEI from modem."""
         try:
-            with serial.Serial(port.device, baudrate=115200, timeout=1) as modem:
+            with self._port_lock(port.device), serial.Serial(port.device, baudrate=115200, timeout=1) as modem:
                 modem.write(b'AT+CGSN\r\n')
                 time.sleep(0.1)
                 response = modem.read_all().decode('utf-8', errors='ignore')
@@ -400,7 +466,7 @@ class ModemManager:
     def _get_phone_number(self, port) -> str:
         """Get phone number from modem."""
         try:
-            with serial.Serial(port.device, baudrate=115200, timeout=1) as modem:
+            with self._port_lock(port.device), serial.Serial(port.device, baudrate=115200, timeout=1) as modem:
                 modem.write(b'AT+CNUM\r\n')
                 time.sleep(0.1)
                 response = modem.read_all().decode('utf-8', errors='ignore')
@@ -414,7 +480,7 @@ class ModemManager:
     def _get_signal_strength(self, port) -> str:
         """Get signal strength from modem."""
         try:
-            with serial.Serial(port.device, baudrate=115200, timeout=1) as modem:
+            with self._port_lock(port.device), serial.Serial(port.device, baudrate=115200, timeout=1) as modem:
                 modem.write(b'AT+CSQ\r\n')
                 time.sleep(0.1)
                 response = modem.read_all().decode('utf-8', errors='ignore')
@@ -0,0 +1,93 @@
+"""Thread-safe registry of sellable modems."""
+
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModemPool:
+    """Phone -> modem info registry with atomic reservation.
+
+    Every status change goes through one lock, and the set of free phones is
+    kept as an insertion-ordered dict so a reservation does not have to scan
+    busy modems while holding it.
+    """
+
+    def __init__(self):
+        self.modems: Dict[str, Dict] = {}  # phone -> modem_info
+        self._free: Dict[str, None] = {}  # phones with status 'active', in order
+        self._lock = threading.Lock()
+
+    def register(self, phone: str, modem_info: dict, activation_id: Optional[int] = None) -> None:
+        """Add or replace a modem, keeping any reservation it already holds.
+
+        ``activation_id`` marks the modem busy for an activation recovered
+        after a restart, before the modem was seen again.
+        """
+        with self._lock:
+            current = self.modems.get(phone)
+            if current and current.get('status') == 'busy':
+                modem_info['status'] = 'busy'
+                modem_info['activation_id'] = current.get('activation_id')
+            elif activation_id is not None and modem_info.get('status') == 'active':
+                modem_info['status'] = 'busy'
+                modem_info['activation_id'] = activation_id
+            self.modems[phone] = modem_info
+            if modem_info.get('status') == 'active':
+                self._free[phone] = None
+            else:
+                self._free.pop(phone, None)
+
+    def unregister(self, phone: str) -> Optional[Dict]:
+        """Remove a modem from the pool."""
+        with self._lock:
+            self._free.pop(phone, None)
+            return self.modems.pop(phone, None)
+
+    def reserve(self, exclude_prefixes: Iterable = (),
+                exclude: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """Atomically claim a free modem and mark it busy.
+
+        ``exclude`` is an optional predicate for phones that must be skipped
+        (e.g. already used for the requested service). Returns the phone
+        number, or None if no free modem matches.
+        """
+        prefixes = tuple(str(prefix) for prefix in exclude_prefixes or ())
+        with self._lock:
+            for phone in self._free:
+                if prefixes and phone.startswith(prefixes):
+                    continue
+                if exclude is not None and exclude(phone):
+                    continue
+                del self._free[phone]
+                self.modems[phone]['status'] = 'busy'
+                return phone
+        return None
+
+    def release(self, phone: str, activation_id: Optional[int] = None) -> bool:
+        """Return a busy modem to the free pool.
+
+        When ``activation_id`` is given the modem is only released if it is
+        still held by that activation.
+        """
+        with self._lock:
+            modem = self.modems.get(phone)
+            if not modem or modem.get('status') != 'busy':
+                return False
+            if activation_id is not None and modem.get('activation_id') != activation_id:
+                return False
+            modem['status'] = 'active'
+            modem.pop('activation_id', None)
+            self._free[phone] = None
+            return True
+
+    def free_count(self) -> int:
+        """Number of modems currently available for sale."""
+        return len(self._free)
+
+    def free_phones(self) -> List[str]:
+        """Snapshot of phones currently available for sale."""
+        with self._lock:
+            return list(self._free)
@@ -0,0 +1,324 @@
+"""Replay recorded hub traffic from the API request logs against an agent.
+
+Reads ``logs/api/api_requests_*.jsonl`` (compact records written by
+APILogger) and the older ``api_requests_*.log`` files (multi-line JSON
+blocks after "Incoming Request:" / "API Response:"), streaming them into a
+trace of protocol requests that is replayed either in-process against
+``SmsHubServer.app`` with a fake fleet, or over HTTP against a running
+agent. Requests are sent on the original schedule divided by ``--speed``
+(0: as fast as the agent answers), independently of how long earlier
+requests take. Reports per-action p50/p99 latency and errors.
+
+The recorded key is replaced with the target's key, and activation ids in
+FINISH_ACTIVATION are mapped to the ids the replayed GET_NUMBERs returned
+(this needs the recorded responses, which only the compact format links
+to their requests). Actions thinned out by ``api_log_sample_rates``
+(GET_SERVICES by default) are replayed only as often as they were logged.
+
+Usage:
+    python replay_logs.py logs/api [--modems 200] [--speed 10]
+    python replay_logs.py logs/api/api_requests_2024-12-12.log --url http://127.0.0.1:5000/ --speed 0
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from stream_stats import KeyedStreamStats
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_MARKER = 'Incoming Request:'
+_RESPONSE_MARKER = 'API Response:'
+
+
+def log_files(paths: Iterable[str]) -> List[str]:
+    """Expand directories to their API logs, oldest date first."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = glob.glob(os.path.join(path, 'api_requests_*.log')) + \
+                glob.glob(os.path.join(path, 'api_requests_*.jsonl'))
+            files.extend(sorted(found))
+        else:
+            files.append(path)
+    return files
+
+
+def _epoch(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _iter_block_records(f) -> Iterator[Dict]:
+    """Records of the multi-line format: a marker line opening a pretty-printed JSON object."""
+    kind, lines = None, []
+    for line in f:
+        if kind is None:
+            for marker, record_type in ((_REQUEST_MARKER, 'request'), (_RESPONSE_MARKER, 'response')):
+                position = line.find(marker)
+                if position != -1:
+                    kind, lines = record_type, [line[position + len(marker):]]
+                    break
+            continue
+        lines.append(line)
+        if line.rstrip() == '}':  # Closing brace of the top-level object (indented output)
+            try:
+                record = json.loads(''.join(lines))
+            except ValueError:
+                continue  # A nested closing brace; keep reading
+            record['type'] = kind
+            kind, lines = None, []
+            yield record
+
+
+def iter_log_records(paths: Iterable[str]) -> Iterator[Dict]:
+    """Stream request/response records from API logs of either format."""
+    for path in log_files(paths):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            if path.endswith('.jsonl'):
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping malformed line in {path}")
+            else:
+                yield from _iter_block_records(f)
+
+
+def load_trace(paths: Iterable[str], actions: Optional[List[str]] = None,
+               window: int = 1000) -> Iterator[Dict]:
+    """Protocol requests in log order: {'timestamp', 'action', 'body', 'response'}.
+
+    Requests wait up to ``window`` records for their response (matched by
+    id) so a FINISH_ACTIVATION can be mapped to the GET_NUMBER it closes.
+    """
+    pending: 'OrderedDict[object, Dict]' = OrderedDict()
+    unmatched = 0  # Records without an id get unique keys
+
+    def ready(keep: int = window):
+        """Pop requests from the head that have their response or have waited long enough."""
+        while pending:
+            key, entry = next(iter(pending.items()))
+            if entry['response'] is None and len(pending) <= keep:
+                return
+            del pending[key]
+            yield entry
+
+    for record in iter_log_records(paths):
+        if record.get('type') == 'response':
+            entry = pending.get(record.get('id'))
+            if entry is not None and isinstance(record.get('body'), dict):
+                entry['response'] = record['body']
+            yield from ready()
+            continue
+        body = record.get('body')
+        if record.get('type') != 'request' or record.get('method', 'POST') != 'POST' \
+                or not isinstance(body, dict) or not body.get('action'):
+            continue
+        if actions and body['action'] not in actions:
+            continue
+        key = record.get('id')
+        if key is None:
+            unmatched += 1
+            key = ('unmatched', unmatched)
+        pending[key] = {'timestamp': _epoch(record['timestamp']), 'action': body['action'],
+                        'body': body, 'response': None}
+        yield from ready()
+    yield from ready(keep=0)
+
+
+class Replayer:
+    """Sends trace entries to an agent on the recorded schedule and collects latency."""
+
+    def __init__(self, send, key: Optional[str] = None, speed: float = 1.0, concurrency: int = 16):
+        self.send = send  # body -> response dict (raises on transport errors)
+        self.key = key
+        self.speed = speed
+        self.concurrency = concurrency
+        self.latency = KeyedStreamStats()
+        self.lag = KeyedStreamStats()  # Seconds requests went out behind schedule
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}  # action -> error message -> count
+        self.activation_ids: Dict[int, int] = {}  # Recorded activationId -> replayed one
+        self._lock = threading.Lock()
+
+    def _prepare(self, entry: Dict) -> Dict:
+        body = dict(entry['body'])
+        if self.key is not None:
+            body['key'] = self.key
+        if body['action'] == 'FINISH_ACTIVATION':
+            body['activationId'] = self.activation_ids.get(body.get('activationId'), body.get('activationId'))
+        return body
+
+    def _error(self, action: str, message: str) -> None:
+        with self._lock:
+            messages = self.errors.setdefault(action, {})
+            messages[message] = messages.get(message, 0) + 1
+
+    def _run_one(self, entry: Dict, due: float) -> None:
+        action = entry['action']
+        body = self._prepare(entry)
+        started = time.perf_counter()
+        self.lag.add(action, max(0.0, time.monotonic() - due))
+        try:
+            result = self.send(body)
+        except Exception as e:
+            self.latency.add(action, time.perf_counter() - started)
+            self._error(action, f'{type(e).__name__}: {e}')
+            return
+        self.latency.add(action, time.perf_counter() - started)
+        status = result.get('status') if isinstance(result, dict) else None
+        if status == 'ERROR' or status is None:
+            self._error(action, str(result.get('error') if isinstance(result, dict) else result))
+        recorded = entry['response'] or {}
+        if action == 'GET_NUMBER' and status == 'SUCCESS' and 'activationId' in recorded:
+            with self._lock:
+                self.activation_ids[recorded['activationId']] = result.get('activationId')
+
+    def run(self, trace: Iterable[Dict], limit: Optional[int] = None) -> float:
+        """Replay ``trace``; returns the wall-clock seconds it took."""
+        slots = threading.BoundedSemaphore(self.concurrency * 4)  # Bounds requests queued behind the agent
+        started = time.monotonic()
+        first = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for n, entry in enumerate(trace):
+                if limit is not None and n >= limit:
+                    break
+                if first is None:
+                    first = entry['timestamp']
+                due = started
+                if self.speed:
+                    due += (entry['timestamp'] - first) / self.speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                slots.acquire()
+                with self._lock:
+                    self.counts[entry['action']] = self.counts.get(entry['action'], 0) + 1
+
+                def task(entry=entry, due=due):
+                    try:
+                        self._run_one(entry, due)
+                    finally:
+                        slots.release()
+
+                pool.submit(task)
+        return time.monotonic() - started
+
+    def report(self) -> Dict[str, Dict]:
+        """Per action: count, p50/p99 latency and schedule lag (seconds), errors."""
+        result = {}
+        for action in sorted(self.counts):
+            latency = self.latency.snapshot(action)
+            result[action] = {
+                'count': self.counts[action],
+                'p50': latency['p50'],
+                'p99': latency['p99'],
+                'lag_p99': self.lag.snapshot(action)['p99'],
+                'errors': sum(self.errors.get(action, {}).values()),
+                'error_messages': dict(self.errors.get(action, {})),
+            }
+        return result
+
+
+def http_sender(url: str, timeout: float = 10.0):
+    """Send protocol requests to a running agent (one keep-alive session per thread)."""
+    import requests
+
+    local = threading.local()
+
+    def send(body: Dict) -> Dict:
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        response = session.post(url, json=body, timeout=timeout)
+        return response.json()
+
+    return send
+
+
+def in_process_sender(app):
+    """Send protocol requests straight into a Flask app."""
+    local = threading.local()
+
+    def send(body: Dict) -> Dict:
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        return client.post('/', json=body).get_json()
+
+    return send
+
+
+def print_report(report: Dict[str, Dict], elapsed: float) -> None:
+    print(f"  {'action':<18} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'errors':>7}")
+    for action, row in report.items():
+        print(f"  {action:<18} {row['count']:>7} {row['count'] / elapsed:>8.1f} {row['p50'] * 1000:>8.2f} "
+              f"{row['p99'] * 1000:>8.2f} {row['lag_p99'] * 1000:>8.1f} {row['errors']:>7}")
+        for message, count in sorted(row['error_messages'].items(), key=lambda item: -item[1])[:3]:
+            print(f"      {count} x {message}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='API log files or directories (e.g. logs/api)')
+    parser.add_argument('--url', help='replay over HTTP against this agent instead of in-process')
+    parser.add_argument('--modems', type=int, default=200, help='fake fleet size (in-process)')
+    parser.add_argument('--key', help='protocol key to send (default: smshub_api_key from config)')
+    parser.add_argument('--speed', type=float, default=1.0, help='N times the recorded pace; 0 = no pacing')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--actions', help='comma-separated actions to replay (default: all)')
+    parser.add_argument('--limit', type=int, help='replay at most this many requests')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--log', action='store_true', help='keep application logging enabled')
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(path) for path in args.paths]
+    report_path = os.path.abspath(args.json) if args.json else None
+    if not args.log:
+        logging.disable(logging.CRITICAL)
+    if args.url:
+        from config import config
+
+        send = http_sender(args.url)
+        target = args.url
+    else:
+        # Same throwaway directory as the benchmarks: the real state and logs stay untouched
+        from benchmark import isolated_workdir, make_server
+
+        isolated_workdir()
+        from config import config
+
+        send = in_process_sender(make_server(args.modems).app)
+        target = f'in-process agent with {args.modems} modems'
+
+    replayer = Replayer(send, key=args.key or config.get('smshub_api_key'), speed=args.speed,
+                        concurrency=args.concurrency)
+    actions = args.actions.split(',') if args.actions else None
+    pace = f'{args.speed:g}x recorded pace' if args.speed else 'no pacing'
+    print(f"Replaying {', '.join(args.paths)} against {target} ({pace})")
+    elapsed = replayer.run(load_trace(paths, actions), limit=args.limit)
+    report = replayer.report()
+    print_report(report, elapsed)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({'elapsed': elapsed, 'actions': report}, f, indent=2)
+    return 1 if any(row['errors'] for row in report.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""Per-service rules for selling a phone number again after it was used."""
+
+import logging
+from typing import Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+NEVER = 'never'      # Never offer the number for the service again
+ROTATED = 'rotated'  # Offer it again once the number moves to another SIM (ICCID)
+AFTER = 'after'      # Offer it again after a cooldown
+
+DEFAULT_RULE = NEVER
+
+
+class ReusePolicy:
+    """Resolves the reuse rule of each service.
+
+    ``rules`` maps a service code (or ``'*'`` for the default) to
+    ``"never"``, ``"rotated"`` or a number of days, e.g.
+    ``{"*": "never", "wa": 30, "tg": "rotated"}``.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Union[str, int, float]]] = None):
+        rules = dict(rules or {})
+        self.default = self._parse('*', rules.pop('*', DEFAULT_RULE))
+        self.rules = {service: self._parse(service, rule) for service, rule in rules.items()}
+
+    @staticmethod
+    def _parse(service: str, rule) -> Tuple[str, Optional[float]]:
+        if rule in (NEVER, ROTATED):
+            return rule, None
+        if isinstance(rule, (int, float)) and not isinstance(rule, bool) and rule >= 0:
+            return AFTER, float(rule) * 86400
+        logger.warning(f"Invalid reuse rule for {service}: {rule!r}; using '{NEVER}'")
+        return NEVER, None
+
+    def mode(self, service: str) -> str:
+        return self.rules.get(service, self.default)[0]
+
+    def reusable_at(self, service: str, used_at: float) -> Optional[float]:
+        """When a number used at ``used_at`` may be sold again; None if not by time."""
+        mode, cooldown = self.rules.get(service, self.default)
+        return used_at + cooldown if mode == AFTER else None
@@ -0,0 +1,197 @@
+"""Compact phone x service usage matrix.
+
+Service codes are interned to small integers so each phone needs one row
+of bits instead of a dict of service strings. Counting "phones not yet
+used for service S" for every service at once is a single column sum.
+"""
+
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # Pure-Python bitmaps are used instead
+    np = None
+
+
+class _ServiceIds:
+    """Interns service codes to dense integer ids."""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def intern(self, service: str) -> int:
+        service_id = self._ids.get(service)
+        if service_id is None:
+            service_id = self._ids[service] = len(self._names)
+            self._names.append(service)
+        return service_id
+
+    def get(self, service: str) -> Optional[int]:
+        return self._ids.get(service)
+
+    def name(self, service_id: int) -> str:
+        return self._names[service_id]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class _ServiceIndex:
+    """Storage-independent part of the index: interning and counting."""
+
+    def __init__(self):
+        self.services = _ServiceIds()
+        self._lock = threading.Lock()
+
+    def _used_counts(self, phones: Iterable[str]) -> List[int]:
+        """Per service id, how many of ``phones`` have used it."""
+        raise NotImplementedError
+
+    def available_counts(self, phones: Iterable[str], services: Iterable[str]) -> Dict[str, int]:
+        """{service: number of ``phones`` that have not been used for it}."""
+        phones = list(phones)
+        used = self._used_counts(phones)
+        result = {}
+        for service in services:
+            service_id = self.services.get(service)
+            result[service] = len(phones) - (used[service_id] if service_id is not None else 0)
+        return result
+
+
+class BitmapServiceIndex(_ServiceIndex):
+    """One Python int per phone; bit ``i`` set means service ``i`` was used."""
+    name = 'bitmap'
+
+    def __init__(self):
+        super().__init__()
+        self._rows: Dict[str, int] = {}
+
+    def mark_used(self, phone: str, service: str) -> None:
+        with self._lock:
+            bit = 1 << self.services.intern(service)
+            self._rows[phone] = self._rows.get(phone, 0) | bit
+
+    def clear(self, phone: str, service: str) -> None:
+        """Make ``phone`` available for ``service`` again."""
+        with self._lock:
+            service_id = self.services.get(service)
+            row = self._rows.get(phone)
+            if service_id is None or row is None:
+                return
+            row &= ~(1 << service_id)
+            if row:
+                self._rows[phone] = row
+            else:
+                del self._rows[phone]
+
+    def is_used(self, phone: str, service: str) -> bool:
+        service_id = self.services.get(service)
+        return service_id is not None and bool(self._rows.get(phone, 0) >> service_id & 1)
+
+    def used_services(self, phone: str) -> List[str]:
+        row = self._rows.get(phone, 0)
+        result = []
+        while row:
+            low = row & -row
+            result.append(self.services.name(low.bit_length() - 1))
+            row ^= low
+        return result
+
+    def _used_counts(self, phones: Iterable[str]) -> List[int]:
+        counts = [0] * len(self.services)
+        with self._lock:
+            rows = [self._rows.get(phone, 0) for phone in phones]
+        for row in rows:
+            while row:  # Visit set bits only
+                low = row & -row
+                counts[low.bit_length() - 1] += 1
+                row ^= low
+        return counts
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class NumpyServiceIndex(_ServiceIndex):
+    """Boolean matrix (phones x services); counts are one ``sum(axis=0)``."""
+    name = 'numpy'
+
+    def __init__(self, initial_phones: int = 1024, initial_services: int = 256):
+        super().__init__()
+        self._row_of: Dict[str, int] = {}
+        self._matrix = np.zeros((initial_phones, initial_services), dtype=bool)
+
+    def _ensure_capacity(self, rows: int, columns: int) -> None:
+        """Grow the matrix geometrically (lock held)."""
+        height, width = self._matrix.shape
+        if rows <= height and columns <= width:
+            return
+        if rows > height:
+            height = max(rows, height * 2)
+        if columns > width:
+            width = max(columns, width * 2)
+        grown = np.zeros((height, width), dtype=bool)
+        old_height, old_width = self._matrix.shape
+        grown[:old_height, :old_width] = self._matrix
+        self._matrix = grown
+
+    def mark_used(self, phone: str, service: str) -> None:
+        with self._lock:
+            service_id = self.services.intern(service)
+            row = self._row_of.get(phone)
+            if row is None:
+                row = len(self._row_of)
+                self._row_of[phone] = row
+            self._ensure_capacity(row + 1, service_id + 1)
+            self._matrix[row, service_id] = True
+
+    def clear(self, phone: str, service: str) -> None:
+        with self._lock:
+            service_id = self.services.get(service)
+            row = self._row_of.get(phone)
+            if service_id is not None and row is not None:
+                self._matrix[row, service_id] = False
+
+    def is_used(self, phone: str, service: str) -> bool:
+        service_id = self.services.get(service)
+        row = self._row_of.get(phone)
+        return service_id is not None and row is not None and bool(self._matrix[row, service_id])
+
+    def used_services(self, phone: str) -> List[str]:
+        row = self._row_of.get(phone)
+        if row is None:
+            return []
+        return [self.services.name(int(i)) for i in np.flatnonzero(self._matrix[row, :len(self.services)])]
+
+    def _used_counts(self, phones: Iterable[str]) -> List[int]:
+        with self._lock:
+            rows = [row for row in map(self._row_of.get, phones) if row is not None]
+            if not rows:
+                return [0] * len(self.services)
+            return self._matrix[rows, :len(self.services)].sum(axis=0).tolist()
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+
+INDEXES = {
+    'bitmap': BitmapServiceIndex,
+    'numpy': NumpyServiceIndex,
+}
+
+
+def create_service_index(name: Optional[str] = 'auto'):
+    """Return an empty index by name; 'auto' uses NumPy when it is installed."""
+    if name in (None, 'auto'):
+        name = 'numpy' if np is not None else 'bitmap'
+    if name == 'numpy' and np is None:
+        logger.warning("numpy is not installed; using the bitmap service index")
+        name = 'bitmap'
+    if name not in INDEXES:
+        raise ValueError(f"Unknown service index: {name}")
+    return INDEXES[name]()
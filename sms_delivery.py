@@ -0,0 +1,141 @@
+"""Background PUSH_SMS delivery.
+
+``submit`` only queues the message; a fixed number of delivery workers push
+to the hub in parallel. A message the hub does not acknowledge with SUCCESS
+is pushed again 10 seconds later, until it is (protocol, PUSH_SMS), each on
+its own schedule, so one failing message never holds up the others. With an
+``SmsOutbox`` every attempt is recorded there, so undelivered messages
+survive a restart.
+
+Before each push the workers ask the API's circuit breaker for permission:
+while the hub is down, queued messages wait for the circuit instead of each
+retrying on its own, and the drain after a recovery is paced.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_INTERVAL = 10.0  # Seconds between pushes of an unacknowledged SMS
+
+
+class SmsDelivery:
+    """Retry schedule (min-heap by due time) served by ``workers`` threads."""
+
+    def __init__(self, api, workers: int = 4, retry_interval: float = RETRY_INTERVAL, outbox=None):
+        self.api = api
+        self.outbox = outbox
+        self.breaker = getattr(api, 'breaker', None)
+        self.on_delivered: Optional[Callable[[Dict], None]] = None  # Called with each acknowledged SMS
+        self.workers = workers
+        self.retry_interval = retry_interval
+        self._heap: List[Tuple[float, int, Dict]] = []
+        self._order = itertools.count()  # Ties on due time go first-in, first-out
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads: List[threading.Thread] = []
+        self.in_flight = 0
+        self.push_count = metrics.counter(
+            'smshub_sms_pushes_total', 'PUSH_SMS attempts by result', ('result',))
+        metrics.gauge('smshub_sms_pending', 'SMS waiting for hub acknowledgement',
+                      callback=self.pending)
+
+    def start(self) -> None:
+        """Start the delivery workers."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [threading.Thread(target=self._run, name=f'sms-delivery-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the workers; queued messages stay queued."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, sms: Dict, delay: float = 0.0) -> None:
+        """Queue ``sms`` (smsId, phone, phoneFrom, text) for delivery; never blocks on the hub."""
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._order), sms))
+            self._cond.notify()
+
+    def pending(self) -> int:
+        """Messages not yet acknowledged (queued or being pushed)."""
+        with self._cond:
+            return len(self._heap) + self.in_flight
+
+    def _next_due(self) -> Optional[Dict]:
+        """Wait for the earliest due message; None once stopped."""
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    wait = self.breaker.acquire() if self.breaker is not None else 0.0
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    self.in_flight += 1
+                    sms = heapq.heappop(self._heap)[2]
+                    if self.outbox is not None:
+                        self.outbox.in_flight(sms['smsId'])
+                    return sms
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            return None
+
+    def _run(self) -> None:
+        while True:
+            sms = self._next_due()
+            if sms is None:
+                return
+            delivered = self._push(sms)
+            with self._cond:
+                self.in_flight -= 1
+                if not delivered:
+                    heapq.heappush(self._heap, (time.monotonic() + self.retry_interval,
+                                                next(self._order), sms))
+                # The circuit may have changed; let waiting workers re-check it
+                self._cond.notify_all()
+
+    def _push(self, sms: Dict) -> bool:
+        try:
+            result = self.api.push_sms_result(
+                sms_id=sms['smsId'],
+                phone=str(sms['phone']),
+                phone_from=sms['phoneFrom'],
+                text=sms['text']
+            )
+            delivered = result.ok and result.content.get('status') == 'SUCCESS'
+            outcome = result.outcome
+        except Exception as e:
+            logger.error(f"Error sending SMS {sms['smsId']}: {e}")
+            delivered, outcome = False, 'error'
+            if self.breaker is not None:
+                self.breaker.release()  # Nothing reached the hub
+        if self.outbox is not None:
+            self.outbox.attempted(sms['smsId'], delivered, outcome)
+        if delivered:
+            logger.info(f"Successfully sent SMS {sms['smsId']} to SMS Hub")
+            self.push_count.inc('delivered')
+            if self.on_delivered is not None:
+                try:
+                    self.on_delivered(sms)
+                except Exception as e:
+                    logger.error(f"Error in delivery callback for SMS {sms['smsId']}: {e}")
+        else:
+            logger.warning(f"Failed to send SMS {sms['smsId']}; retrying in {self.retry_interval:g}s")
+            self.push_count.inc('retry')
+        return delivered
@@ -0,0 +1,222 @@
+"""Persistent outbox of inbound SMS waiting to be pushed to the hub.
+
+Each SMS is inserted before ``process_message`` returns; its smsId is the
+row's AUTOINCREMENT key, so ids keep increasing across restarts and are
+never reused. The database runs in WAL mode with ``synchronous=NORMAL``:
+a commit is an append to the WAL without an fsync, which survives a crash
+of the process (only a power loss can roll back the last commits).
+
+Status changes (in flight, attempted, delivered) are queued and written by
+one thread, many per transaction. An SMS whose "delivered" mark was still
+queued when the process died is pushed once more after the restart; the
+queue is flushed every ``flush_interval`` seconds to keep that window short.
+
+Delivered messages are purged by ``recover`` after
+``delivered_retention_seconds``. Rows read from a modem only lose their
+text: their ``source_key`` stays as a tombstone, so a message the SIM
+still lists is not stored and pushed again.
+
+States::
+
+    pending    waiting for (another) push
+    in_flight  being pushed; reset to pending by ``recover``
+    delivered  acknowledged with SUCCESS
+"""
+
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DELIVERED = 'delivered'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    sms_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone INTEGER NOT NULL,
+    phone_from TEXT NOT NULL,
+    text TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    activation_id INTEGER,
+    source_key TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_attempt_at REAL,
+    last_outcome TEXT,
+    delivered_at REAL
+);
+CREATE INDEX IF NOT EXISTS sms_outbox_undelivered ON sms_outbox (sms_id) WHERE state != 'delivered';
+"""
+
+SMS_ID_START = 1000000  # First smsId of a new outbox
+
+_STOP = object()
+
+
+class SmsOutbox:
+    """SQLite-backed outbox with monotonic smsIds and batched status updates."""
+
+    def __init__(self, path: str = 'sms_outbox.db', busy_timeout: float = 5.0,
+                 flush_interval: float = 0.05, batch_size: int = 256,
+                 delivered_retention_seconds: float = 7 * 86400):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.delivered_retention_seconds = delivered_retention_seconds
+        self._local = threading.local()
+        self._updates: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        db = self._connection()
+        db.executescript(_SCHEMA)
+        columns = {row[1] for row in db.execute('PRAGMA table_info(sms_outbox)')}
+        if 'activation_id' not in columns:  # Outbox created before SMS were routed to activations
+            db.execute('ALTER TABLE sms_outbox ADD COLUMN activation_id INTEGER')
+        if 'source_key' not in columns:
+            db.execute('ALTER TABLE sms_outbox ADD COLUMN source_key TEXT')
+        # One row per modem message, however often the modem lists it
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS sms_outbox_source ON sms_outbox (source_key) '
+                   'WHERE source_key IS NOT NULL')
+        if db.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'sms_outbox'").fetchone() is None:
+            # New outbox: start above the small ids the hub saw while they restarted at 1 every boot
+            db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('sms_outbox', ?)", (SMS_ID_START,))
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit mode; batches are wrapped in BEGIN IMMEDIATE ... COMMIT
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def start(self) -> None:
+        """Start the thread that writes queued status updates."""
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._write_loop, name='sms-outbox', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def add(self, phone: int, phone_from: str, text: str, received_at: Optional[float] = None,
+            activation_id: Optional[int] = None, source_key: Optional[str] = None) -> Dict:
+        """Store an inbound SMS; returns it as a PUSH_SMS message with its new smsId.
+
+        ``source_key`` identifies the message on the modem. If a row with the
+        same key exists, nothing is stored and that row is returned with
+        ``duplicate`` set (and ``delivered`` if the hub already acknowledged it).
+        """
+        received_at = received_at or time.time()
+        db = self._connection()
+        cursor = db.execute(
+            'INSERT INTO sms_outbox (phone, phone_from, text, received_at, activation_id, source_key) '
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (source_key) WHERE source_key IS NOT NULL DO NOTHING',
+            (phone, phone_from, text, received_at, activation_id, source_key))
+        if cursor.rowcount == 0:
+            sms_id, state = db.execute('SELECT sms_id, state FROM sms_outbox WHERE source_key = ?',
+                                       (source_key,)).fetchone()
+            return {'smsId': sms_id, 'phone': phone, 'phoneFrom': phone_from, 'text': text,
+                    'duplicate': True, 'delivered': state == DELIVERED}
+        return {'smsId': cursor.lastrowid, 'phone': phone, 'phoneFrom': phone_from, 'text': text}
+
+    def in_flight(self, sms_id: int) -> None:
+        self._updates.put(('UPDATE sms_outbox SET state = ? WHERE sms_id = ? AND state = ?',
+                           (IN_FLIGHT, sms_id, PENDING)))
+
+    def attempted(self, sms_id: int, delivered: bool, outcome: Optional[str] = None) -> None:
+        """Record one push attempt and its result."""
+        now = time.time()
+        self._updates.put((
+            'UPDATE sms_outbox SET attempts = attempts + 1, last_attempt_at = ?, last_outcome = ?, '
+            'state = ?, delivered_at = ? WHERE sms_id = ? AND state != ?',
+            (now, outcome, DELIVERED if delivered else PENDING, now if delivered else None, sms_id, DELIVERED)))
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._updates.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Gather whatever else arrives within the flush interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._updates.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            self._write([update for update in batch if update is not _STOP])
+            if stop:
+                return
+
+    def _write(self, updates: List[Tuple[str, tuple]]) -> None:
+        if not updates:
+            return
+        db = self._connection()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for statement, params in updates:
+                db.execute(statement, params)
+            db.execute('COMMIT')
+        except sqlite3.Error as e:
+            logger.error(f"Error writing SMS outbox updates: {e}")
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+
+    def flush(self) -> None:
+        """Write queued status updates now (on the caller's thread)."""
+        updates = []
+        try:
+            while True:
+                update = self._updates.get_nowait()
+                if update is _STOP:
+                    self._updates.put(_STOP)
+                    break
+                updates.append(update)
+        except queue.Empty:
+            pass
+        self._write(updates)
+
+    def recover(self) -> List[Dict]:
+        """Undelivered SMS in smsId order; interrupted pushes become pending again."""
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('UPDATE sms_outbox SET state = ? WHERE state = ?', (PENDING, IN_FLIGHT))
+            if self.delivered_retention_seconds:
+                cutoff = time.time() - self.delivered_retention_seconds
+                db.execute('DELETE FROM sms_outbox WHERE state = ? AND delivered_at < ? AND source_key IS NULL',
+                           (DELIVERED, cutoff))
+                # Modem messages keep their key as a tombstone: the SIM may still list them
+                db.execute("UPDATE sms_outbox SET text = '', phone_from = '' "
+                           "WHERE state = ? AND delivered_at < ? AND source_key IS NOT NULL AND text != ''",
+                           (DELIVERED, cutoff))
+            rows = db.execute(
+                'SELECT sms_id, phone, phone_from, text FROM sms_outbox '
+                'WHERE state != ? ORDER BY sms_id', (DELIVERED,)).fetchall()
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            db.execute('ROLLBACK')
+            raise
+        return [{'smsId': sms_id, 'phone': phone, 'phoneFrom': phone_from, 'text': text}
+                for sms_id, phone, phone_from, text in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of messages per state."""
+        return dict(self._connection().execute('SELECT state, COUNT(*) FROM sms_outbox GROUP BY state'))
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write queued updates and stop the writer thread."""
+        if self._writer is None or not self._writer.is_alive():
+            self.flush()
+            return
+        self._updates.put(_STOP)
+        self._writer.join(timeout)
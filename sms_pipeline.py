@@ -0,0 +1,277 @@
+"""Staged pipeline from modem receive to hub acknowledgement.
+
+    receive -> decode -> dedup -> route -> persist -> push ... acknowledge
+
+Each stage runs on its own thread(s) and hands items on through a bounded
+queue. When a stage falls behind, the put into its queue blocks, so the
+backlog reaches the modem readers (which simply poll less often) instead of
+growing without limit. The push stage hands SMS to ``SmsDelivery``, whose
+retry schedule only holds messages already stored in the outbox; the
+acknowledge stage runs when the hub answers SUCCESS.
+
+Modems keep listing a message until it is deleted, so the dedup stage drops
+messages already seen in this process and the outbox's ``source_key``
+drops those stored before a restart. Messages that will never be pushed
+(received before the live activation, or for an unsold number) and those
+the hub acknowledged are deleted from the SIM unless ``delete_delivered``
+is off.
+"""
+
+import hashlib
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from metrics import registry as metrics
+from stream_stats import StreamStats
+
+logger = logging.getLogger(__name__)
+
+RECEIVE = 'receive'
+DECODE = 'decode'
+DEDUP = 'dedup'
+ROUTE = 'route'
+PERSIST = 'persist'
+PUSH = 'push'
+ACKNOWLEDGE = 'acknowledge'
+
+STAGES = (RECEIVE, DECODE, DEDUP, ROUTE, PERSIST, PUSH, ACKNOWLEDGE)
+
+
+class _Stage:
+    """Worker thread(s) applying ``handler`` to items from ``inbox``.
+
+    ``handler`` returns the items for the next stage (none to drop).
+    """
+
+    def __init__(self, pipeline: 'SmsPipeline', name: str, handler: Callable[[object], Iterable],
+                 inbox: queue.Queue, outbox: Optional[queue.Queue], workers: int = 1):
+        self.pipeline = pipeline
+        self.name = name
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.processed = 0
+        self.emitted = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self._threads = [threading.Thread(target=self._run, name=f'sms-{self.name}-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def join(self, timeout: float) -> None:
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        while self.pipeline.running:
+            try:
+                item = self.inbox.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                results = list(self.handler(item) or ())
+            except Exception as e:
+                logger.error(f"Error in SMS pipeline stage {self.name}: {e}")
+                results = []
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.processed += 1
+                self.emitted += len(results)
+            self.pipeline.item_count.inc(self.name, 'in')
+            if results:
+                self.pipeline.item_count.inc(self.name, 'out', amount=len(results))
+            for result in results:
+                self.pipeline.put(self.outbox, result)
+
+
+class SmsPipeline:
+    """Wires a modem reader to the SMS Hub integration through bounded stages.
+
+    ``reader`` is a ModemManager (or anything with ``modems``, ``read_sms``,
+    ``parse_sms_list`` and ``delete_sms``); ``integration`` is a
+    SmsHubIntegration.
+    """
+
+    def __init__(self, reader, integration, poll_interval: float = 5.0, queue_size: int = 1000,
+                 receive_threads: int = 4, delete_delivered: bool = True, dedup_size: int = 100000):
+        self.reader = reader
+        self.integration = integration
+        self.poll_interval = poll_interval
+        self.receive_threads = receive_threads
+        self.delete_delivered = delete_delivered  # Delete SMS from the SIM once delivered or dropped
+        self.dedup_size = dedup_size
+        self.running = False
+        self.started_at: Optional[float] = None
+        self.polls = 0
+        self.end_to_end = StreamStats()  # Seconds from modem read to hub SUCCESS
+        self.item_count = metrics.counter(
+            'smshub_pipeline_items_total', 'Items entering and leaving each SMS pipeline stage',
+            ('stage', 'direction'))
+
+        self._seen: 'OrderedDict[str, None]' = OrderedDict()  # Dedup keys, least recently seen first
+        self._seen_lock = threading.Lock()
+        self._unacknowledged: Dict[int, Dict] = {}  # smsId -> where and when it was read
+        self._receive_lock = threading.Lock()
+
+        # receive -> decode -> dedup -> route -> persist -> push; delivery -> acknowledge
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in STAGES[1:]}
+        self.stages = [
+            _Stage(self, DECODE, self._decode, self.queues[DECODE], self.queues[DEDUP]),
+            _Stage(self, DEDUP, self._dedup, self.queues[DEDUP], self.queues[ROUTE]),
+            _Stage(self, ROUTE, self._route, self.queues[ROUTE], self.queues[PERSIST]),
+            _Stage(self, PERSIST, self._persist, self.queues[PERSIST], self.queues[PUSH]),
+            _Stage(self, PUSH, self._push, self.queues[PUSH], None),
+            _Stage(self, ACKNOWLEDGE, self._acknowledge, self.queues[ACKNOWLEDGE], None),
+        ]
+        self._receivers: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start polling modems and every stage."""
+        if self.running:
+            return
+        self.running = True
+        self.started_at = time.monotonic()
+        self.integration.delivery.on_delivered = self._delivered
+        for stage in self.stages:
+            stage.start()
+        self._receivers = [threading.Thread(target=self._receive_loop, args=(i,), name=f'sms-receive-{i}',
+                                            daemon=True)
+                           for i in range(self.receive_threads)]
+        for thread in self._receivers:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the stages; SMS already persisted stay in the outbox."""
+        self.running = False
+        if self.integration.delivery.on_delivered == self._delivered:
+            self.integration.delivery.on_delivered = None
+        for thread in self._receivers:
+            thread.join(timeout)
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def put(self, target: Optional[queue.Queue], item) -> None:
+        """Blocking put (backpressure) that gives up once the pipeline stops."""
+        if target is None:
+            return
+        while self.running:
+            try:
+                target.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    # Stages
+
+    def _receive_loop(self, worker: int) -> None:
+        """Poll this worker's share of the modems every ``poll_interval`` seconds."""
+        while self.running:
+            started = time.monotonic()
+            ports = sorted(self.reader.modems)[worker::self.receive_threads]
+            for port in ports:
+                if not self.running:
+                    return
+                try:
+                    raw = self.reader.read_sms(port)
+                except Exception as e:
+                    logger.error(f"Error reading SMS on port {port}: {e}")
+                    continue
+                with self._receive_lock:
+                    self.polls += 1
+                self.item_count.inc(RECEIVE, 'out')
+                if raw:
+                    self.put(self.queues[DECODE], (port, raw, time.monotonic()))
+            remaining = self.poll_interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _decode(self, item):
+        port, raw, read_at = item
+        return [(port, message, read_at) for message in self.reader.parse_sms_list(raw)]
+
+    @staticmethod
+    def _message_key(port: str, message: Dict) -> str:
+        text = hashlib.blake2b(str(message.get('text', '')).encode('utf-8'), digest_size=8).hexdigest()
+        return f"{port}|{message.get('index')}|{message.get('sender')}|{message.get('timestamp')}|{text}"
+
+    def _dedup(self, item):
+        port, message, read_at = item
+        key = self._message_key(port, message)
+        with self._seen_lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return []
+            self._seen[key] = None
+            if len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+        return [item]
+
+    def _route(self, item):
+        port, message, read_at = item
+        routed = self.integration.route_message(port, message)
+        if routed is None:
+            return []
+        if routed.get('drop'):
+            # Never to be pushed: free the SIM slot so it is not read again
+            if self.delete_delivered and message.get('index') is not None:
+                self.reader.delete_sms(port, message['index'])
+            return []
+        return [(port, message, read_at, routed)]
+
+    def _persist(self, item):
+        port, message, read_at, routed = item
+        # Keyed by number rather than port: ports can be renumbered across restarts
+        text = hashlib.blake2b(routed['text'].encode('utf-8'), digest_size=8).hexdigest()
+        source_key = f"{routed['phone']}|{message.get('index')}|{message.get('timestamp')}|{routed['phoneFrom']}|{text}"
+        sms = self.integration.store_message(routed, source_key=source_key)
+        if sms is None:
+            return []  # Stored before a restart; the outbox recovery pushes it if needed
+        self._unacknowledged[sms['smsId']] = {'port': port, 'index': message.get('index'), 'read_at': read_at}
+        return [(sms, routed['delay'])]
+
+    def _push(self, item):
+        sms, delay = item
+        self.integration.delivery.submit(sms, delay=delay)
+        return []
+
+    def _delivered(self, sms: Dict) -> None:
+        """SmsDelivery callback (delivery worker thread)."""
+        try:
+            self.queues[ACKNOWLEDGE].put_nowait(sms)
+        except queue.Full:
+            logger.warning(f"Acknowledge queue full; not tracking SMS {sms['smsId']}")
+
+    def _acknowledge(self, sms: Dict):
+        source = self._unacknowledged.pop(sms['smsId'], None)
+        if source is None:
+            return []  # Recovered from the outbox after a restart
+        self.end_to_end.add(time.monotonic() - source['read_at'])
+        if self.delete_delivered and source['index'] is not None:
+            self.reader.delete_sms(source['port'], source['index'])
+        return []
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per stage: items in/out, errors, items per second since start and queue depth."""
+        elapsed = max(1e-9, time.monotonic() - (self.started_at or time.monotonic()))
+        result = {RECEIVE: {'in': self.polls, 'out': self.polls, 'errors': 0,
+                            'per_second': self.polls / elapsed, 'queue': 0}}
+        for stage in self.stages:
+            result[stage.name] = {
+                'in': stage.processed,
+                'out': stage.emitted,
+                'errors': stage.errors,
+                'per_second': stage.processed / elapsed,
+                'queue': stage.inbox.qsize(),
+            }
+        result['end_to_end'] = self.end_to_end.snapshot()
+        return result
@@ -0,0 +1,75 @@
+"""Routing of inbound SMS to the number and live activation they belong to.
+
+Modems are bound by phone number, serial port and ICCID when they register,
+so every lookup here is a dict access. The activation itself comes from the
+state backend's phone index (``StateBackend.active_activation``).
+"""
+
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SmsRouter:
+    """port / ICCID / phone -> phone, and phone -> live activation."""
+
+    def __init__(self, state=None):
+        self.state = state  # StateBackend; without one no activation is ever found
+        self._by_port: Dict[str, str] = {}
+        self._by_iccid: Dict[str, str] = {}
+        self._keys: Dict[str, Tuple[Optional[str], Optional[str]]] = {}  # phone -> (port, iccid)
+        self._lock = threading.Lock()
+
+    def bind(self, phone: str, port: Optional[str] = None, iccid: Optional[str] = None) -> None:
+        """Route SMS arriving on ``port`` or SIM ``iccid`` to ``phone``."""
+        phone = str(phone)
+        with self._lock:
+            self._unbind(phone)
+            if port:
+                previous = self._by_port.get(port)
+                if previous is not None and previous != phone:
+                    # The port now carries another SIM
+                    self._unbind(previous)
+                self._by_port[port] = phone
+            if iccid:
+                self._by_iccid[iccid] = phone
+            self._keys[phone] = (port, iccid)
+
+    def unbind(self, phone: str) -> None:
+        with self._lock:
+            self._unbind(str(phone))
+
+    def _unbind(self, phone: str) -> None:
+        """Drop every route to ``phone`` (lock held)."""
+        port, iccid = self._keys.pop(phone, (None, None))
+        if port and self._by_port.get(port) == phone:
+            del self._by_port[port]
+        if iccid and self._by_iccid.get(iccid) == phone:
+            del self._by_iccid[iccid]
+
+    def phone_for(self, port: Optional[str] = None, iccid: Optional[str] = None) -> Optional[str]:
+        """Phone number of the modem on ``port`` or holding SIM ``iccid``."""
+        if iccid and iccid in self._by_iccid:
+            return self._by_iccid[iccid]
+        if port:
+            return self._by_port.get(port)
+        return None
+
+    def activation_for(self, phone: str) -> Optional[Dict]:
+        """The live activation that sold ``phone``, if any."""
+        if self.state is None:
+            return None
+        return self.state.active_activation(str(phone))
+
+    def route(self, port: Optional[str] = None, iccid: Optional[str] = None,
+              phone: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """(phone, live activation or None) for an SMS from ``port``/``iccid``/``phone``."""
+        phone = str(phone) if phone else self.phone_for(port, iccid)
+        if phone is None:
+            return None, None
+        return phone, self.activation_for(phone)
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -1,21 +1,61 @@
-import requests
 import json
 import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Dict, List, Optional, Union
 from dataclasses import dataclass
+import requests
+from stream_stats import StreamStats
+from hub_client import HubClient, shared_client
+from circuit_breaker import CircuitBreaker, STATE_VALUES
+from metrics import registry as metrics
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Outcome of one hub request
+OK = 'ok'
+REJECTED = 'rejected'                  # Well-formed reply with status ERROR
+TIMEOUT = 'timeout'                    # Connect/read deadline or the overall budget ran out
+HTTP_ERROR = 'http_error'              # Non-2xx response
+CONNECTION_ERROR = 'connection_error'  # DNS, refused, reset
+PROTOCOL_ERROR = 'protocol_error'      # Not JSON, or no status field
+
+# Outcomes that mean the hub answered; anything else counts against the circuit
+ANSWERED = (OK, REJECTED)
+
 @dataclass
 class SmsHubConfig:
     api_key: str
     agent_id: str  # Your agent ID from SMS Hub
     server_url: str  # Your server's public URL that SMS Hub will call
     api_url: str = "https://agent.unerio.com/agent/api/sms"  # Updated to correct endpoint
+    pool_size: int = 8  # Keep-alive connections to the hub
+    gzip_requests: bool = True  # gzip request bodies (required by protocol)
+    dns_ttl: float = 300  # Seconds to cache the hub's address
+    connect_timeout: float = 3.05  # Seconds to establish a connection
+    read_timeout: float = 10.0  # Seconds to wait for response bytes
+    budget: float = 15.0  # Overall seconds one request may take, hedge included
+    hedge_quantile: Optional[float] = None  # e.g. 0.95: send a second attempt once the first is slower
+    hedge_min_samples: int = 50  # PUSH_SMS round trips measured before hedging starts
+    breaker_failures: int = 5  # Consecutive failures that open the circuit
+    probe_interval: float = 10.0  # Seconds between probes while the circuit is open
+    max_push_rate: float = 50.0  # Pushes per second while healthy; 0 = unlimited
+    ramp_seconds: float = 30.0  # Seconds to ramp back to max_push_rate after an outage
+
+@dataclass
+class HubResult:
+    """What one hub request came to."""
+    outcome: str
+    content: Optional[Dict] = None
+    elapsed: float = 0.0
+    hedged: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.outcome == OK
 
 class SmsHubAPI:
-    def __init__(self, config: SmsHubConfig):
+    def __init__(self, config: SmsHubConfig, client: Optional[HubClient] = None):
         self.config = config
         self.active_orders: Dict[str, Dict] = {}
         self.headers = {
@@ -23,50 +63,153 @@ class SmsHubAPI:
             'Content-Type': 'application/json',
             'Accept-Encoding': 'gzip'  # Required by protocol
         }
+        self.push_latency = StreamStats()  # Seconds per answered PUSH_SMS round trip
+        # One pooled session shared by every sender
+        self.client = client or shared_client(
+            pool_size=config.pool_size,
+            gzip_requests=config.gzip_requests,
+            dns_ttl=config.dns_ttl,
+            headers={k: v for k, v in self.headers.items() if k != 'Content-Type'}
+        )
+        # Attempts run here so the caller can stop waiting when the budget is spent,
+        # even if the socket itself is still blocked
+        self._executor = ThreadPoolExecutor(max_workers=config.pool_size * 2,
+                                            thread_name_prefix='hub-request')
+        self.request_count = metrics.counter(
+            'smshub_hub_requests_total', 'Requests to the SMS Hub API by action and outcome',
+            ('action', 'outcome'))
+        self.request_latency = metrics.histogram(
+            'smshub_hub_request_duration_seconds', 'SMS Hub API request latency in seconds', ('action',))
+        # Shared by every sender; callers that send in bulk gate on breaker.acquire()
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.breaker_failures,
+            probe_interval=config.probe_interval,
+            max_rate=config.max_push_rate,
+            ramp_seconds=config.ramp_seconds
+        )
+        metrics.gauge('smshub_hub_circuit_state', 'SMS Hub API circuit: 0 closed, 1 half-open, 2 open',
+                      callback=lambda: STATE_VALUES[self.breaker.state])
+        self.hedge_count = metrics.counter(
+            'smshub_hub_hedges_total', 'Hedged second attempts by action and which attempt answered first',
+            ('action', 'winner'))
 
-    def _make_request(self, action: str, params: Dict) -> Optional[Dict]:
-        """Make request to SMS Hub API."""
+    def request(self, action: str, params: Dict, hedge: bool = False) -> HubResult:
+        """Send one request within the configured budget; never raises."""
+        request_data = {
+            'key': self.config.api_key,
+            'action': action,
+            **params
+        }
+        logger.info("Making request to SMS Hub: %s", action)
+        logger.debug("Request data: %s", request_data)
+
+        started = time.perf_counter()
+        deadline = started + self.config.budget
+        hedge_after = self._hedge_delay() if hedge else None
+        attempts = {self._executor.submit(self._attempt, request_data, deadline): 'first'}
+        hedged = False
+        result = None
+        while attempts and result is None:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            if not hedged and hedge_after is not None:
+                timeout = min(timeout, max(0.0, started + hedge_after - now))
+            done, _ = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if not hedged and hedge_after is not None and time.perf_counter() < deadline:
+                    logger.info(f"{action} slower than {hedge_after * 1000:.0f} ms; sending hedged attempt")
+                    attempts[self._executor.submit(self._attempt, request_data, deadline)] = 'hedge'
+                    hedged = True
+                continue
+            for future in done:
+                name = attempts.pop(future)
+                attempt = future.result()
+                # A failed attempt only counts once the other one has failed too
+                if attempt.ok or not attempts:
+                    result = attempt
+                    if hedged:
+                        self.hedge_count.inc(action, name)
+                    break
+        if result is None:
+            logger.error(f"{action} request exceeded its {self.config.budget:g}s budget")
+            result = HubResult(TIMEOUT)
+
+        result.hedged = hedged
+        result.elapsed = time.perf_counter() - started
+        if result.outcome in ANSWERED:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        self.request_count.inc(action, result.outcome)
+        self.request_latency.observe(result.elapsed, action)
+        return result
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Latency after which a hedged attempt is sent; None while hedging is off."""
+        q = self.config.hedge_quantile
+        if not q or self.push_latency.count < self.config.hedge_min_samples:
+            return None
+        if q not in self.push_latency.quantiles:
+            logger.warning(f"hedge_quantile {q} is not tracked; hedging disabled")
+            self.config.hedge_quantile = None
+            return None
+        return self.push_latency.quantile(q)
+
+    def _attempt(self, request_data: Dict, deadline: float) -> HubResult:
+        """One HTTP round trip, classified; runs on the executor."""
+        read_timeout = min(self.config.read_timeout, max(0.001, deadline - time.perf_counter()))
         try:
-            # Format parameters according to SMS Hub documentation
-            request_data = {
-                'key': self.config.api_key,
-                'action': action,
-                **params
-            }
-            
-            logger.info(f"Making request to SMS Hub: {action}")
-            logger.debug(f"Request data: {request_data}")
-            
-            response = requests.post(
-                self.config.api_url,
-                json=request_data,
-                headers=self.headers
-            )
+            response = self.client.post_json(self.config.api_url, request_data,
+                                             timeout=(self.config.connect_timeout, read_timeout))
             response.raise_for_status()
-            
             content = response.json()
-            logger.info(f"SMS Hub Response: {content}")
-            
-            if content.get('status') == 'ERROR':
-                logger.error(f"API Error: {content.get('error')}")
-                return None
-                
-            return content
-                
-        except Exception as e:
+        except requests.Timeout as e:
+            logger.error(f"API request timed out: {e}")
+            return HubResult(TIMEOUT)
+        except requests.HTTPError as e:
             logger.error(f"API request failed: {e}")
-            return None
+            return HubResult(HTTP_ERROR)
+        except requests.RequestException as e:
+            logger.error(f"API request failed: {e}")
+            return HubResult(CONNECTION_ERROR)
+        except ValueError as e:
+            logger.error(f"API returned invalid JSON: {e}")
+            return HubResult(PROTOCOL_ERROR)
+
+        logger.debug("SMS Hub Response: %s", content)
+        if not isinstance(content, dict) or 'status' not in content:
+            logger.error(f"API returned no status: {content!r}")
+            return HubResult(PROTOCOL_ERROR, content if isinstance(content, dict) else None)
+        if content.get('status') == 'ERROR':
+            logger.error(f"API Error: {content.get('error')}")
+            return HubResult(REJECTED, content)
+        return HubResult(OK, content)
+
+    def _make_request(self, action: str, params: Dict) -> Optional[Dict]:
+        """Make request to SMS Hub API."""
+        result = self.request(action, params)
+        return result.content if result.ok else None
 
     def push_sms(self, sms_id: int, phone: str, phone_from: str, text: str) -> bool:
         """Send SMS to SMS Hub server."""
+        result = self.push_sms_result(sms_id, phone, phone_from, text)
+        return result.ok and result.content.get('status') == 'SUCCESS'
+
+    def push_sms_result(self, sms_id: int, phone: str, phone_from: str, text: str) -> HubResult:
+        """PUSH_SMS with the classified outcome; hedged when configured."""
         params = {
             'smsId': sms_id,
             'phone': int(phone),  # Must be numeric with country code
             'phoneFrom': phone_from,
             'text': text
         }
-        response = self._make_request('PUSH_SMS', params)
-        return response and response.get('status') == 'SUCCESS'
+        # A hedge carries the same smsId, so the hub sees it as the same message
+        result = self.request('PUSH_SMS', params, hedge=True)
+        if result.outcome in ANSWERED:  # Timeouts and transport failures would skew the hedge delay
+            self.push_latency.add(result.elapsed)
+        return result
 
     def get_services(self) -> Dict[str, Dict]:
         """Get available services and quantities.
@@ -1,11 +1,15 @@
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, Dict
 from smshub_api import SmsHubAPI, SmsHubConfig
-from config import SMSHUB_API_KEY, SMSHUB_AGENT_ID, SMSHUB_SERVER_URL
+from sms_delivery import SmsDelivery
+from sms_outbox import SmsOutbox
+from sms_routing import SmsRouter
+from activation_logger import ActivationLogger
+from modem_manager import parse_sms_timestamp
+from config import SMSHUB_API_KEY, SMSHUB_AGENT_ID, SMSHUB_SERVER_URL, config as app_config
 import re
 import time
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SmsHubIntegration:
@@ -16,12 +20,51 @@ class SmsHubIntegration:
         config = SmsHubConfig(
             api_key=api_key,
             agent_id=SMSHUB_AGENT_ID,
-            server_url=SMSHUB_SERVER_URL
+            server_url=SMSHUB_SERVER_URL,
+            pool_size=app_config.get('hub_pool_size', 8),
+            gzip_requests=app_config.get('hub_gzip_requests', True),
+            dns_ttl=app_config.get('hub_dns_ttl', 300),
+            connect_timeout=app_config.get('hub_connect_timeout', 3.05),
+            read_timeout=app_config.get('hub_read_timeout', 10.0),
+            budget=app_config.get('hub_request_budget', 15.0),
+            hedge_quantile=app_config.get('hub_hedge_quantile'),
+            breaker_failures=app_config.get('hub_breaker_failures', 5),
+            probe_interval=app_config.get('hub_probe_interval', 10.0),
+            max_push_rate=app_config.get('hub_max_push_rate', 50.0),
+            ramp_seconds=app_config.get('hub_ramp_seconds', 30.0)
         )
         self.api = SmsHubAPI(config)
         self.registered_modems: Dict[str, Dict] = {}  # Store registered modems
-        self.sms_queue: List[Dict] = []  # Queue for SMS messages to be sent
-        self.next_sms_id = 1  # Counter for SMS IDs
+        self.server = None  # Set by attach_server
+        self.router = SmsRouter()  # Replaced by the server's router in attach_server
+        self.activation_logger = ActivationLogger()
+        self.unsold_sms_delay = app_config.get('unsold_sms_delay')  # None: do not push SMS for unsold numbers
+        # Inbound SMS are stored here first; the outbox also allocates smsIds
+        self.outbox = SmsOutbox(app_config.get('sms_outbox', 'sms_outbox.db'))
+        self.outbox.start()
+        # Pushes happen on background workers; process_message only queues
+        self.delivery = SmsDelivery(self.api, workers=app_config.get('sms_delivery_workers', 4),
+                                    outbox=self.outbox)
+        pending = self.outbox.recover()
+        for sms in pending:
+            self.delivery.submit(sms)
+        if pending:
+            logger.info(f"Recovered {len(pending)} undelivered SMS from the outbox")
+        self.delivery.start()
+
+    def attach_server(self, server) -> None:
+        """Link to the agent server and share its SMS routing index."""
+        self.server = server
+        server.smshub = self
+        for phone, modem in self.registered_modems.items():
+            server.router.bind(phone, modem['port'])
+        self.router = server.router
+
+    def get_delivery_status(self) -> Dict:
+        """Hub circuit state and outbox backlog for the dashboard."""
+        status = self.api.breaker.snapshot()
+        status['pending'] = self.delivery.pending()
+        return status
 
     def register_modem(self, port: str, phone_number: str) -> bool:
         """Register a modem."""
@@ -33,6 +76,7 @@ class SmsHubIntegration:
                 'phone': phone_number,
                 'last_seen': time.time()
             }
+            self.router.bind(phone_number, port)
             logger.info(f"Registered modem {phone_number}")
             return True
         except Exception as e:
@@ -52,73 +96,65 @@ class SmsHubIntegration:
     def process_message(self, modem_id: str, message: dict) -> None:
         """Process a new message from a modem."""
         try:
-            # Get phone number for the modem
-            modem = None
-            for m in self.registered_modems.values():
-                if m['port'] == modem_id:
-                    modem = m
-                    break
-
-            if not modem:
-                logger.error(f"No registered modem found for port {modem_id}")
+            routed = self.route_message(modem_id, message)
+            if routed is None or routed.get('drop'):
                 return
-
-            # Validate phone number format
-            try:
-                phone = str(modem['phone'])
-                if not phone.isdigit():
-                    raise ValueError("Phone must be numeric")
-                phone = int(phone)  # Convert to int for SMS Hub
-            except (ValueError, TypeError) as e:
-                logger.error(f"Invalid phone number format: {e}")
-                return
-
-            # Queue SMS for delivery to SMS Hub with proper type validation
-            sms = {
-                'smsId': int(self.next_sms_id),  # Ensure numeric
-                'phone': phone,  # Already validated as numeric with country code
-                'phoneFrom': str(message.get('sender', 'Unknown')),  # Ensure string
-                'text': str(message.get('text', ''))  # Ensure string
-            }
-            self.next_sms_id += 1
-            self.sms_queue.append(sms)
-
-            # Try to send immediately
-            self._process_sms_queue()
+            sms = self.store_message(routed)
+            if sms is not None:
+                self.delivery.submit(sms, delay=routed['delay'])
 
         except Exception as e:
             logger.error(f"Error processing message: {e}")
 
-    def _process_sms_queue(self) -> None:
-        """Process queued SMS messages with proper retry logic."""
-        if not self.sms_queue:
-            return
+    def route_message(self, modem_id: str, message: dict) -> Optional[Dict]:
+        """Resolve the number and live activation of a message.
+
+        Returns None if it cannot be routed yet (e.g. the modem is not
+        registered), ``{'drop': reason}`` if it must never be pushed, and
+        otherwise the fields to push.
+        """
+        phone, activation = self.router.route(port=modem_id, iccid=message.get('iccid'))
+        if phone is None:
+            logger.error(f"No registered modem found for port {modem_id}")
+            return None
+
+        # Validate phone number format
+        try:
+            if not phone.isdigit():
+                raise ValueError("Phone must be numeric")
+            phone_number = int(phone)  # Convert to int for SMS Hub
+        except (ValueError, TypeError) as e:
+            logger.error(f"Invalid phone number format: {e}")
+            return None
 
-        # Try to send each SMS in the queue
-        remaining_sms = []
-        for sms in self.sms_queue:
-            try:
-                success = False
-                retry_count = 0
-                while not success and retry_count < 3:  # Maximum 3 retries
-                    if self.api.push_sms(
-                        sms_id=sms['smsId'],
-                        phone=str(sms['phone']),
-                        phone_from=sms['phoneFrom'],
-                        text=sms['text']
-                    ):
-                        logger.info(f"Successfully sent SMS {sms['smsId']} to SMS Hub")
-                        success = True
-                    else:
-                        retry_count += 1
-                        if retry_count < 3:
-                            logger.warning(f"Failed to send SMS {sms['smsId']}, attempt {retry_count}/3")
-                            time.sleep(10)  # 10 second delay between retries
-                        else:
-                            logger.error(f"Failed to send SMS {sms['smsId']} after 3 attempts")
-                            remaining_sms.append(sms)
-            except Exception as e:
-                logger.error(f"Error sending SMS {sms['smsId']}: {e}")
-                remaining_sms.append(sms)
+        sender = str(message.get('sender', 'Unknown'))  # Ensure string
+        if activation is None and self.unsold_sms_delay is None:
+            logger.info(f"Not pushing SMS from {sender} to {phone}: number is not sold")
+            return {'drop': 'not sold'}
+        received_at = parse_sms_timestamp(message.get('timestamp'))
+        if activation is not None and received_at is not None and received_at < int(activation['timestamp']):  # Modem clock: whole seconds
+            # Still on the SIM from before this sale (e.g. re-read after a restart)
+            logger.info(f"Not pushing SMS from {sender} to {phone}: received before activation "
+                        f"{activation['activation_id']}")
+            return {'drop': 'stale'}
+        return {
+            'phone': phone_number,
+            'phoneFrom': sender,
+            'text': str(message.get('text', '')),  # Ensure string
+            'activation_id': activation['activation_id'] if activation else None,
+            # Not sold: push after the SMS for sold numbers
+            'delay': 0.0 if activation else self.unsold_sms_delay,
+        }
 
-        self.sms_queue = remaining_sms
\ No newline at end of file
+    def store_message(self, routed: Dict, source_key: Optional[str] = None) -> Optional[Dict]:
+        """Store a routed message in the outbox (allocating its smsId); None if it was stored before."""
+        sms = self.outbox.add(routed['phone'], routed['phoneFrom'], routed['text'],
+                              activation_id=routed['activation_id'], source_key=source_key)
+        if sms.get('duplicate'):
+            return None
+        activation_id = routed['activation_id']
+        if activation_id is not None:
+            if self.server is not None:
+                self.server.mark_sms_received(str(routed['phone']))
+            self.activation_logger.log_sms_received(activation_id, routed['text'], routed['phoneFrom'])
+        return sms
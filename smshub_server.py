@@ -1,7 +1,8 @@
+import atexit
 import logging
 import time
 from typing import Dict, Optional, List
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, g
 from config import config
 from tunnel_manager import TunnelManager
 from setup_localtonet import ensure_localtonet_setup
@@ -9,23 +10,37 @@ import threading
 from datetime import datetime
 from flask_cors import CORS
 from flask_compress import Compress
-import os
 import json
+import os
 from api_logger import APILogger
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from activation_ids import ActivationIdGenerator
+from json_codec import get_codec
+from metrics import registry as metrics
+from stream_stats import KeyedStreamStats
+from service_index import create_service_index
+from activation_journal import ActivationJournal
+from state_backend import create_state_backend
+from history_store import HistoryStore
+from sms_routing import SmsRouter
+from reuse_policy import ReusePolicy, AFTER, ROTATED
+from time_buckets import ActivityStats, COMPLETED, NO_NUMBERS, EARNINGS_PREFIX
+from wsgi_server import ProductionServer, production_available
+from activation_leases import (
+    LeaseTimer, FINISH_STATUS_STATES, LIVE_STATES, RESERVED, SMS_RECEIVED,
+    FINISHED, CANCELLED, REFUNDED, EXPIRED
 )
+
 logger = logging.getLogger(__name__)
 
+PROTOCOL_ACTIONS = ('GET_SERVICES', 'GET_NUMBER', 'FINISH_ACTIVATION', 'PUSH_SMS')
+
 class SmsHubServer:
-    def __init__(self, host='0.0.0.0', port=None):
+    def __init__(self, host='0.0.0.0', port=None, scan_modems=True):
         self.host = host
         self.port = port or config.get('server_port', 5000)
         self.app = Flask(__name__)
-        self.api_logger = APILogger()  # Initialize our API logger
+        self.codec = get_codec(config.get('json_codec', 'auto'))  # Decodes each body once, encodes to bytes
+        self.api_logger = APILogger(sample_rates=config.get('api_log_sample_rates', {}))  # Queued, batched API log
         
         # Enable CORS and compression
         CORS(self.app)
@@ -38,118 +53,220 @@ class SmsHubServer:
         
         # Initialize other components
         self.tunnel_manager = None
-        self.services = {}
-        self.modems = {}
-        self.active_numbers = {}
-        self.completed_activations = {}  # phone -> {service: completion_time}
+        self.http_server = None  # ProductionServer when running in production mode
+        self.services = {}  # Enabled service -> free numbers not yet used for it
+        self._services_lock = threading.Lock()
+        self.state = self._create_state_backend()  # Modems, reservations and activations
+        self.router = SmsRouter(self.state)  # port / ICCID / phone -> live activation for inbound SMS
+        self.activation_lease_seconds = config.get('activation_lease_seconds', 1800)
+        self._stats_lock = threading.Lock()
+        self.lease_timer = LeaseTimer(self.expire_activation)  # Started once live activations are restored
+        # phone x service usage bits; a phone is not sold twice for the same service
+        # unless its reuse rule allows it (cooldown expiry or a new SIM)
+        self.service_usage = create_service_index(config.get('service_index', 'auto'))
+        self.reuse_policy = ReusePolicy(config.get('service_reuse'))
+        self.reuse_timer = LeaseTimer(self._reuse_service, name='reuse-timer')  # (phone, service) -> reusable at
+        self._sold_iccids: Dict[str, str] = {}  # phone -> ICCID it was last sold on
         self.activation_log_file = "activation_history.txt"
+        self.history = HistoryStore(self.activation_log_file, config.get('history_compact_every', 10000))
         self.public_url = None
         self.smshub = None  # Will be set by main.py
         self.localtonet_url = "Waiting for connection..."  # Initialize with a default value
+        self.activation_ids = ActivationIdGenerator(node_id=config.get('node_id'))
         
-        # Initialize ModemManager
+        # Initialize ModemManager (scanning starts once state is restored)
         from modem_manager import ModemManager
         self.modem_manager = ModemManager(self)
-        self.modem_manager.start()  # Start scanning for modems
         
+        # Per-minute / per-hour activity per service: the saved rings, plus sales
+        # from the history that came after the last save
+        self.activity = ActivityStats()
+        self.activity_file = os.path.abspath(config.get('activity_snapshot', 'activity_stats.json'))  # atexit may run elsewhere
+        self._activity_saved_at = self.activity.load(self.activity_file)
+        self._stopped = threading.Event()
+        threading.Thread(target=self._save_activity_loop, name='activity-save', daemon=True).start()
+        atexit.register(self.activity.save, self.activity_file)
+
         # Load previous activation history
         self.load_activation_history()
+        self.reuse_timer.start()
         
         # Statistics tracking
         self.stats = {
             'total_earnings': 0.0,
-            'today_earnings': 0.0,
             'total_activations': 0,
             'completed_activations': 0,
             'cancelled_activations': 0,
             'refunded_activations': 0,
-            'service_stats': {},  # service -> {completed: 0, cancelled: 0, refunded: 0}
-            'activation_times': [],  # List of activation durations for averaging
         }
+        # Constant-memory duration estimators (P² quantiles + EWMA), per service
+        self.activation_durations = KeyedStreamStats()  # GET_NUMBER -> successful FINISH_ACTIVATION
+        self.sms_delays = KeyedStreamStats()  # GET_NUMBER -> first SMS received
+        self._init_metrics()
+
+        # Restore activations that were in flight when the process stopped
+        self._recover_activations()
+        self.lease_timer.start()
         
         # Setup routes and start background tasks
         self.setup_routes()
         self.update_service_quantities()
+        if scan_modems:
+            self.modem_manager.start()  # Start scanning for modems
+
+    @staticmethod
+    def _create_state_backend():
+        """The configured state backend: 'memory' (journaled) or 'sqlite' (shared by workers)."""
+        backend = config.get('state_backend', 'memory')
+        if backend == 'sqlite':
+            return create_state_backend(backend, path=config.get('state_db', 'smshub_state.db'))
+        journal = ActivationJournal(config.get('activation_journal', 'activation_journal.log'),
+                                    fsync=config.get('journal_fsync', True),
+                                    commit_timeout=config.get('journal_commit_timeout', 5.0))
+        return create_state_backend(backend, journal=journal)
+
+    @property
+    def modems(self) -> Dict[str, Dict]:
+        """phone -> modem_info, owned by the state backend."""
+        return self.state.modems()
+
+    @property
+    def active_numbers(self) -> Dict[str, Dict]:
+        """phone -> live activation."""
+        return self.state.active_numbers()
+
+    def _recover_activations(self):
+        """Restore live activations from the state backend and re-arm their leases."""
+        recovered = self.state.recover()
+        for activation in recovered:
+            # Leases that ran out while we were down fire right away
+            self.lease_timer.schedule(activation['activation_id'],
+                                      activation['timestamp'] + self.activation_lease_seconds)
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} in-flight activations ({self.state.name} backend)")
+
+    def _init_metrics(self):
+        """Register protocol metrics on the process-wide registry."""
+        self.request_count = metrics.counter(
+            'smshub_requests_total', 'Protocol requests by action and response status', ('action', 'outcome'))
+        self.request_latency = metrics.histogram(
+            'smshub_request_duration_seconds', 'Protocol request latency in seconds', ('action',))
+        self.activation_count = metrics.counter(
+            'smshub_activations_closed_total', 'Closed activations by service and final state', ('service', 'state'))
+        self.earnings_count = metrics.counter(
+            'smshub_earnings_total', 'Earnings from sold activations by ISO-4217 currency', ('currency',))
+        metrics.gauge('smshub_modems', 'Registered modems by status', ('status',),
+                      callback=self._modem_status_counts)
+        metrics.gauge('smshub_live_activations', 'Activations reserved and not yet finished',
+                      callback=lambda: len(self.active_numbers))
+
+    def _modem_status_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for modem in list(self.modems.values()):
+            status = modem.get('status', 'unknown')
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def _record_request_metrics(self, response) -> None:
+        """Count the request and its latency by protocol action and outcome."""
+        started = g.get('started')
+        if started is None:
+            return
+        payload = g.get('payload')
+        action = payload.get('action') if isinstance(payload, dict) else None
+        if action not in PROTOCOL_ACTIONS:
+            action = 'STATUS' if request.method == 'GET' else 'OTHER'
+        result = g.get('response_payload')
+        outcome = result.get('status', 'UNKNOWN') if isinstance(result, dict) else str(response.status_code)
+        self.request_count.inc(action, outcome)
+        self.request_latency.observe(time.perf_counter() - started, action)
 
     def setup_routes(self):
         """Setup Flask routes."""
         
         @self.app.before_request
         def log_request():
-            """Log the incoming request."""
-            return self.api_logger.log_request(request)
+            """Decode the body once and log the incoming request."""
+            g.payload = None
+            g.payload_error = None
+            if request.path == '/metrics':
+                return None
+            g.started = time.perf_counter()
+            raw = request.get_data(cache=True)
+            if raw:
+                try:
+                    g.payload = self.codec.loads(raw)
+                except Exception as e:
+                    g.payload_error = e
+            # Keep the record for log_response; returning it would short-circuit the request
+            request._logged_request = self.api_logger.log_request(request, body=g.payload)
 
         @self.app.after_request
         def log_response(response):
             """Log the response."""
             # Get the request data that was stored by before_request
             request_data = getattr(request, '_logged_request', None)
-            self.api_logger.log_response(response, request_data)
+            if request_data is not None:
+                self.api_logger.log_response(response, request_data, body=g.get('response_payload'))
+            self._record_request_metrics(response)
             return response
 
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            """Prometheus text exposition of the process-wide metrics."""
+            return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
         @self.app.route('/', methods=['GET', 'POST'])
         @self.app.route('/smshub', methods=['GET', 'POST'])
         def handle_smshub_request():
             """Handle all SMS Hub requests."""
             try:
-                logger.info("=== SMS Hub Request Received ===")
-                logger.info(f"Method: {request.method}")
-                logger.info(f"Headers: {dict(request.headers)}")
-                logger.info(f"URL: {request.url}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("SMS Hub request: %s %s headers=%s", request.method, request.url, dict(request.headers))
                 
                 # For GET requests, show status page
                 if request.method == 'GET':
-                    return jsonify({
+                    return self._respond({
                         'status': 'running',
                         'services': self.services,
                         'modems': len(self.modems),
                         'active_numbers': len(self.active_numbers)
                     })
                 
-                try:
-                    data = request.json
-                    logger.info(f"Request data: {data}")
-                except Exception as e:
-                    logger.error(f"Failed to parse JSON data: {e}")
-                    return jsonify({'status': 'ERROR', 'error': 'Invalid JSON data'})
+                if g.payload_error is not None:
+                    logger.error(f"Failed to parse JSON data: {g.payload_error}")
+                    return self._respond({'status': 'ERROR', 'error': 'Invalid JSON data'})
+                data = g.payload
+                logger.debug("Request data: %s", data)
                 
                 if not data:
                     logger.error("No data provided in request")
-                    return jsonify({'status': 'ERROR', 'error': 'No data provided'})
+                    return self._respond({'status': 'ERROR', 'error': 'No data provided'})
 
                 key = data.get('key')
                 action = data.get('action')
-                logger.info(f"Key: {key}, Action: {action}")
 
                 if not key or key != config.get('smshub_api_key'):
                     logger.error(f"Invalid API key: {key}")
-                    return jsonify({'status': 'ERROR', 'error': 'Invalid API key'})
+                    return self._respond({'status': 'ERROR', 'error': 'Invalid API key'})
 
                 # Handle different actions
-                logger.debug(f"Handling action: {action}")
+                logger.debug("Handling action: %s", action)
                 if action == 'GET_SERVICES':
-                    logger.debug("Processing GET_SERVICES")
                     return self.handle_get_services()
                 elif action == 'GET_NUMBER':
-                    logger.debug("Processing GET_NUMBER")
                     return self.handle_get_number(data)
                 elif action == 'FINISH_ACTIVATION':
-                    logger.debug("Processing FINISH_ACTIVATION")
                     return self.handle_finish_activation(data)
                 elif action == 'PUSH_SMS':
-                    logger.debug("Processing PUSH_SMS")
-                    sms_content = data.get('sms_content', 'No content')
-                    sender = data.get('sender', 'Unknown')
-                    recipient = data.get('recipient', 'Unknown')
-                    logger.info(f"SMS received: From={sender}, To={recipient}, Content={sms_content}")
                     return self.handle_push_sms(data)
                 else:
-                    logger.error(f"Unknown action: {action}")
-                    return jsonify({'status': 'ERROR', 'error': 'Unknown action'})
+                    logger.error("Unknown action: %s", action)
+                    return self._respond({'status': 'ERROR', 'error': 'Unknown action'})
 
             except Exception as e:
                 logger.error(f"Error handling request: {e}", exc_info=True)
-                return jsonify({'status': 'ERROR', 'error': str(e)})
+                return self._respond({'status': 'ERROR', 'error': str(e)})
 
         # Add CORS headers to all responses
         @self.app.after_request
@@ -159,27 +276,39 @@ class SmsHubServer:
             response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE')
             return response
 
+    def _respond(self, payload: Dict, status: int = 200) -> Response:
+        """Encode a protocol response straight to bytes with the configured codec."""
+        g.response_payload = payload  # Lets the API logger skip decoding our own output
+        return Response(self.codec.dumps(payload), status=status, mimetype='application/json')
+
     def load_activation_history(self):
-        """Load activation history from file."""
+        """Load activation history (snapshot + tail) and fold the tail into the snapshot."""
         try:
-            if os.path.exists(self.activation_log_file):
-                with open(self.activation_log_file, 'r') as f:
-                    for line in f:
-                        try:
-                            data = json.loads(line.strip())
-                            phone = data.get('phone')
-                            service = data.get('service')
-                            if phone and service:
-                                if phone not in self.completed_activations:
-                                    self.completed_activations[phone] = {}
-                                self.completed_activations[phone][service] = data.get('timestamp')
-                        except json.JSONDecodeError:
-                            logger.error(f"Error parsing activation history line: {line}")
-                logger.info(f"Loaded {len(self.completed_activations)} activation histories")
+            for data in self.history.load():
+                self._note_service_use(data['phone'], data['service'], data.get('timestamp') or 0,
+                                       data.get('iccid'), data.get('finish_status'))
+                self._replay_activity(data)
+            logger.info(f"Loaded {len(self.service_usage)} activation histories")
+            if self.history.tail_lines:
+                self.history.compact()
         except Exception as e:
             logger.error(f"Error loading activation history: {e}")
 
-    def save_activation(self, phone: str, service: str, status: str):
+    def _replay_activity(self, entry: Dict) -> None:
+        """Add a sale from the history that the saved activity rings do not include."""
+        timestamp = entry.get('timestamp')
+        if not isinstance(timestamp, (int, float)) or timestamp <= self._activity_saved_at \
+                or timestamp < time.time() - self.activity.span[1]:
+            return
+        if entry.get('finish_status', 3) != 3:  # Legacy entries were all sales
+            return
+        service = entry['service']
+        self.activity.record(service, COMPLETED, ts=timestamp)
+        if entry.get('sum') is not None:
+            self.activity.record(service, f"{EARNINGS_PREFIX}{entry.get('currency')}",
+                                 self._activation_amount(entry), ts=timestamp)
+
+    def save_activation(self, phone: str, service: str, status: str, activation: Optional[Dict] = None):
         """Save activation to history file."""
         try:
             if status == 'completed':  # Only save completed activations
@@ -190,65 +319,86 @@ class SmsHubServer:
                     'timestamp': timestamp,
                     'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
                 }
+                if activation:
+                    entry['activation_id'] = activation.get('activation_id')
+                    entry['finish_status'] = activation.get('finish_status')
+                    entry['sum'] = activation.get('sum')
+                    entry['currency'] = activation.get('currency')
+                    entry['iccid'] = activation.get('iccid')
                 
                 # Update in-memory record
-                if phone not in self.completed_activations:
-                    self.completed_activations[phone] = {}
-                self.completed_activations[phone][service] = timestamp
+                activation = activation or {}
+                self._note_service_use(phone, service, timestamp,
+                                       activation.get('iccid'), activation.get('finish_status'))
+                reusable_at = None
+                if activation.get('finish_status') != 1:
+                    reusable_at = self.reuse_policy.reusable_at(service, timestamp)
+                self.state.record_use(phone, service, reusable_at)  # Shared with other workers
                 
-                # Append to file
-                with open(self.activation_log_file, 'a') as f:
-                    f.write(json.dumps(entry) + '\n')
-                    
-                logger.info(f"Saved activation: {phone} - {service}")
+                # Append to the history tail
+                self.history.append(entry)
+
+                logger.info("Saved activation: %s - %s", phone, service)
         except Exception as e:
             logger.error(f"Error saving activation: {e}")
 
+    def _note_service_use(self, phone: str, service: str, used_at: float,
+                          iccid: Optional[str] = None, finish_status: Optional[int] = None) -> None:
+        """Mark ``phone`` as used for ``service`` and arm its reuse rule."""
+        mode = self.reuse_policy.mode(service)
+        if finish_status == 1:  # Hub asked never to offer this number for the service again
+            mode = None
+        if mode == AFTER:
+            reusable_at = self.reuse_policy.reusable_at(service, used_at)
+            if reusable_at <= time.time():
+                return  # Cooldown already over (e.g. an old history entry)
+            self.reuse_timer.schedule((phone, service), reusable_at)
+        else:
+            self.reuse_timer.cancel((phone, service))
+        if mode == ROTATED and iccid and iccid != 'Unknown':
+            self._sold_iccids[phone] = iccid
+        self.service_usage.mark_used(phone, service)
+
+    def _reuse_service(self, key) -> None:
+        """Cooldown expiry callback: offer the phone for the service again."""
+        phone, service = key
+        self.service_usage.clear(phone, service)
+        self.state.clear_use(phone, service)
+        modem = self.modems.get(phone)
+        if (modem and modem.get('status') == 'active' and modem.get('operator') == 'physic'
+                and service in self.services):
+            with self._services_lock:
+                self.services[service] += 1
+        logger.debug("Cooldown over: %s may be sold for %s again", phone, service)
+
+    def _check_rotation(self, phone: str, iccid: Optional[str]) -> None:
+        """Free 'rotated' services of a number that now sits on a different SIM."""
+        sold_on = self._sold_iccids.get(phone)
+        if not sold_on or not iccid or iccid == 'Unknown' or iccid == sold_on:
+            return
+        for service in self.service_usage.used_services(phone):
+            if self.reuse_policy.mode(service) == ROTATED:
+                self.service_usage.clear(phone, service)
+                self.state.clear_use(phone, service)
+        del self._sold_iccids[phone]
+        logger.info("Number %s moved to a new SIM; rotated services are available again", phone)
+
     def handle_get_services(self):
         """Handle GET_SERVICES request."""
         try:
-            # Get list of currently active modems
-            active_phones = [phone for phone, modem in self.modems.items() 
-                           if modem.get('status') == 'active']
-            total_active_phones = len(active_phones)
-            
-            # Count current active service usage
-            active_services = {}
-            for phone, activation in self.active_numbers.items():
-                service = activation.get('service')
-                if service and activation.get('status') == 'active':
-                    active_services[service] = active_services.get(service, 0) + 1
-            
-            # Build response with services and their quantities
-            services = {}
-            
-            # Only use services defined in config.json
-            for service_id, enabled in config.get('services', {}).items():
-                if enabled:
-                    # For each service, count how many of our current active phones 
-                    # have already completed this service
-                    phones_used_for_service = sum(
-                        1 for phone in active_phones
-                        if (phone in self.completed_activations and 
-                            service_id in self.completed_activations[phone])
-                    )
-                    
-                    # Available = current active phones - phones already used for this service - currently active service count
-                    available = max(0, total_active_phones - 
-                               phones_used_for_service - 
-                               active_services.get(service_id, 0))
-                    
-                    services[service_id] = available
-            
+            # Available = free phones - free phones already used for the service.
+            # Phones rented out right now are 'busy', so they are already excluded.
+            services = self._available_counts(self.state.free_phones())
+
             # Return response in correct format
-            return jsonify({
+            return self._respond({
                 'status': 'SUCCESS',
                 'services': services
             })
             
         except Exception as e:
             logger.error(f"Error handling GET_SERVICES request: {e}", exc_info=True)
-            return jsonify({'status': 'ERROR', 'error': str(e)})
+            return self._respond({'status': 'ERROR', 'error': str(e)})
 
     def handle_get_number(self, data):
         """Handle GET_NUMBER request."""
@@ -261,58 +411,50 @@ class SmsHubServer:
             exception_phones = data.get('exceptionPhoneSet', [])
 
             if not all([country, operator, service, sum_amount, currency]):
-                return jsonify({'status': 'ERROR', 'error': 'Missing required fields'})
-
-            # Check if service has available numbers
-            service_quantity = 0
-            for modem in self.modems.values():
-                if modem.get('status') == 'active':
-                    service_quantity += 1
+                return self._respond({'status': 'ERROR', 'error': 'Missing required fields'})
 
-            if service_quantity == 0:
+            if self.state.free_count() == 0:
                 logger.info("No numbers available: No active modems found")
-                return jsonify({'status': 'NO_NUMBERS'})
-
-            # Find available modem
-            for phone, modem in self.modems.items():
-                if modem.get('status') != 'active':
-                    continue
-
-                # Check if phone is in exception list
-                if any(phone.startswith(prefix) for prefix in exception_phones):
-                    continue
-
-                # Found a match (we don't check operator since all are 'physic')
-                modem['status'] = 'busy'
-                activation_id = int(time.time())  # Generate unique ID
-                modem['activation_id'] = activation_id
-
-                # Record activation
-                self.active_numbers[phone] = {
-                    'service': service,
-                    'timestamp': time.time(),
-                    'status': 'active',
-                    'sum': sum_amount,
-                    'activation_id': activation_id
-                }
-                logger.info(f"Activation started: ID={activation_id}, Phone={phone}, Service={service}, Sum={sum_amount}")
-                
-                # Update statistics
+                self.activity.record(service, NO_NUMBERS)
+                return self._respond({'status': 'NO_NUMBERS'})
+
+            # Atomically claim a modem outside the exception prefixes that
+            # has not been sold for this service before, and record the activation
+            # (we don't check operator since all are 'physic')
+            now = time.time()
+            activation_id = self.activation_ids.next_id()
+            activation = self.state.reserve({
+                'activation_id': activation_id,
+                'service': service,
+                'timestamp': now,
+                'status': RESERVED,
+                'sum': sum_amount,
+                'currency': currency
+            }, exception_phones, exclude=lambda candidate: self.service_usage.is_used(candidate, service))
+            if activation is None:
+                logger.info("No numbers available: No suitable modems found")
+                self.activity.record(service, NO_NUMBERS)
+                return self._respond({'status': 'NO_NUMBERS'})
+            phone = activation['phone']
+            self._adjust_service_quantities(phone, -1)  # No longer free
+
+            # Arm the lease
+            self.lease_timer.schedule(activation_id, now + self.activation_lease_seconds)
+            logger.info("Activation started: ID=%s, Phone=%s, Service=%s, Sum=%s", activation_id, phone, service, sum_amount)
+            
+            # Update statistics
+            with self._stats_lock:
                 self.stats['total_activations'] += 1
 
-                return jsonify({
-                    'status': 'SUCCESS',
-                    'number': int(phone),  # Must be numeric
-                    'activationId': activation_id
-                })
-
-            # No suitable numbers found
-            logger.info("No numbers available: No suitable modems found")
-            return jsonify({'status': 'NO_NUMBERS'})
+            return self._respond({
+                'status': 'SUCCESS',
+                'number': int(phone),  # Must be numeric
+                'activationId': activation_id
+            })
 
         except Exception as e:
             logger.error(f"Error in get_number: {e}", exc_info=True)
-            return jsonify({'status': 'ERROR', 'error': str(e)})
+            return self._respond({'status': 'ERROR', 'error': str(e)})
 
     def handle_finish_activation(self, data):
         """Handle FINISH_ACTIVATION request."""
@@ -322,34 +464,130 @@ class SmsHubServer:
             status = data.get('status')
 
             if not isinstance(activation_id, (int, float)) or not isinstance(status, (int, float)):
-                return jsonify({'status': 'ERROR', 'error': 'Invalid field types'})
-
-            # Find the activation by ID
-            phone = None
-            for p, modem in self.modems.items():
-                if modem.get('activation_id') == activation_id:
-                    phone = p
-                    break
+                return self._respond({'status': 'ERROR', 'error': 'Invalid field types'})
 
-            if not phone:
-                return jsonify({'status': 'ERROR', 'error': 'Activation not found'})
+            new_state = FINISH_STATUS_STATES.get(int(status))
+            if new_state is None:
+                return self._respond({'status': 'ERROR', 'error': f'Unknown status: {status}'})
 
-            activation = self.active_numbers.get(phone)
+            activation = self.state.get_activation(activation_id)
             if not activation:
-                return jsonify({'status': 'ERROR', 'error': 'No active activation found'})
+                return self._respond({'status': 'ERROR', 'error': 'Activation not found'})
 
-            # Update activation status
-            if status == 3:  # Successfully sold
-                self.save_activation(phone, activation['service'], 'completed')
-                logger.info(f"Activation completed: {phone} - {activation['service']}")
-                
-            # Rest of the existing finish_activation logic...
+            # Repeated FINISH requests are answered with SUCCESS (idempotence)
+            if self.close_activation(activation, new_state, int(status)):
+                logger.info("Activation %s %s: %s - %s", activation_id, new_state, activation['phone'], activation['service'])
             
-            return jsonify({'status': 'SUCCESS'})
+            return self._respond({'status': 'SUCCESS'})
 
         except Exception as e:
             logger.error(f"Error in finish_activation: {e}", exc_info=True)
-            return jsonify({'status': 'ERROR', 'error': str(e)})
+            return self._respond({'status': 'ERROR', 'error': str(e)})
+
+    def close_activation(self, activation: Dict, new_state: str, finish_status: Optional[int] = None) -> bool:
+        """Move an activation to a terminal state and release its modem.
+
+        Returns False if the transition is not allowed (e.g. a repeated finish).
+        A refund of a completed sale takes the sale back out of the stats.
+        """
+        # The transition overwrites these; a refund needs the sale's
+        sold = activation.get('status') == FINISHED and activation.get('finish_status') == 3
+        sold_at = activation.get('finished_at')
+        fields = {'finished_at': time.time()}
+        if finish_status is not None:
+            fields['finish_status'] = finish_status
+        result = self.state.transition(activation['activation_id'], new_state, **fields)
+        if result is None:
+            return False
+        previous, activation = result
+        phone = activation['phone']
+        activation_id = activation['activation_id']
+
+        with self._stats_lock:
+            if new_state == FINISHED and finish_status == 3:
+                self.stats['completed_activations'] += 1
+                earned = self._activation_amount(activation)
+                self.stats['total_earnings'] += earned
+                self.earnings_count.inc(str(activation.get('currency')), amount=earned)
+            elif new_state == CANCELLED:
+                self.stats['cancelled_activations'] += 1
+            elif new_state == REFUNDED:
+                self.stats['refunded_activations'] += 1
+                if previous == FINISHED and sold:
+                    self.stats['completed_activations'] -= 1
+                    self.stats['total_earnings'] -= self._activation_amount(activation)
+
+        self.activation_count.inc(activation['service'], new_state)
+        if new_state == FINISHED and finish_status == 3:
+            self.activation_durations.add(activation['service'], activation['finished_at'] - activation['timestamp'])
+            self.activity.record(activation['service'], COMPLETED)
+            self.activity.record(activation['service'], f"{EARNINGS_PREFIX}{activation.get('currency')}",
+                                 self._activation_amount(activation))
+        elif new_state in (CANCELLED, REFUNDED):
+            self.activity.record(activation['service'], new_state)
+            if new_state == REFUNDED and previous == FINISHED and sold:
+                # Reverse the sale in the buckets it was counted in
+                self.activity.record(activation['service'], COMPLETED, -1, ts=sold_at)
+                self.activity.record(activation['service'], f"{EARNINGS_PREFIX}{activation.get('currency')}",
+                                     -self._activation_amount(activation), ts=sold_at)
+        self.lease_timer.cancel(activation_id)
+        if new_state == FINISHED:
+            # Status 1 and 3 both mean this number must not be offered for the service again
+            self.save_activation(phone, activation['service'], 'completed', activation)
+        if previous in LIVE_STATES:
+            # The number is free again; count it after its use is recorded
+            modem = self.modems.get(phone)
+            if modem and modem.get('status') == 'active':
+                self._adjust_service_quantities(phone, 1)
+        return True
+
+    @staticmethod
+    def _activation_amount(activation: Dict) -> float:
+        """The agent's reward for an activation (the GET_NUMBER 'sum')."""
+        try:
+            return float(activation.get('sum') or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def _save_activity_loop(self) -> None:
+        """Save the activity rings every ``activity_save_interval`` seconds.
+
+        Cancels, refunds and NO_NUMBERS misses exist only in the rings, so a
+        crash loses at most one interval of them; sales are replayed from
+        the history.
+        """
+        interval = config.get('activity_save_interval', 60)
+        while not self._stopped.wait(interval):
+            self.activity.save(self.activity_file)
+
+    def expire_activation(self, activation_id: int) -> None:
+        """Lease expiry callback: release an activation the hub never finished."""
+        activation = self.state.get_activation(activation_id)
+        if activation and activation['status'] in LIVE_STATES:
+            if self.close_activation(activation, EXPIRED):
+                logger.info("Activation %s expired: %s - %s", activation_id, activation['phone'], activation['service'])
+
+    def mark_sms_received(self, phone: str) -> Optional[Dict]:
+        """Record that an SMS arrived for a sold number; returns its live activation."""
+        activation = self.state.active_activation(phone)
+        if activation is None:
+            return None
+        result = self.state.transition(activation['activation_id'], SMS_RECEIVED, sms_received_at=time.time())
+        if result is not None:  # First SMS for this activation
+            activation = result[1]
+            self.sms_delays.add(activation['service'], activation['sms_received_at'] - activation['timestamp'])
+        return activation
+
+    def get_latency_summary(self) -> Dict[str, Dict]:
+        """p50/p95/p99, mean and EWMA of activation timings, overall and per service."""
+        summary = {
+            'activation_duration': self.activation_durations.snapshot_all(),
+            'time_to_first_sms': self.sms_delays.snapshot_all(),
+        }
+        push_latency = getattr(getattr(self.smshub, 'api', None), 'push_latency', None)
+        if push_latency is not None:
+            summary['push_latency'] = {KeyedStreamStats.ALL: push_latency.snapshot()}
+        return summary
 
     def register_modem(self, key: str, modem_info: dict):
         """Register a modem with the server."""
@@ -360,7 +598,10 @@ class SmsHubServer:
             modem_info['operator'] = 'physic'
             modem_info['country'] = 'usaphysical'  # Also set the country
             
-            self.modems[key] = modem_info
+            self._check_rotation(key, modem_info.get('iccid'))
+            held = self.state.active_activation(key)  # Activation restored after a restart
+            self.state.register_modem(key, modem_info, held['activation_id'] if held else None)
+            self.router.bind(key, modem_info.get('port'), modem_info.get('iccid'))
             self.update_service_quantities()  # Update available services
             logger.info(f"Successfully registered modem: {key} with status: {modem_info.get('status', 'unknown')}")
         except Exception as e:
@@ -369,31 +610,54 @@ class SmsHubServer:
 
     def unregister_modem(self, phone_number: str) -> None:
         """Unregister a modem."""
-        self.modems.pop(phone_number, None)
+        self.state.unregister_modem(phone_number)
+        self.router.unbind(phone_number)
         self.update_service_quantities()
 
     def update_service_quantities(self):
         """Update available service quantities based on active modems."""
         try:
             # Count all modems that are active and have operator set to 'physic'
-            available_modems = sum(1 for modem in self.modems.values() 
-                                 if modem.get('status') == 'active' 
-                                 and modem.get('operator') == 'physic')
+            available_phones = [phone for phone, modem in list(self.modems.items())
+                                if modem.get('status') == 'active'
+                                and modem.get('operator') == 'physic']
             
-            logger.info(f"Found {available_modems} active modems with 'physic' operator")
-            logger.debug(f"Current modems: {json.dumps(list(self.modems.values()), indent=2)}")
+            logger.debug("Found %d active modems with 'physic' operator", len(available_phones))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Current modems: %s", json.dumps(list(self.modems.values()), default=str))
             
             # Update quantities for all enabled services
-            for service, enabled in config.get('services', {}).items():
-                if enabled:
-                    self.services[service] = available_modems
-                    logger.debug(f"Updated service {service} quantity to {available_modems}")
+            counts = self._available_counts(available_phones)
+            with self._services_lock:
+                self.services.update(counts)
             
-            logger.info(f"Updated service quantities: {self.services}")
+            logger.debug("Updated %d service quantities from %d modems", len(self.services), len(available_phones))
             
         except Exception as e:
             logger.error(f"Error updating service quantities: {e}", exc_info=True)
 
+    def _available_counts(self, phones: List[str]) -> Dict[str, int]:
+        """{enabled service: phones among ``phones`` not yet used for it}, in one pass."""
+        return self.service_usage.available_counts(phones, self._enabled_services())
+
+    @staticmethod
+    def _enabled_services() -> List[str]:
+        return [service for service, on in config.get('services', {}).items() if on]
+
+    def _adjust_service_quantities(self, phone: str, delta: int) -> None:
+        """Add ``delta`` to every enabled service ``phone`` has not been used for.
+
+        Keeps ``services`` current when one number is taken or freed without
+        recounting the whole fleet.
+        """
+        modem = self.modems.get(phone)
+        if not modem or modem.get('operator') != 'physic':
+            return
+        with self._services_lock:
+            for service in self._enabled_services():
+                if not self.service_usage.is_used(phone, service):
+                    self.services[service] = self.services.get(service, 0) + delta
+
     def get_services(self):
         """Get available services and their quantities."""
         return self.services
@@ -421,22 +685,30 @@ class SmsHubServer:
             if self.stats['total_activations'] > 0:
                 success_rate = (self.stats['completed_activations'] / self.stats['total_activations']) * 100
             
-            # Calculate average activation time
-            avg_activation_time = 0
-            if self.stats['activation_times']:
-                avg_activation_time = sum(self.stats['activation_times']) / len(self.stats['activation_times'])
+            # Activation time from the streaming estimator (O(1) regardless of uptime)
+            durations = self.activation_durations.snapshot()
+            avg_activation_time = durations['mean']
+            sms_delays = self.sms_delays.snapshot()
+
+            # Average GET_NUMBER response time from the latency histogram
+            count, total = self.request_latency.summary('GET_NUMBER')
+            avg_response_time = total / count if count else 0
             
             return {
                 'total_modems': total_modems,
                 'active_modems': active_modems,
                 'active_services': active_services,
+                'active_numbers': active_services,
+                'avg_response_time': round(avg_response_time, 4),
                 'success_rate': round(success_rate, 2),
                 'avg_activation_time': round(avg_activation_time, 2),
+                'activation_time_p95': round(durations['p95'], 2),
+                'time_to_first_sms_p95': round(sms_delays['p95'], 2),
                 'total_activations': self.stats['total_activations'],
                 'completed_activations': self.stats['completed_activations'],
                 'cancelled_activations': self.stats['cancelled_activations'],
                 'total_earnings': round(self.stats['total_earnings'], 2),
-                'today_earnings': round(self.stats['today_earnings'], 2)
+                'today_earnings': round(self._today_earnings(), 2)
             }
         except Exception as e:
             logger.error(f"Error getting performance metrics: {e}")
@@ -453,12 +725,66 @@ class SmsHubServer:
                 'today_earnings': 0
             }
 
+    def _today_earnings(self) -> float:
+        """Earnings since local midnight, summed over currencies."""
+        return sum(self.activity.today_earnings().values())
+
+    def get_hourly_demand(self, service: Optional[str] = None, hours: int = 24) -> Dict[str, List[float]]:
+        """Per-hour completed and unmet (NO_NUMBERS) requests, oldest first."""
+        service = service or ActivityStats.ALL
+        return {
+            'completed': self.activity.hourly(COMPLETED, hours, service),
+            'no_numbers': self.activity.hourly(NO_NUMBERS, hours, service),
+        }
+
+    def get_service_dashboard(self) -> Dict[str, Dict[str, float]]:
+        """Per-service available quantity, live activations, 24h outcomes and hourly demand.
+
+        Demand is sales plus NO_NUMBERS misses per hour; ``peak_hourly_demand``
+        against ``quantity`` shows whether the fleet covers the busiest hour.
+        """
+        quantities = self.get_service_quantities()
+        totals = self.activity.service_totals(86400)
+        live: Dict[str, int] = {}
+        for activation in list(self.active_numbers.values()):
+            live[activation['service']] = live.get(activation['service'], 0) + 1
+
+        dashboard = {}
+        for service in set(quantities) | set(totals) | set(live):
+            events = totals.get(service, {})
+            demand = self.get_hourly_demand(service)
+            hourly = [sold + missed for sold, missed in zip(demand['completed'], demand['no_numbers'])]
+            dashboard[service] = {
+                'quantity': quantities.get(service, 0),
+                'active': live.get(service, 0),
+                'completed': int(events.get(COMPLETED, 0)),
+                'cancelled': int(events.get(CANCELLED, 0)),
+                'refunded': int(events.get(REFUNDED, 0)),
+                'no_numbers': int(events.get(NO_NUMBERS, 0)),
+                'demand_this_hour': int(hourly[-1]),
+                'peak_hourly_demand': int(max(hourly)),
+            }
+        return dashboard
+
+    def get_hub_status(self) -> Optional[Dict]:
+        """Circuit state of the SMS Hub API and undelivered SMS; None without an integration."""
+        if self.smshub is None or not hasattr(self.smshub, 'get_delivery_status'):
+            return None
+        return self.smshub.get_delivery_status()
+
     def get_public_url(self) -> Optional[str]:
         """Get the public URL for this server."""
         return self.public_url
 
     def run(self):
         """Run the server."""
+        if self._use_production_server():
+            self.http_server = ProductionServer(
+                self.app, self.host, self.port, config.get('production_server', {})
+            )
+            self.http_server.run()
+            return
+
         self.app.run(
             host=self.host, 
             port=self.port, 
@@ -467,8 +793,28 @@ class SmsHubServer:
             ssl_context=self.ssl_context
         )
 
+    def _use_production_server(self) -> bool:
+        """Decide between the production server and Werkzeug's development server."""
+        if config.get('server_mode', 'production') != 'production':
+            return False
+        if self.ssl_context:
+            logger.warning("Production server does not terminate SSL; using development server")
+            return False
+        if not production_available():
+            logger.warning("waitress is not installed; using development server")
+            return False
+        return True
+
     def stop(self):
         """Stop the server and cleanup."""
+        if self.http_server:
+            self.http_server.drain()
+        self.lease_timer.stop()
+        self.reuse_timer.stop()
+        self.state.close()
+        self.activation_ids.close()
+        self._stopped.set()
+        self.activity.save(self.activity_file)
         if self.tunnel_manager:
             self.tunnel_manager.stop() 
 
@@ -481,36 +827,35 @@ class SmsHubServer:
             text = data.get('text')
 
             if not all([sms_id, phone, phone_from, text]):
-                return jsonify({'status': 'ERROR', 'error': 'Missing required fields'})
+                return self._respond({'status': 'ERROR', 'error': 'Missing required fields'})
 
             # Validate types
             if not isinstance(sms_id, (int, float)):
-                return jsonify({'status': 'ERROR', 'error': 'smsId must be numeric'})
+                return self._respond({'status': 'ERROR', 'error': 'smsId must be numeric'})
             if not isinstance(phone, (int, float)):
-                return jsonify({'status': 'ERROR', 'error': 'phone must be numeric'})
+                return self._respond({'status': 'ERROR', 'error': 'phone must be numeric'})
             if not isinstance(phone_from, str):
-                return jsonify({'status': 'ERROR', 'error': 'phoneFrom must be string'})
+                return self._respond({'status': 'ERROR', 'error': 'phoneFrom must be string'})
             if not isinstance(text, str):
-                return jsonify({'status': 'ERROR', 'error': 'text must be string'})
+                return self._respond({'status': 'ERROR', 'error': 'text must be string'})
 
             # Log the SMS
-            logger.info(f"Received SMS - ID: {sms_id}, From: {phone_from}, To: {phone}, Text: {text}")
+            logger.info("Received SMS - ID: %s, From: %s, To: %s", sms_id, phone_from, phone)
+            logger.debug("SMS %s text: %s", sms_id, text)
 
             # Here you would typically store the SMS in your database
             # For now, we just return success
-            return jsonify({'status': 'SUCCESS'})
+            return self._respond({'status': 'SUCCESS'})
 
         except Exception as e:
             logger.error(f"Error in push_sms: {e}", exc_info=True)
-            return jsonify({'status': 'ERROR', 'error': str(e)})
+            return self._respond({'status': 'ERROR', 'error': str(e)})
 
     def get_statistics(self):
         """Get current statistics."""
         try:
             active_count = len(self.active_numbers)
-            avg_time = 0
-            if self.stats['activation_times']:
-                avg_time = sum(self.stats['activation_times']) / len(self.stats['activation_times'])
+            avg_time = self.activation_durations.snapshot()['mean']
             
             success_rate = 0
             if self.stats['total_activations'] > 0:
@@ -518,7 +863,8 @@ class SmsHubServer:
             
             return {
                 'total_earnings': self.stats['total_earnings'],
-                'today_earnings': self.stats['today_earnings'],
+                'today_earnings': self._today_earnings(),
+                'today_earnings_by_currency': self.activity.today_earnings(),
                 'total_activations': self.stats['total_activations'],
                 'completed_activations': self.stats['completed_activations'],
                 'cancelled_activations': self.stats['cancelled_activations'],
@@ -526,7 +872,9 @@ class SmsHubServer:
                 'active_count': active_count,
                 'success_rate': success_rate,
                 'average_time': avg_time,
-                'service_stats': self.stats['service_stats']
+                'service_stats': self.activity.service_totals(86400),
+                'cooling_down': self.reuse_timer.pending(),
+                'latency': self.get_latency_summary()
             }
         except Exception as e:
             logger.error(f"Error getting statistics: {e}")
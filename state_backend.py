@@ -0,0 +1,436 @@
+"""Activation and inventory state behind one interface.
+
+``MemoryStateBackend`` keeps everything in this process (journaled to disk
+for crash recovery). ``SQLiteStateBackend`` keeps it in an SQLite database
+in WAL mode so several server worker processes can share one inventory;
+a modem is claimed with a single ``UPDATE ... RETURNING`` inside an
+immediate transaction, so two workers can never sell the same SIM.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from activation_leases import LIVE_STATES, can_transition
+from modem_pool import ModemPool
+
+logger = logging.getLogger(__name__)
+
+# (state before the transition, the activation after it)
+Transition = Tuple[str, Dict]
+
+
+class StateBackend:
+    """Interface shared by the state backends.
+
+    Activations are plain dicts with at least ``activation_id``, ``phone``,
+    ``service``, ``timestamp`` and ``status``.
+    """
+    name = ''
+
+    # Inventory
+    def register_modem(self, phone: str, info: Dict, activation_id: Optional[int] = None) -> None:
+        """Add or replace a modem; ``activation_id`` marks it busy for a recovered activation."""
+        raise NotImplementedError
+
+    def unregister_modem(self, phone: str) -> None:
+        raise NotImplementedError
+
+    def modems(self) -> Dict[str, Dict]:
+        """phone -> modem info (including ``status`` and ``activation_id``)."""
+        raise NotImplementedError
+
+    def free_phones(self) -> List[str]:
+        raise NotImplementedError
+
+    def free_count(self) -> int:
+        raise NotImplementedError
+
+    # Activations
+    def reserve(self, activation: Dict, exclude_prefixes: Iterable = (),
+                exclude: Optional[Callable[[str], bool]] = None) -> Optional[Dict]:
+        """Claim a free modem for ``activation`` and store it atomically.
+
+        Fills in ``phone`` and ``iccid``; returns the stored activation or
+        None if no free modem matches.
+        """
+        raise NotImplementedError
+
+    def get_activation(self, activation_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def active_activation(self, phone: str) -> Optional[Dict]:
+        """The live activation holding ``phone``, if any."""
+        raise NotImplementedError
+
+    def active_numbers(self) -> Dict[str, Dict]:
+        """phone -> live activation."""
+        raise NotImplementedError
+
+    def transition(self, activation_id: int, new_state: str, **fields) -> Optional[Transition]:
+        """Move an activation to ``new_state`` and set ``fields``.
+
+        Leaving a live state releases the modem. Returns None if the
+        activation is unknown or the transition is not allowed.
+        """
+        raise NotImplementedError
+
+    def recover(self) -> List[Dict]:
+        """Live activations that survived a restart."""
+        raise NotImplementedError
+
+    # Service usage shared between workers (the server keeps its own index too)
+    def record_use(self, phone: str, service: str, reusable_at: Optional[float]) -> None:
+        pass
+
+    def clear_use(self, phone: str, service: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """In-process state: a ModemPool plus activation dicts, optionally journaled."""
+    name = 'memory'
+
+    def __init__(self, journal=None, closed_retention: int = 10000):
+        self.journal = journal  # ActivationJournal, or None for no crash recovery
+        self.pool = ModemPool()
+        self.activations: Dict[int, Dict] = {}  # activation_id -> live or recently closed activation
+        self._active_numbers: Dict[str, Dict] = {}  # phone -> live activation
+        self._closed: OrderedDict = OrderedDict()  # activation_id -> None, oldest first
+        self.closed_retention = closed_retention  # closed activations kept for idempotent FINISH
+        self._lock = threading.Lock()
+
+    def register_modem(self, phone: str, info: Dict, activation_id: Optional[int] = None) -> None:
+        self.pool.register(phone, info, activation_id)
+
+    def unregister_modem(self, phone: str) -> None:
+        self.pool.unregister(phone)
+
+    def modems(self) -> Dict[str, Dict]:
+        return self.pool.modems
+
+    def free_phones(self) -> List[str]:
+        return self.pool.free_phones()
+
+    def free_count(self) -> int:
+        return self.pool.free_count()
+
+    def reserve(self, activation: Dict, exclude_prefixes: Iterable = (),
+                exclude: Optional[Callable[[str], bool]] = None) -> Optional[Dict]:
+        ticket = None
+        with self._lock:
+            phone = self.pool.reserve(exclude_prefixes, exclude)
+            if phone is None:
+                return None
+            modem = self.pool.modems[phone]
+            modem['activation_id'] = activation['activation_id']
+            activation['phone'] = phone
+            activation['iccid'] = modem.get('iccid')
+            self._active_numbers[phone] = activation
+            self.activations[activation['activation_id']] = activation
+            if self.journal:
+                ticket = self.journal.opened(activation)  # Committed by the journal thread
+        if ticket is not None:
+            self.journal.wait(ticket)  # On disk before the hub hears of it (outside the lock: group commit)
+        return activation
+
+    def get_activation(self, activation_id: int) -> Optional[Dict]:
+        return self.activations.get(activation_id)
+
+    def active_activation(self, phone: str) -> Optional[Dict]:
+        return self._active_numbers.get(phone)
+
+    def active_numbers(self) -> Dict[str, Dict]:
+        return self._active_numbers
+
+    def transition(self, activation_id: int, new_state: str, **fields) -> Optional[Transition]:
+        ticket = None
+        with self._lock:
+            activation = self.activations.get(activation_id)
+            if activation is None or not can_transition(activation['status'], new_state):
+                return None
+            previous = activation['status']
+            activation['status'] = new_state
+            activation.update(fields)
+
+            if new_state in LIVE_STATES:
+                if self.journal:
+                    ticket = self.journal.updated(activation_id, status=new_state, **fields)
+            else:
+                phone = activation['phone']
+                if self._active_numbers.get(phone) is activation:
+                    del self._active_numbers[phone]
+                self._retain_closed(activation_id)
+                if self.journal and previous in LIVE_STATES:
+                    ticket = self.journal.closed(activation_id, new_state)
+                    if self.journal.checkpoint_due:
+                        self.journal.checkpoint(self._active_numbers.values(), self._closed_activations())
+
+        if ticket is not None:
+            self.journal.wait(ticket)
+        if previous in LIVE_STATES and new_state not in LIVE_STATES:
+            self.pool.release(activation['phone'], activation_id)
+        return previous, activation
+
+    def _retain_closed(self, activation_id: int) -> None:
+        """Keep a bounded window of closed activations (lock held)."""
+        self._closed[activation_id] = None
+        self._closed.move_to_end(activation_id)
+        while len(self._closed) > self.closed_retention:
+            old_id, _ = self._closed.popitem(last=False)
+            self.activations.pop(old_id, None)
+
+    def _closed_activations(self) -> List[Dict]:
+        """The retained closed activations, oldest first (lock held)."""
+        return [self.activations[activation_id] for activation_id in self._closed
+                if activation_id in self.activations]
+
+    def recover(self) -> List[Dict]:
+        if not self.journal:
+            return []
+        try:
+            recovered, closed = self.journal.recover()
+        except Exception as e:
+            logger.error(f"Error reading activation journal: {e}")
+            recovered, closed = [], []
+        self.journal.start()
+
+        with self._lock:
+            for activation in closed:  # Repeated FINISH requests stay idempotent across restarts
+                self.activations[activation['activation_id']] = activation
+                self._retain_closed(activation['activation_id'])
+            for activation in recovered:
+                self.activations[activation['activation_id']] = activation
+                self._active_numbers[activation['phone']] = activation
+            self.journal.checkpoint(recovered, self._closed_activations())  # Start from a compact journal
+        return recovered
+
+    def close(self) -> None:
+        if self.journal:
+            self.journal.close()
+
+
+# SQL list of the live states, e.g. ('reserved', 'sms_received')
+_LIVE = '(' + ', '.join(f"'{state}'" for state in LIVE_STATES) + ')'
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS modems (
+    phone TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    activation_id INTEGER,
+    iccid TEXT,
+    free_since REAL,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS modems_free ON modems (status, free_since);
+CREATE TABLE IF NOT EXISTS activations (
+    activation_id INTEGER PRIMARY KEY,
+    phone TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activations_live ON activations (phone) WHERE status IN {_LIVE};
+CREATE TABLE IF NOT EXISTS service_usage (
+    phone TEXT NOT NULL,
+    service TEXT NOT NULL,
+    reusable_at REAL,
+    PRIMARY KEY (phone, service)
+) WITHOUT ROWID;
+"""
+
+class SQLiteStateBackend(StateBackend):
+    """State in one SQLite database (WAL), shareable between worker processes."""
+    name = 'sqlite'
+
+    def __init__(self, path: str = 'smshub_state.db', busy_timeout: float = 5.0,
+                 closed_retention_seconds: float = 7 * 86400):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+        with self._transaction() as db:
+            # Closed activations are kept a while for idempotent FINISH
+            db.execute(f"DELETE FROM activations WHERE status NOT IN {_LIVE} AND updated_at < ?",
+                       (time.time() - closed_retention_seconds,))
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit mode; write transactions are opened explicitly with BEGIN IMMEDIATE
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    @staticmethod
+    def _activation(row) -> Optional[Dict]:
+        return json.loads(row[0]) if row else None
+
+    def register_modem(self, phone: str, info: Dict, activation_id: Optional[int] = None) -> None:
+        with self._transaction() as db:
+            current = db.execute('SELECT status, activation_id FROM modems WHERE phone = ?', (phone,)).fetchone()
+            if activation_id is None:
+                live = db.execute(f'SELECT activation_id FROM activations WHERE phone = ? AND status IN {_LIVE}',
+                                  (phone,)).fetchone()
+                activation_id = live[0] if live else None
+            if current and current[0] == 'busy':
+                info['status'] = 'busy'
+                info['activation_id'] = current[1]
+            elif activation_id is not None and info.get('status') == 'active':
+                info['status'] = 'busy'
+                info['activation_id'] = activation_id
+            db.execute(
+                'INSERT OR REPLACE INTO modems (phone, status, activation_id, iccid, free_since, info) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (phone, info.get('status'), info.get('activation_id'), info.get('iccid'), time.time(),
+                 json.dumps(info, default=str)))
+
+    def unregister_modem(self, phone: str) -> None:
+        with self._transaction() as db:
+            db.execute('DELETE FROM modems WHERE phone = ?', (phone,))
+
+    def modems(self) -> Dict[str, Dict]:
+        result = {}
+        for phone, status, activation_id, info in self._connection().execute(
+                'SELECT phone, status, activation_id, info FROM modems'):
+            modem = json.loads(info)
+            modem['status'] = status
+            if activation_id is not None:
+                modem['activation_id'] = activation_id
+            else:
+                modem.pop('activation_id', None)
+            result[phone] = modem
+        return result
+
+    def free_phones(self) -> List[str]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT phone FROM modems WHERE status = 'active' ORDER BY free_since")]
+
+    def free_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM modems WHERE status = 'active'").fetchone()[0]
+
+    def reserve(self, activation: Dict, exclude_prefixes: Iterable = (),
+                exclude: Optional[Callable[[str], bool]] = None) -> Optional[Dict]:
+        prefixes = [str(prefix) + '%' for prefix in exclude_prefixes or ()]
+        eligible = (
+            "m.status = 'active'"
+            + ''.join(' AND m.phone NOT LIKE ?' for _ in prefixes)
+            + ' AND NOT EXISTS (SELECT 1 FROM service_usage u WHERE u.phone = m.phone AND u.service = ?'
+              ' AND (u.reusable_at IS NULL OR u.reusable_at > ?))'
+        )
+        params = prefixes + [activation['service'], time.time()]
+        claim = ("UPDATE modems SET status = 'busy', activation_id = ? "
+                 "WHERE phone = ? AND status = 'active' RETURNING phone, iccid")
+
+        with self._transaction() as db:
+            row = None
+            if exclude is None:
+                # Pick and claim in one statement
+                row = db.execute(
+                    "UPDATE modems SET status = 'busy', activation_id = ? WHERE phone = "
+                    f"(SELECT m.phone FROM modems m WHERE {eligible} ORDER BY m.free_since LIMIT 1) "
+                    "RETURNING phone, iccid",
+                    [activation['activation_id']] + params).fetchone()
+            else:
+                for (phone,) in db.execute(
+                        f'SELECT m.phone FROM modems m WHERE {eligible} ORDER BY m.free_since', params).fetchall():
+                    if exclude(phone):
+                        continue
+                    row = db.execute(claim, (activation['activation_id'], phone)).fetchone()
+                    if row:
+                        break
+            if row is None:
+                return None
+            activation['phone'], activation['iccid'] = row
+            db.execute('INSERT INTO activations (activation_id, phone, status, updated_at, data) VALUES (?, ?, ?, ?, ?)',
+                       (activation['activation_id'], activation['phone'], activation['status'], time.time(),
+                        json.dumps(activation, default=str)))
+        return activation
+
+    def get_activation(self, activation_id: int) -> Optional[Dict]:
+        return self._activation(self._connection().execute(
+            'SELECT data FROM activations WHERE activation_id = ?', (activation_id,)).fetchone())
+
+    def active_activation(self, phone: str) -> Optional[Dict]:
+        return self._activation(self._connection().execute(
+            f'SELECT data FROM activations WHERE phone = ? AND status IN {_LIVE}', (phone,)).fetchone())
+
+    def active_numbers(self) -> Dict[str, Dict]:
+        return {activation['phone']: activation for activation in self.recover()}
+
+    def transition(self, activation_id: int, new_state: str, **fields) -> Optional[Transition]:
+        with self._transaction() as db:
+            activation = self._activation(db.execute(
+                'SELECT data FROM activations WHERE activation_id = ?', (activation_id,)).fetchone())
+            if activation is None or not can_transition(activation['status'], new_state):
+                return None
+            previous = activation['status']
+            activation['status'] = new_state
+            activation.update(fields)
+            db.execute('UPDATE activations SET status = ?, updated_at = ?, data = ? WHERE activation_id = ?',
+                       (new_state, time.time(), json.dumps(activation, default=str), activation_id))
+            if previous in LIVE_STATES and new_state not in LIVE_STATES:
+                db.execute("UPDATE modems SET status = 'active', activation_id = NULL, free_since = ? "
+                           "WHERE phone = ? AND status = 'busy' AND activation_id = ?",
+                           (time.time(), activation['phone'], activation_id))
+        return previous, activation
+
+    def recover(self) -> List[Dict]:
+        return [json.loads(row[0]) for row in self._connection().execute(
+            f'SELECT data FROM activations WHERE status IN {_LIVE}')]
+
+    def record_use(self, phone: str, service: str, reusable_at: Optional[float]) -> None:
+        with self._transaction() as db:
+            db.execute('INSERT OR REPLACE INTO service_usage (phone, service, reusable_at) VALUES (?, ?, ?)',
+                       (phone, service, reusable_at))
+
+    def clear_use(self, phone: str, service: str) -> None:
+        with self._transaction() as db:
+            db.execute('DELETE FROM service_usage WHERE phone = ? AND service = ?', (phone, service))
+
+    def close(self) -> None:
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT``, rolled back on error."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+BACKENDS = {
+    'memory': MemoryStateBackend,
+    'sqlite': SQLiteStateBackend,
+}
+
+
+def create_state_backend(name: Optional[str] = 'memory', **options) -> StateBackend:
+    """Return a state backend by name; ``options`` go to its constructor."""
+    if name is None:
+        name = 'memory'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown state backend: {name}")
+    return BACKENDS[name](**options)
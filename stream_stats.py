@@ -0,0 +1,159 @@
+"""Constant-memory streaming statistics (P² quantiles and EWMA)."""
+
+import math
+import threading
+from typing import Dict, List, Optional, Sequence
+
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class P2Quantile:
+    """P² single-quantile estimator (Jain & Chlamtac, 1985).
+
+    Tracks one quantile with five markers: O(1) memory and O(1) per update.
+    """
+
+    def __init__(self, q: float):
+        self.q = q
+        self._initial: List[float] = []
+        self._heights: List[float] = []
+        self._positions: List[float] = []
+        self._desired: List[float] = []
+        self._increments = [0.0, q / 2, q, (1 + q) / 2, 1.0]
+
+    def add(self, x: float) -> None:
+        if not self._heights:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+                self._positions = [0.0, 1.0, 2.0, 3.0, 4.0]
+                q = self.q
+                self._desired = [0.0, 2 * q, 4 * q, 2 + 2 * q, 4.0]
+                self._initial = []
+            return
+
+        h, n = self._heights, self._positions
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while k < 3 and x >= h[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not h[i - 1] < candidate < h[i + 1]:
+                    candidate = h[i] + step * (h[i + step] - h[i]) / (n[i + step] - n[i])
+                h[i] = candidate
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        h, n = self._heights, self._positions
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> float:
+        """Current estimate (exact while fewer than five samples were seen)."""
+        if self._heights:
+            return self._heights[2]
+        if not self._initial:
+            return 0.0
+        ordered = sorted(self._initial)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(self.q * len(ordered)) - 1))]
+
+
+class EWMA:
+    """Exponentially weighted moving average."""
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def add(self, x: float) -> None:
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+
+
+class StreamStats:
+    """Count, mean, min/max, EWMA and P² quantiles of one stream."""
+
+    def __init__(self, quantiles: Sequence[float] = DEFAULT_QUANTILES, alpha: float = 0.1):
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.ewma = EWMA(alpha)
+        self.quantiles = {q: P2Quantile(q) for q in quantiles}
+        self._lock = threading.Lock()
+
+    def add(self, x: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += x
+            self.min = x if self.min is None else min(self.min, x)
+            self.max = x if self.max is None else max(self.max, x)
+            self.ewma.add(x)
+            for estimator in self.quantiles.values():
+                estimator.add(x)
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            return self.quantiles[q].value()
+
+    def snapshot(self) -> Dict[str, float]:
+        """O(1) summary: count, mean, min, max, ewma and p50/p95/p99."""
+        with self._lock:
+            result = {
+                'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'min': self.min or 0.0,
+                'max': self.max or 0.0,
+                'ewma': self.ewma.value or 0.0,
+            }
+            for q, estimator in self.quantiles.items():
+                result[f'p{q * 100:g}'] = estimator.value()
+            return result
+
+
+class KeyedStreamStats:
+    """StreamStats per key (e.g. service) plus an overall aggregate."""
+
+    ALL = '*'
+
+    def __init__(self, quantiles: Sequence[float] = DEFAULT_QUANTILES, alpha: float = 0.1):
+        self._quantiles = quantiles
+        self._alpha = alpha
+        self._streams: Dict[str, StreamStats] = {self.ALL: StreamStats(quantiles, alpha)}
+        self._lock = threading.Lock()
+
+    def add(self, key: Optional[str], x: float) -> None:
+        stream = self._streams.get(key)
+        if stream is None and key is not None:
+            with self._lock:
+                stream = self._streams.setdefault(key, StreamStats(self._quantiles, self._alpha))
+        if stream is not None:
+            stream.add(x)
+        self._streams[self.ALL].add(x)
+
+    def get(self, key: str = ALL) -> Optional[StreamStats]:
+        return self._streams.get(key)
+
+    def snapshot(self, key: str = ALL) -> Dict[str, float]:
+        stream = self._streams.get(key)
+        return stream.snapshot() if stream else StreamStats(self._quantiles).snapshot()
+
+    def snapshot_all(self) -> Dict[str, Dict[str, float]]:
+        return {key: stream.snapshot() for key, stream in list(self._streams.items())}
@@ -0,0 +1,73 @@
+"""Refunds after a sale: close_activation must take the sale back out of the stats."""
+
+import logging
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A server with two fake modems, working in a temporary directory."""
+    monkeypatch.chdir(tmp_path)  # State, history and logs stay out of the repo
+    monkeypatch.syspath_prepend(REPO_DIR)
+    logging.disable(logging.CRITICAL)
+    from benchmark import make_server
+
+    server = make_server(2)
+    yield server
+    server.stop()
+    server.api_logger.close()
+    logging.disable(logging.NOTSET)
+
+
+def sell(server):
+    from benchmark import get_number_request
+
+    with server.app.test_request_context('/', method='POST'):
+        from flask import g
+
+        server.handle_get_number(get_number_request('wa'))
+        return g.response_payload['activationId']
+
+
+def finish(server, activation_id, status):
+    with server.app.test_request_context('/', method='POST'):
+        from flask import g
+
+        server.handle_finish_activation({'activationId': activation_id, 'status': status})
+        return g.response_payload
+
+
+def test_refund_after_sale_reverses_stats_and_earnings(server):
+    activation_id = sell(server)
+    assert finish(server, activation_id, 3) == {'status': 'SUCCESS'}
+    assert server.stats['completed_activations'] == 1
+    assert server.stats['total_earnings'] == 10.0
+    assert server.activity.today_earnings() == {'643': 10.0}
+
+    assert finish(server, activation_id, 5) == {'status': 'SUCCESS'}
+    assert server.stats['completed_activations'] == 0
+    assert server.stats['refunded_activations'] == 1
+    assert server.stats['total_earnings'] == 0.0
+    assert server.activity.today_earnings() == {'643': 0.0}
+    outcomes = server.get_service_dashboard()['wa']
+    assert outcomes['completed'] == 0
+    assert outcomes['refunded'] == 1
+
+    # A repeated refund changes nothing
+    assert finish(server, activation_id, 5) == {'status': 'SUCCESS'}
+    assert server.stats['refunded_activations'] == 1
+    assert server.stats['total_earnings'] == 0.0
+
+
+def test_refund_of_unsold_activation_keeps_other_sales(server):
+    sold, refunded = sell(server), sell(server)
+    finish(server, sold, 3)
+    finish(server, refunded, 5)
+    assert server.stats['completed_activations'] == 1
+    assert server.stats['total_earnings'] == 10.0
+    assert server.stats['refunded_activations'] == 1
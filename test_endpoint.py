@@ -1,3 +1,13 @@
+"""Manual smoke test of an agent endpoint: GET_SERVICES, GET_NUMBER, FINISH_ACTIVATION, PUSH_SMS.
+
+Usage:
+    python test_endpoint.py [--url http://127.0.0.1:5000/] [--key KEY] [--service wa]
+
+The URL defaults to the local agent (server_port from config) and the key to
+smshub_api_key from config. For load and protocol checks use fake_hub.py.
+"""
+
+import argparse
 import requests
 import json
 import logging
@@ -6,83 +16,61 @@ import time
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def test_get_services():
-    url = "https://fzn84ln.localto.net/"  # Note the trailing slash
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "SMSHubAgent/1.0",
-        "Accept-Encoding": "gzip",
-        "localtonet-skip-warning": "true"  # Added to bypass warning page
-    }
-    data = {
-        "action": "GET_SERVICES",
-        "key": "15431U1ea5e5b53572512438b03fbe8f96fa10"  # Exact key from screenshot
-    }
+HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "SMSHubAgent/1.0",
+    "Accept-Encoding": "gzip",
+    "localtonet-skip-warning": "true"  # Added to bypass warning page
+}
+
 
+def post(url: str, data: dict, verify: bool = True):
+    """POST one protocol request and log the exchange."""
     try:
         logger.info(f"Making request to {url}")
-        logger.info(f"Headers: {headers}")
+        logger.info(f"Headers: {HEADERS}")
         logger.info(f"Data: {data}")
-        
+
         response = requests.post(
             url,
-            headers=headers,
+            headers=HEADERS,
             json=data,
-            verify=False
+            verify=verify,
+            timeout=10
         )
-        
+
         logger.info(f"Response status code: {response.status_code}")
         logger.info(f"Response headers: {dict(response.headers)}")
         logger.info(f"Response content: {response.text}")
-        
+
         return response.json()
     except Exception as e:
         logger.error(f"Error making request: {e}")
         return None
 
-def test_get_number():
+
+def check_get_services(url: str, key: str, verify: bool = True):
+    return post(url, {"action": "GET_SERVICES", "key": key}, verify)
+
+
+def check_get_number(url: str, key: str, service: str = "wa", country: str = "usaphysical",
+                    operator: str = "physic", verify: bool = True):
     """Test GET_NUMBER endpoint."""
-    url = "https://fzn84ln.localto.net/"
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "SMSHubAgent/1.0",
-        "Accept-Encoding": "gzip",
-        "localtonet-skip-warning": "true"
-    }
+    logger.info("\nTesting GET_NUMBER endpoint")
     data = {
         "action": "GET_NUMBER",
-        "key": "1543IU7eA5e5b5357251243Bb03fbe8f96fa10",
-        "country": "russia",
-        "operator": "any",
-        "service": "vk",
+        "key": key,
+        "country": country,
+        "operator": operator,
+        "service": service,
         "sum": 10.00,  # Price in rubles
         "currency": 643,  # 643 is the code for RUB
         "exceptionPhoneSet": []  # Optional list of phone numbers to exclude
     }
+    return post(url, data, verify)
 
-    try:
-        logger.info(f"\nTesting GET_NUMBER endpoint")
-        logger.info(f"Making request to {url}")
-        logger.info(f"Headers: {headers}")
-        logger.info(f"Data: {data}")
-        
-        response = requests.post(
-            url,
-            headers=headers,
-            json=data,
-            verify=False
-        )
-        
-        logger.info(f"Response status code: {response.status_code}")
-        logger.info(f"Response headers: {dict(response.headers)}")
-        logger.info(f"Response content: {response.text}")
-        
-        return response.json()
-    except Exception as e:
-        logger.error(f"Error making request: {e}")
-        return None
 
-def test_finish_activation(activation_id: int, status: int = 3):
+def check_finish_activation(url: str, key: str, activation_id: int, status: int = 3, verify: bool = True):
     """Test FINISH_ACTIVATION endpoint.
     Status codes:
     1 - Do not provide for this service
@@ -90,123 +78,88 @@ def test_finish_activation(activation_id: int, status: int = 3):
     4 - Cancelled
     5 - Refunded
     """
-    url = "https://fzn84ln.localto.net/"
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "SMSHubAgent/1.0",
-        "Accept-Encoding": "gzip",
-        "localtonet-skip-warning": "true"
-    }
+    logger.info("\nTesting FINISH_ACTIVATION endpoint")
     data = {
         "action": "FINISH_ACTIVATION",
-        "key": "1543IU7eA5e5b5357251243Bb03fbe8f96fa10",
+        "key": key,
         "activationId": activation_id,
         "status": status
     }
+    return post(url, data, verify)
 
-    try:
-        logger.info(f"\nTesting FINISH_ACTIVATION endpoint")
-        logger.info(f"Making request to {url}")
-        logger.info(f"Headers: {headers}")
-        logger.info(f"Data: {data}")
-        
-        response = requests.post(
-            url,
-            headers=headers,
-            json=data,
-            verify=False
-        )
-        
-        logger.info(f"Response status code: {response.status_code}")
-        logger.info(f"Response headers: {dict(response.headers)}")
-        logger.info(f"Response content: {response.text}")
-        
-        return response.json()
-    except Exception as e:
-        logger.error(f"Error making request: {e}")
-        return None
 
-def test_push_sms(phone: str = None, text: str = None):
+def check_push_sms(url: str, key: str, phone: str = None, text: str = None, verify: bool = True):
     """Test PUSH_SMS endpoint.
     This simulates receiving an SMS and forwarding it to SMSHub.
     """
-    url = "https://fzn84ln.localto.net/"  # Local testing server
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "SMSHubAgent/1.0",
-        "Accept-Encoding": "gzip",
-        "localtonet-skip-warning": "true"
-    }
-    
     # If no phone provided, use the last one we got from GET_NUMBER
     if not phone:
         phone = "79281234567"  # Example number with country code
-    
+
     # If no text provided, use a test message
     if not text:
         text = "VK: 123456 - your verification code"
-        
+
+    logger.info("\nTesting PUSH_SMS endpoint")
     data = {
         "action": "PUSH_SMS",
-        "key": "1543IU7eA5e5b5357251243Bb03fbe8f96fa10",  # Local testing key
+        "key": key,
         "smsId": int(time.time()),  # Use timestamp as SMS ID
         "phone": int(phone.replace("+", "").replace("-", "")),  # Clean number and convert to int
         "phoneFrom": "VK",  # Example sender name
         "text": text
     }
+    return post(url, data, verify)
 
-    try:
-        logger.info(f"\nTesting PUSH_SMS endpoint")
-        logger.info(f"Making request to {url}")
-        logger.info(f"Headers: {headers}")
-        logger.info(f"Data: {data}")
-        
-        response = requests.post(
-            url,
-            headers=headers,
-            json=data,
-            verify=False
-        )
-        
-        logger.info(f"Response status code: {response.status_code}")
-        logger.info(f"Response headers: {dict(response.headers)}")
-        logger.info(f"Response content: {response.text}")
-        
-        return response.json()
-    except Exception as e:
-        logger.error(f"Error making request: {e}")
-        return None
 
-if __name__ == "__main__":
+def main():
+    from config import config
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=f"http://127.0.0.1:{config.get('server_port', 5000)}/",
+                        help='agent endpoint (note the trailing slash)')
+    parser.add_argument('--key', default=config.get('smshub_api_key'), help='protocol key')
+    parser.add_argument('--service', default='wa')
+    parser.add_argument('--country', default='usaphysical')
+    parser.add_argument('--operator', default='physic')
+    parser.add_argument('--insecure', action='store_true', help='skip TLS verification (tunnels)')
+    args = parser.parse_args()
+    verify = not args.insecure
+
     # Test GET_SERVICES
     print("\n=== Testing GET_SERVICES ===")
-    result = test_get_services()
+    result = check_get_services(args.url, args.key, verify)
     if result:
         print("\nGET_SERVICES Response:")
         print(json.dumps(result, indent=2))
 
     # Test GET_NUMBER
     print("\n=== Testing GET_NUMBER ===")
-    result = test_get_number()
+    result = check_get_number(args.url, args.key, args.service, args.country, args.operator, verify)
     phone_number = None
     if result:
         print("\nGET_NUMBER Response:")
         print(json.dumps(result, indent=2))
-        phone_number = str(result.get('number'))
-        
+        if result.get('number'):
+            phone_number = str(result.get('number'))
+
         # If we got a number, test finishing the activation
         activation_id = result.get('activationId')
         if activation_id:
             print("\n=== Testing FINISH_ACTIVATION ===")
-            finish_result = test_finish_activation(activation_id)
+            finish_result = check_finish_activation(args.url, args.key, activation_id, verify=verify)
             if finish_result:
                 print("\nFINISH_ACTIVATION Response:")
                 print(json.dumps(finish_result, indent=2))
-    
+
     # Test PUSH_SMS using the number we got
     if phone_number:
         print("\n=== Testing PUSH_SMS ===")
-        sms_result = test_push_sms(phone_number)
+        sms_result = check_push_sms(args.url, args.key, phone_number, verify=verify)
         if sms_result:
             print("\nPUSH_SMS Response:")
-            print(json.dumps(sms_result, indent=2)) 
\ No newline at end of file
+            print(json.dumps(sms_result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Fixed-size ring buffers of time-bucketed counters."""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Activity events tracked per service
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+REFUNDED = 'refunded'
+NO_NUMBERS = 'no_numbers'
+EARNINGS_PREFIX = 'earnings:'  # + ISO-4217 currency code
+
+
+class RingCounter:
+    """``size`` buckets of ``width`` seconds; older buckets are overwritten in place.
+
+    With ``local_time`` bucket boundaries follow the local clock (the UTC
+    offset of each timestamp, so DST changes are honoured) and hour buckets
+    line up with local midnight.
+    """
+
+    def __init__(self, width: int, size: int, local_time: bool = False):
+        self.width = width
+        self.size = size
+        self.local_time = local_time
+        self._epochs: List[Optional[int]] = [None] * size  # absolute bucket index held by each slot
+        self._values: List[Dict[Hashable, float]] = [{} for _ in range(size)]
+        self._latest = 0
+        self._lock = threading.Lock()
+
+    def _index(self, ts: float) -> int:
+        if self.local_time:
+            ts += time.localtime(ts).tm_gmtoff
+        return int(ts // self.width)
+
+    def add(self, key: Hashable, amount: float = 1, ts: Optional[float] = None) -> None:
+        index = self._index(time.time() if ts is None else ts)
+        slot = index % self.size
+        with self._lock:
+            if index <= self._latest - self.size:
+                return  # Older than the ring covers
+            self._latest = max(self._latest, index)
+            if self._epochs[slot] != index:
+                self._epochs[slot] = index
+                self._values[slot] = {}
+            values = self._values[slot]
+            values[key] = values.get(key, 0) + amount
+
+    def total(self, key: Hashable, since: float, until: Optional[float] = None) -> float:
+        """Sum of ``key`` over buckets starting in [since, until]; O(size)."""
+        first = self._index(since)
+        last = self._index(time.time() if until is None else until)
+        result = 0
+        with self._lock:
+            for epoch, values in zip(self._epochs, self._values):
+                if epoch is not None and first <= epoch <= last:
+                    result += values.get(key, 0)
+        return result
+
+    def totals(self, since: float, until: Optional[float] = None) -> Dict[Hashable, float]:
+        """Sums of every key over buckets starting in [since, until]; O(size x keys)."""
+        first = self._index(since)
+        last = self._index(time.time() if until is None else until)
+        result: Dict[Hashable, float] = {}
+        with self._lock:
+            for epoch, values in zip(self._epochs, self._values):
+                if epoch is not None and first <= epoch <= last:
+                    for key, value in values.items():
+                        result[key] = result.get(key, 0) + value
+        return result
+
+    def series(self, key: Hashable, count: int, now: Optional[float] = None) -> List[float]:
+        """Per-bucket values of ``key`` for the last ``count`` buckets, oldest first."""
+        last = self._index(time.time() if now is None else now)
+        count = min(count, self.size)
+        result = []
+        with self._lock:
+            for index in range(last - count + 1, last + 1):
+                slot = index % self.size
+                result.append(self._values[slot].get(key, 0) if self._epochs[slot] == index else 0)
+        return result
+
+    def buckets(self) -> List[Tuple[int, Dict[Hashable, float]]]:
+        """(bucket index, values) of every non-empty bucket."""
+        with self._lock:
+            return [(epoch, dict(values)) for epoch, values in zip(self._epochs, self._values)
+                    if epoch is not None and values]
+
+    def restore(self, index: int, values: Dict[Hashable, float]) -> None:
+        """Add a bucket saved by ``buckets``; ignored if the ring has moved past it."""
+        slot = index % self.size
+        with self._lock:
+            if index <= self._latest - self.size or (self._epochs[slot] or 0) > index:
+                return
+            self._latest = max(self._latest, index)
+            if self._epochs[slot] != index:
+                self._epochs[slot] = index
+                self._values[slot] = {}
+            bucket = self._values[slot]
+            for key, value in values.items():
+                bucket[key] = bucket.get(key, 0) + value
+
+
+class ActivityStats:
+    """Per-service activity in per-minute and per-hour rings.
+
+    Keys are ``(service, event)``; every event is also counted under the
+    service ``'*'`` for fleet-wide totals. ``save``/``load`` carry the rings
+    across restarts.
+    """
+
+    ALL = '*'
+
+    def __init__(self, minutes: int = 120, hours: int = 168):
+        self.minutes = RingCounter(60, minutes)
+        self.hours = RingCounter(3600, hours, local_time=True)
+
+    def record(self, service: Optional[str], event: str, amount: float = 1,
+               ts: Optional[float] = None) -> None:
+        for key in ((service, event), (self.ALL, event)) if service else ((self.ALL, event),):
+            self.minutes.add(key, amount, ts)
+            self.hours.add(key, amount, ts)
+
+    def _ring_for(self, seconds: float) -> RingCounter:
+        if seconds <= self.minutes.width * self.minutes.size:
+            return self.minutes
+        return self.hours
+
+    def today_earnings(self) -> Dict[str, float]:
+        """Earnings since local midnight by currency."""
+        now = time.time()
+        local = time.localtime(now)
+        midnight = time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1))
+        return {event[len(EARNINGS_PREFIX):]: value
+                for (service, event), value in self.hours.totals(midnight, now).items()
+                if service == self.ALL and event.startswith(EARNINGS_PREFIX)}
+
+    def service_totals(self, seconds: float) -> Dict[str, Dict[str, float]]:
+        """{service: {event: total}} over the trailing window."""
+        now = time.time()
+        result: Dict[str, Dict[str, float]] = {}
+        for (service, event), value in self._ring_for(seconds).totals(now - seconds + 1, now).items():
+            if service != self.ALL:
+                result.setdefault(service, {})[event] = value
+        return result
+
+    def hourly(self, event: str, hours: int = 24, service: str = ALL) -> List[float]:
+        """Per-hour totals of ``event`` for the last ``hours`` hours, oldest first."""
+        return self.hours.series((service, event), hours)
+
+    @property
+    def span(self) -> Tuple[int, int]:
+        """Seconds covered by the (minute, hour) rings."""
+        return self.minutes.width * self.minutes.size, self.hours.width * self.hours.size
+
+    def save(self, path: str) -> None:
+        """Write both rings to ``path`` (temp file + rename)."""
+        snapshot = {'saved_at': time.time()}
+        for name, ring in (('minutes', self.minutes), ('hours', self.hours)):
+            snapshot[name] = {
+                'width': ring.width,
+                'size': ring.size,
+                'buckets': [[index, [[service, event, value] for (service, event), value in values.items()]]
+                            for index, values in ring.buckets()],
+            }
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error saving activity stats: {e}")
+
+    def load(self, path: str) -> float:
+        """Restore rings saved by ``save``; returns when they were saved (0 if not at all)."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0.0
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading activity stats: {e}")
+            return 0.0
+        for name, ring in (('minutes', self.minutes), ('hours', self.hours)):
+            saved = snapshot.get(name) or {}
+            if saved.get('width') != ring.width:
+                continue
+            for index, values in saved.get('buckets', []):
+                ring.restore(index, {(service, event): value for service, event, value in values})
+        return float(snapshot.get('saved_at') or 0)
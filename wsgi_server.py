@@ -0,0 +1,108 @@
+"""Production WSGI serving for the SMS Hub agent."""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from waitress.server import create_server
+    from waitress import wasyncore
+except ImportError:  # Optional until requirements are reinstalled
+    create_server = None
+    wasyncore = None
+
+PRODUCTION_DEFAULTS = {
+    'threads': 8,               # Worker threads handling requests
+    'connection_limit': 100,    # Stop accepting beyond this many open connections
+    'channel_timeout': 30,      # Seconds an idle keep-alive connection stays open
+    'backlog': 1024,            # Listen backlog for bursts
+    'drain_timeout': 10,        # Seconds to let in-flight requests finish on stop
+}
+
+
+def production_available() -> bool:
+    """Whether the production server dependency is installed."""
+    return create_server is not None
+
+
+class ProductionServer:
+    """Multi-threaded keep-alive WSGI server (waitress) with graceful drain."""
+
+    def __init__(self, app, host: str, port: int, options: Optional[Dict] = None):
+        if not production_available():
+            raise RuntimeError("waitress is not installed")
+        self.options = dict(PRODUCTION_DEFAULTS)
+        self.options.update(options or {})
+        self.server = create_server(
+            app,
+            host=host,
+            port=port,
+            threads=self.options['threads'],
+            connection_limit=self.options['connection_limit'],
+            channel_timeout=self.options['channel_timeout'],
+            backlog=self.options['backlog'],
+            ident='SMSHubAgent',
+        )
+        self._serving = False  # The asyncore loop is running in run()
+
+    @property
+    def port(self) -> int:
+        """The port actually bound (useful when started on port 0)."""
+        return self.server.effective_port
+
+    def run(self):
+        """Serve until drain() is called."""
+        logger.info(f"Production server listening on {self.server.effective_host}:{self.port} "
+                    f"({self.options['threads']} threads, limit {self.options['connection_limit']} connections)")
+        self._serving = True
+        try:
+            self.server.run()
+        finally:
+            self._serving = False
+
+    def _in_loop(self, fn, timeout: float = 5.0) -> None:
+        """Run ``fn`` on the server's own loop thread (the asyncore map is not thread-safe)."""
+        if not self._serving:
+            fn()
+            return
+        done = threading.Event()
+
+        def thunk():
+            try:
+                fn()
+            finally:
+                done.set()
+
+        self.server.trigger.pull_trigger(thunk)
+        if not done.wait(timeout):
+            logger.warning("Server loop did not run the shutdown step in time")
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Stop accepting connections, wait for in-flight requests, then close.
+
+        Returns True if all requests finished within the timeout.
+        """
+        timeout = self.options['drain_timeout'] if timeout is None else timeout
+        dispatcher = self.server.task_dispatcher
+        # Close the listening socket (not the trigger) so new connections are refused
+        # instead of queuing in the backlog
+        self._in_loop(lambda: wasyncore.dispatcher.close(self.server))
+
+        deadline = time.time() + timeout
+        drained = False
+        while time.time() < deadline:
+            with dispatcher.lock:
+                drained = not dispatcher.queue and dispatcher.active_count == 0
+            if drained:
+                break
+            time.sleep(0.05)
+        if not drained:
+            logger.warning("Server drain timed out with requests still in flight")
+
+        dispatcher.shutdown(timeout=max(0.0, deadline - time.time()))
+        # Closing every channel (and the trigger) lets the asyncore loop in run() return
+        self._in_loop(lambda: wasyncore.close_all(self.server._map))
+        return drained